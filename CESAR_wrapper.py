@@ -4,6 +4,7 @@
 Retrieve exons from the query genome.
 """
 import argparse
+import json
 import os
 import sys
 import subprocess
@@ -12,16 +13,24 @@ import math
 from datetime import datetime as dt
 from re import finditer, IGNORECASE
 from collections import defaultdict
-import ctypes
+from concurrent.futures import ThreadPoolExecutor
 from operator import and_
 from functools import reduce
+import numpy as np
 from twobitreader import TwoBitFile
+from modules.chain_coords_converter import chain_coords_converter
+from modules.extract_subchain import extract_subchain_blocks
 from modules.common import parts, bed_extract_id_text
 from modules.common import bed_extract_id, chain_extract_id
 from modules.common import make_cds_track
 from modules.common import eprint
 from modules.common import die
 from modules.common import flatten
+from modules.cesar_cache import CesarCache
+from modules.cesar_cache import get_cache_key
+from modules.cesar_cache import set_query_ids
+from modules.job_profiler import JobsProfiler
+from modules.ref_exons_store import RefExonsStore
 from modules.inact_mut_check import inact_mut_check
 from modules.parse_cesar_output import parse_cesar_out
 from constants import Constants
@@ -44,27 +53,7 @@ ERR_CODE_FRAGM_ERR = 2
 two_bit_templ = "/projects/hillerlab/genome/gbdb-HL/{0}/{0}.2bit"
 chain_alias_template = "/projects/hillerlab/genome/gbdb-HL/{0}/lastz/vs_{1}/axtChain/{0}.{1}.allfilled.chain.gz"
 
-# connect shared lib; define input and output data types
-chain_coords_conv_lib_path = os.path.join(
-    LOCATION, "modules", "chain_coords_converter_slib.so"
-)
-ch_lib = ctypes.CDLL(chain_coords_conv_lib_path)
-ch_lib.chain_coords_converter.argtypes = [
-    ctypes.c_char_p,
-    ctypes.c_int,
-    ctypes.c_int,
-    ctypes.POINTER(ctypes.c_char_p),
-]
-ch_lib.chain_coords_converter.restype = ctypes.POINTER(ctypes.c_char_p)
-
-# connect extract subchain lib
-extract_subchain_lib_path = os.path.join(
-    LOCATION, "modules", "extract_subchain_slib.so"
-)
 DEFAULT_CESAR = os.path.join(LOCATION, "CESAR2.0", "cesar")
-ex_lib = ctypes.CDLL(extract_subchain_lib_path)
-ex_lib.extract_subchain.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p]
-ex_lib.extract_subchain.restype = ctypes.POINTER(ctypes.c_char_p)
 
 # blosum matrix address
 BLOSUM_FILE = os.path.join(LOCATION, "supply", "BLOSUM62.txt")
@@ -276,6 +265,23 @@ def parse_args():
         help="Automatically mask all inactivating mutations in first 10 percent of "
              "the reading frame, ignoring ATG codons distribution."
     )
+    app.add_argument(
+        "--cesar_cache",
+        default=None,
+        help="Directory with cached CESAR output, reuse output for the same CESAR input"
+    )
+    app.add_argument(
+        "--ref_exons",
+        default=None,
+        help="Reference exons store of the reference pack, read exons from there "
+             "instead of the target 2bit file"
+    )
+    app.add_argument(
+        "--profile_dir",
+        default=None,
+        help="Save cProfile output to this directory if the job is sampled, "
+             "TOGA_PROFILE_DIR environment variable is used if not set"
+    )
     app.add_argument(
         "--temp_dir",
         default=None,
@@ -314,10 +320,12 @@ def read_bed(gene, bed_file):
     except OSError:
         # h5df cannot open this file: this is likely a text file
         bed_track_raw = bed_extract_id_text(bed_file, gene)
-
     # left CDS only
-    bed_track = make_cds_track(bed_track_raw)
+    return parse_bed_track(make_cds_track(bed_track_raw))
 
+
+def parse_bed_track(bed_track):
+    """Parse CDS bed-12 track."""
     # regular parsing of a bed-12 formatted file
     bed_info = bed_track.split("\t")
 
@@ -377,8 +385,11 @@ def find_chain_file(ref_name, chain_arg):
     return chain_path
 
 
-def get_exons(bed_data, t_db):
-    """Extract exons sequences for reference."""
+def get_exons(bed_data, t_db, target_genome=None):
+    """Extract exons sequences for reference.
+
+    target_genome: opened 2bit file, to extract many transcripts without reopening it.
+    """
     exons_raw = (
         bed_data["blocks"][::-1] if not bed_data["strand"] else bed_data["blocks"]
     )
@@ -399,7 +410,8 @@ def get_exons(bed_data, t_db):
     gene_borders = {_all_positions[0], _all_positions[-1]}
     # extract sequences
     exons_seq = {}  # exon number: sequence dict
-    target_genome = TwoBitFile(get_2bit_path(t_db))  # use 2bitreader library
+    if target_genome is None:
+        target_genome = TwoBitFile(get_2bit_path(t_db))  # use 2bitreader library
     get_chr = bed_data["chrom"]
     try:
         chrom_seq = target_genome[get_chr]
@@ -464,6 +476,57 @@ def get_exons(bed_data, t_db):
     return exons_pos, exons_seq, s_sites, exon_flanks
 
 
+def dump_ref_exons(bed_data, exons_data):
+    """Serialize reference data of the transcript for the reference exons store.
+
+    Stop codons are masked in advance, CESAR-formatted exons
+    are made of the masked exons.
+    """
+    exons_pos, exons_seq, s_sites, exon_flanks = exons_data
+    masked_exons_seq, sec_codons = check_ref_exons(exons_seq, True)
+    cesar_exons = prepare_exons_for_cesar(masked_exons_seq)
+    exons_num = len(exons_seq)
+    ref_exons = {
+        "bed_data": bed_data,
+        "exons_pos": [exons_pos[num] for num in range(exons_num)],
+        "exons_seq": [exons_seq[num] for num in range(exons_num)],
+        "s_sites": s_sites,
+        "exon_flanks": [exon_flanks[num] for num in range(exons_num)],
+        "inframe_stops": masked_exons_seq != exons_seq,
+        "masked_exons_seq": [masked_exons_seq[num] for num in range(exons_num)],
+        "sec_codons": sorted(sec_codons),
+        "cesar_exons": [cesar_exons[num] for num in range(exons_num)],
+    }
+    return json.dumps(ref_exons)
+
+
+def load_ref_exons(ref_exons_store, gene):
+    """Read reference data of the transcript saved in the reference exons store.
+
+    Return None if the transcript is not in the store.
+    """
+    record = RefExonsStore(ref_exons_store).get(gene)
+    if record is None:
+        return None
+    ref_exons = json.loads(record)
+    bed_data = ref_exons["bed_data"]
+    bed_data["blocks"] = [tuple(x) for x in bed_data["blocks"]]
+    exons_pos = {num: tuple(x) for num, x in enumerate(ref_exons["exons_pos"])}
+    exons_seq = dict(enumerate(ref_exons["exons_seq"]))
+    exon_flanks = dict(enumerate(ref_exons["exon_flanks"]))
+    verbose(f"Reference data of {gene} is loaded from {ref_exons_store}")
+    return {
+        "bed_data": bed_data,
+        "exons_data": (exons_pos, exons_seq, ref_exons["s_sites"], exon_flanks),
+        "inframe_stops": ref_exons["inframe_stops"],
+        "checked_exons": (
+            dict(enumerate(ref_exons["masked_exons_seq"])),
+            set(ref_exons["sec_codons"]),
+            dict(enumerate(ref_exons["cesar_exons"])),
+        ),
+    }
+
+
 def check_ref_exons(exon_seqs, mask_stops):
     """Check if the reference sequence is correct.
 
@@ -593,58 +656,22 @@ def chain_cut(chain_str, gene_range, gene_flank, extra_flank=0):
     Also add flanks if shift is > 0.
     """
     # need to get genomic region for the gene
-    # also need to translate python data types to C
-    # to call the shared library; I do it 2 times here
-    # for shift = 0 and shifts = 2 (add flanks around gene)
-    c_chain = ctypes.c_char_p(chain_str.encode())
-    c_shift_2 = ctypes.c_int(2)
-    c_shift_0 = ctypes.c_int(0)
-    granges_num = 1
-    c_granges_num = ctypes.c_int(granges_num)  # we need only one grange to analyze
-    granges_arr = (ctypes.c_char_p * (granges_num + 1))()  # granges_num + 1
-    granges_bytes = [gene_range.encode("utf-8")]
-    # need to do this tricks to pass strings array to C
-    granges_arr[:-1] = granges_bytes
-    granges_arr[granges_num] = None
-    raw_ch_conv_s2 = ch_lib.chain_coords_converter(
-        c_chain, c_shift_2, c_granges_num, granges_arr
-    )
-    chain_coords_conv_out_s2 = []  # keep lines here
-    # convert C output to python-readable type
-    for i in range(granges_num + 1):
-        chain_coords_conv_out_s2.append(raw_ch_conv_s2[i].decode("utf-8"))
-    # chain', 'chr5', '+', '137889395', '148245211', 'chr18', '+', '34409342', '44120958
-    chain_data = chain_coords_conv_out_s2[0].split(" ")
-    t_strand = True if chain_data[2] == "+" else False
-    q_strand = True if chain_data[7] == "+" else False
-    t_size = int(chain_data[3])
-    q_size = int(chain_data[8])
-
-    # re-define arrays to avoid segfault
-    c_chain = ctypes.c_char_p(chain_str.encode())
-    granges_arr = (ctypes.c_char_p * (granges_num + 1))()  # granges_num + 1
-    granges_bytes = [gene_range.encode("utf-8")]
-    granges_arr[:-1] = granges_bytes
-    granges_arr[granges_num] = None
-
-    raw_ch_conv_s0 = ch_lib.chain_coords_converter(
-        c_chain, c_shift_0, c_granges_num, granges_arr
-    )
-    chain_coords_conv_out_s0 = []  # keep lines here
-
-    # convert C output to python-readable type
-    for i in range(granges_num + 1):
-        chain_coords_conv_out_s0.append(raw_ch_conv_s0[i].decode("utf-8"))
+    # project it with shift = 2 (add flanks around gene) and shift = 0
+    # the shared library parses the chain once for both
+    gene_start_end = gene_range.split(":")[1].split("-")
+    t_region = (int(gene_start_end[0]), int(gene_start_end[1]))
+    chain_info, q_regions = chain_coords_converter(chain_str, [t_region], shifts=(2, 0))
+    t_size, t_strand, _, _, q_size, q_strand, _, _ = chain_info
+    q_chrom = chain_str.split("\n", 1)[0].split()[7]
     # another approach to detect range
     # sometimes blocks go so far
     # ------------------genegene-------------------
     # block-------------blockblock------------block
 
     # to avoid very huge query sequences program controls it's size
-    search_region_shift_str = range_corrector(
-        chain_coords_conv_out_s2[1].split("\t")[1]
-    )
-    search_region_abs_str = range_corrector(chain_coords_conv_out_s0[1].split("\t")[1])
+    (shift_start, shift_end), (abs_start, abs_end) = q_regions[:, 0].tolist()
+    search_region_shift_str = range_corrector(f"{q_chrom}:{shift_start}-{shift_end}")
+    search_region_abs_str = range_corrector(f"{q_chrom}:{abs_start}-{abs_end}")
 
     chrom = search_region_shift_str.split(":")[0]
     search_reg_shift = [
@@ -676,8 +703,6 @@ def chain_cut(chain_str, gene_range, gene_flank, extra_flank=0):
 
     act_search_range = f"{chrom}:{act_start}-{act_end}"
     # ext_search_range = f"{chrom}:{}-{}"
-    del raw_ch_conv_s0  # not sure if this is necessary
-    del raw_ch_conv_s2  # but just in case
     return (
         act_search_range,
         search_region_shift_str,
@@ -686,67 +711,46 @@ def chain_cut(chain_str, gene_range, gene_flank, extra_flank=0):
 
 
 def extract_subchain(chain_str, search_locus):
-    """Extract subchain containing only the search locus."""
-    # convert python types to C types
-    c_chain = ctypes.c_char_p(chain_str.encode())
-    c_mode = ctypes.c_char_p("q".encode())
-    c_search = ctypes.c_char_p(search_locus.encode())
-    # call the library finally
-    ex_out_raw = ex_lib.extract_subchain(c_chain, c_mode, c_search)
-    ex_out = []
-
-    for elem in ex_out_raw:
-        line = elem.decode("utf-8")
-        if line == "END":
-            break
-        ex_out.append(line)
-
-    blocks = [[int(x) for x in elem.split()] for elem in ex_out]
+    """Extract subchain containing only the search locus.
+
+    Return int64 array of [t_start, t_end, q_start, q_end] blocks.
+    """
+    blocks = extract_subchain_blocks(chain_str, search_locus)
     if len(blocks) == 0:  # die an show chain id
         chain_id = chain_str.split("\n")[0].split()[-1]
         die(f"Error! No overlapping blocks for chain {chain_id} found!", 1)
-    del ex_out_raw  # maybe it's necessary
     return blocks
 
 
 def orient_blocks(subchain_blocks_raw, chain_data):
-    """Create block num: coordinates dict.
+    """Orient blocks in correct direction, add interblock regions.
 
-    Orient them in correct direction.
-    Add interblock regions, like block 1_2 between blocks 1 and 2.
+    Return array of [t_start, t_end, q_start, q_end] rows, ordered
+    as in block_id: block 0, interblock 0_1, block 1, 1_2, ...
     """
-    block_ranges = {}
     t_strand, t_size, q_strand, q_size = chain_data
-
-    for i in range(len(subchain_blocks_raw)):
-        i_block = subchain_blocks_raw[i]
-        t_start = i_block[0] if t_strand else t_size - i_block[1]
-        t_end = i_block[1] if t_strand else t_size - i_block[0]
-        q_start = i_block[2] if q_strand else q_size - i_block[3]
-        q_end = i_block[3] if q_strand else q_size - i_block[2]
-        block_ranges[str(i)] = (
-            min(t_start, t_end),
-            max(t_start, t_end),
-            min(q_start, q_end),
-            max(q_start, q_end),
+    raw = subchain_blocks_raw
+    t_starts = raw[:, 0] if t_strand else t_size - raw[:, 1]
+    t_ends = raw[:, 1] if t_strand else t_size - raw[:, 0]
+    q_starts = raw[:, 2] if q_strand else q_size - raw[:, 3]
+    q_ends = raw[:, 3] if q_strand else q_size - raw[:, 2]
+    blocks = np.column_stack(
+        (
+            np.minimum(t_starts, t_ends),
+            np.maximum(t_starts, t_ends),
+            np.minimum(q_starts, q_ends),
+            np.maximum(q_starts, q_ends),
         )
-
+    )
     # if there is only one block (weird but possible) --> no gaps between blocks
-    if len(block_ranges) == 1:
-        return block_ranges
-
-    # make interblock gaps
-    blocks_num = len(block_ranges.keys())
-    for i in range(1, blocks_num):
-        prev = block_ranges[str(i - 1)]
-        current = block_ranges[str(i)]
-        # connect xEnd_prev to xStart_current
-        inter_t_start = prev[1] if t_strand else prev[0]
-        inter_t_end = current[0] if t_strand else current[1]
-        inter_q_start = prev[3] if q_strand else prev[2]
-        inter_q_end = current[2] if q_strand else current[3]
-        interblock_data = (inter_t_start, inter_t_end, inter_q_start, inter_q_end)
-        block_ranges[f"{i - 1}_{i}"] = interblock_data
+    block_ranges = np.empty((2 * len(blocks) - 1, 4), dtype=np.int64)
+    block_ranges[0::2] = blocks
+    # make interblock gaps: connect xEnd_prev to xStart_current
+    prev, current = blocks[:-1], blocks[1:]
+    block_ranges[1::2, 0] = prev[:, 1] if t_strand else prev[:, 0]
+    block_ranges[1::2, 1] = current[:, 0] if t_strand else current[:, 1]
+    block_ranges[1::2, 2] = prev[:, 3] if q_strand else prev[:, 2]
+    block_ranges[1::2, 3] = current[:, 2] if q_strand else current[:, 3]
     return block_ranges
 
 
@@ -757,150 +761,170 @@ def intersect_ranges(range_1, range_2):
     return min(range_1[1], range_2[1]) - max(range_1[0], range_2[0])
 
 
-def get_aa_ex_cov(exon_range, i_block_coords):
-    """Get number of bases covered in target and query."""
+def get_aa_ex_cov(exon_range, block_coords, interblock):
+    """Get number of bases covered in target and query.
+
+    block_coords: array of [t_start, t_end, q_start, q_end] of intersected blocks.
+    interblock: bool array, True for interblock regions.
+    """
     # deal with t_cov first
-    # chain blocks without _ in name - real blocks, len in T == len in Q
-    # blocks with _ -> not aligned
-    # will get exon len + flanks - len of blocks with _
+    # chain blocks - real blocks, len in T == len in Q
+    # interblock regions -> not aligned
+    # will get exon len + flanks - len of interblock regions
     flanked_exon_len = max(exon_range) - min(exon_range)
-    exon_range = (min(exon_range), max(exon_range))
-    interblock_reg = [x[1] for x in i_block_coords if "_" in x[0]]
-    if len(interblock_reg) == 0:
+    exon_start, exon_end = min(exon_range), max(exon_range)
+    if not interblock.any():
         # single block covers the exon + flanks: ideal case
         return flanked_exon_len, flanked_exon_len, flanked_exon_len
-    # select blocks, ignore
-    cov_blocks_not_trimmed = [x[1] for x in i_block_coords if "_" not in x[0]]
-    t_cov_blocks_trimmed = []
+    t_lo = np.minimum(block_coords[:, 0], block_coords[:, 1])
+    t_hi = np.maximum(block_coords[:, 0], block_coords[:, 1])
+    start_within = (exon_start <= t_lo) & (t_lo <= exon_end)
+    end_within = (exon_start <= t_hi) & (t_hi <= exon_end)
     # trim blocks | convert this:
     # --------exonexonexonexonexon--------
     # --blockclobk===blockblock===========
     # to:
     # --------exonexonexonexonexon--------
     # --------block==blockblock===========
-    for block in cov_blocks_not_trimmed:
-        t_start, t_end = block[0], block[1]
-        t_block_vals = (t_start, t_end)
-        t_block = [min(t_block_vals), max(t_block_vals)]
-        start_within = exon_range[0] <= t_block[0] <= exon_range[1]
-        end_within = exon_range[0] <= t_block[1] <= exon_range[1]
-        if not start_within and not end_within:
-            # something impossible
-            continue
-            # die("Impossible block configuration in get_aa_ex_cov!")
-        if start_within and end_within:
-            t_cov_blocks_trimmed.append(t_block)
-            continue
-        elif not start_within:
-            t_block[0] = exon_range[0]
-            t_cov_blocks_trimmed.append(t_block)
-            continue
-        else:
-            t_block[1] = exon_range[1]
-            t_cov_blocks_trimmed.append(t_block)
-            continue
-    t_cov = sum([abs(x[1] - x[0]) for x in t_cov_blocks_trimmed])
-    t_cov = t_cov if t_cov > 0 else 0
-
-    # now compute q_cov
-    q_blocks_within = []
-    for block in interblock_reg:
-        t_start, t_end = block[0], block[1]
-        q_start, q_end = block[2], block[3]
-        q_block_vals = (q_start, q_end)
-        t_block_vals = (t_start, t_end)
-        t_block = [min(t_block_vals), max(t_block_vals)]
-        q_block = [min(q_block_vals), max(q_block_vals)]
-        start_within = exon_range[0] <= t_block[0] <= exon_range[1]
-        end_within = exon_range[0] <= t_block[1] <= exon_range[1]
-        if not start_within or not end_within:
-            continue
-        q_blocks_within.append(q_block)
-    q_corr_reg = sum([abs(x[1] - x[0]) for x in q_blocks_within])
+    # blocks with neither start nor end within the exon are impossible: skip them
+    trimmed = ~interblock & (start_within | end_within)
+    t_trim_lo = np.where(start_within, t_lo, exon_start)[trimmed]
+    t_trim_hi = np.where(end_within, t_hi, exon_end)[trimmed]
+    t_cov = int(np.abs(t_trim_hi - t_trim_lo).sum())
+
+    # now compute q_cov: add interblock regions lying within the exon
+    q_within = interblock & start_within & end_within
+    q_corr_reg = int(np.abs(block_coords[q_within, 3] - block_coords[q_within, 2]).sum())
     q_cov = t_cov + q_corr_reg
     q_cov = q_cov if q_cov > 0 else 0
     return flanked_exon_len, t_cov, q_cov
 
 
+def ranges_to_arrays(ranges):
+    """Split (start, end) pairs into arrays of lower and upper bounds."""
+    ranges_arr = np.array(ranges, dtype=np.int64).reshape(-1, 2)
+    return ranges_arr.min(axis=1), ranges_arr.max(axis=1)
+
+
+def find_overlaps(lo, hi, query_lo, query_hi, strict=False):
+    """For each query range, get sorted indexes of ranges it overlaps.
+
+    Chain blocks and interblock regions follow each other, so lo and hi
+    are both sorted in either direction: overlapping ranges are found
+    with binary search. Ranges sharing only a border overlap if not strict.
+    """
+    ranges_num = len(lo)
+    if np.all(lo[1:] >= lo[:-1]) and np.all(hi[1:] >= hi[:-1]):
+        direct = True
+    elif np.all(lo[1:] <= lo[:-1]) and np.all(hi[1:] <= hi[:-1]):
+        direct = False
+        lo, hi = lo[::-1], hi[::-1]
+    else:  # not expected for a chain: check each range
+        overlaps = []
+        for q_lo, q_hi in zip(query_lo.tolist(), query_hi.tolist()):
+            intersect = np.minimum(hi, q_hi) - np.maximum(lo, q_lo)
+            overlaps.append(np.nonzero(intersect > 0 if strict else intersect >= 0)[0])
+        return overlaps
+    firsts = np.searchsorted(hi, query_lo, side="right" if strict else "left")
+    lasts = np.searchsorted(lo, query_hi, side="left" if strict else "right")
+    overlaps = []
+    for first, last, q_lo, q_hi in zip(firsts.tolist(), lasts.tolist(), query_lo.tolist(), query_hi.tolist()):
+        indexes = np.arange(first, max(first, last))
+        if strict:  # empty ranges overlap nothing
+            indexes = indexes[hi[indexes] > lo[indexes]] if q_hi > q_lo else indexes[:0]
+        overlaps.append(indexes if direct else ranges_num - 1 - indexes[::-1])
+    return overlaps
+
+
+def get_exon_blocks(exon_nums, block_overlaps, block_ranks):
+    """Get exon_num: intersected blocks dict.
+
+    Blocks go before interblock regions, exons are ordered by the first block they intersect.
+    """
+    exon_blocks = defaultdict(list)
+    exon_ranked_blocks = []
+    for exon_num, blocks in zip(exon_nums, block_overlaps):
+        if len(blocks) == 0:
+            continue
+        exon_ranked_blocks.append((exon_num, sorted(blocks.tolist(), key=block_ranks.__getitem__)))
+    exon_ranked_blocks.sort(key=lambda x: block_ranks[x[1][0]])
+    for exon_num, blocks in exon_ranked_blocks:
+        exon_blocks[exon_num] = [block_id(b) for b in blocks]
+    return exon_blocks
+
+
 def intersect_exons_blocks_gaps(
     exon_coordinates, subchain_blocks, gap_coordinates, flank, uhq_flank
 ):
     """Intersect exons, chain blocks and gaps.
 
+    subchain_blocks: array of blocks and interblock regions, see orient_blocks.
     Create the following dictionaries:
     exon_num: intersected chain blocks (list)
     chain_block: intersects gap or not (bool)
     """
+    blocks_num = len(subchain_blocks)
+    # intervals ends in the reference and query, interblock regions might be reversed
+    block_t_lo, block_t_hi = ranges_to_arrays(subchain_blocks[:, :2])
+    block_q_lo, block_q_hi = ranges_to_arrays(subchain_blocks[:, 2:])
+    # blocks are reported in the blocks first, interblock regions next order
+    real_blocks_num = (blocks_num + 1) // 2
+    block_ranks = [i // 2 if i % 2 == 0 else real_blocks_num + i // 2 for i in range(blocks_num)]
     # make a pseudoblock --> for the entire chain
-    # all T - all chain blocks in reference coordinates
-    all_t = [b[0] for b in subchain_blocks.values()] + [
-        b[1] for b in subchain_blocks.values()
-    ]
-    # all Q - all chain blocks in query coordinates
-    all_q = [b[2] for b in subchain_blocks.values()] + [
-        b[3] for b in subchain_blocks.values()
-    ]
-    global_block = (min(all_t), max(all_t), min(all_q), max(all_q))
+    global_block = (int(block_t_lo.min()), int(block_t_hi.max()))
+
+    exon_nums = list(exon_coordinates.keys())
+    exon_lo, exon_hi = ranges_to_arrays([exon_coordinates[e] for e in exon_nums])
     # get a dict of exons with flanks
     exon_flank_coordinates = {}
     exon_aa_flank_coordinates = {}  # just to check that AA criteria satisfied
-    marginal_cases = {e: False for e in exon_coordinates.keys()}
+    marginal_cases = {e: False for e in exon_nums}
 
-    for exon_num, exon_coords in exon_coordinates.items():
+    for exon_num, exon_start, exon_end in zip(exon_nums, exon_lo.tolist(), exon_hi.tolist()):
         # get exon -> flanked coordinates
-        exon_start, exon_end = min(exon_coords), max(exon_coords)
         exon_size = exon_end - exon_start
-        flanked_exon_start = exon_start - flank
-        flanked_exon_end = exon_end + flank
-        aa_flanked_start = exon_start - uhq_flank
-        aa_flanked_end = exon_end + uhq_flank
-        exon_flank_coordinates[exon_num] = (flanked_exon_start, flanked_exon_end)
-        exon_aa_flank_coordinates[exon_num] = (aa_flanked_start, aa_flanked_end)
+        exon_flank_coordinates[exon_num] = (exon_start - flank, exon_end + flank)
+        exon_aa_flank_coordinates[exon_num] = (exon_start - uhq_flank, exon_end + uhq_flank)
         # also check if a block outside the chain
-        glob_intersect = intersect_ranges(
-            exon_coords, (global_block[0], global_block[1])
-        )
+        glob_intersect = intersect_ranges((exon_start, exon_end), global_block)
         if glob_intersect != exon_size:
             # exon doesn't intersect chain -> put to marginal cases
             marginal_cases[exon_num] = True
 
     # find intersections for blocks and assembly gaps
-    exon_num_blocks = defaultdict(list)
-    fl_exon_num_blocks = defaultdict(list)
-    aa_exon_num_blocks = defaultdict(list)
-    block_gaps = {b: False for b in subchain_blocks.keys()}
-
-    for block_num, block_coords in subchain_blocks.items():
-        # try intersection with all exons
-        for exon_num, exon_coords in exon_coordinates.items():
-            flanked_coords = exon_flank_coordinates.get(exon_num)
-            aa_flank_coords = exon_aa_flank_coordinates.get(exon_num)
-            intersect_norm = intersect_ranges(
-                exon_coords, (block_coords[0], block_coords[1])
-            )
-            intersect_flanked = intersect_ranges(
-                flanked_coords, (block_coords[0], block_coords[1])
-            )
-            intersect_aa_class = intersect_ranges(
-                aa_flank_coords, (block_coords[0], block_coords[1])
-            )
-            if intersect_norm >= 0:
-                exon_num_blocks[exon_num].append(block_num)
-            if intersect_flanked >= 0:
-                fl_exon_num_blocks[exon_num].append(block_num)
-            if intersect_aa_class >= 0:
-                aa_exon_num_blocks[exon_num].append(block_num)
-        # and gaps
-        for gap_num, gap in enumerate(gap_coordinates):
-            intersect = intersect_ranges(gap, (block_coords[2], block_coords[3]))
-            if intersect <= 0:
-                continue
-            block_gaps[block_num] = gap_num
-            verbose_msg = (
-                f"Block num {block_num} in coords t:{block_coords[0]}-{block_coords[1]} "
-                f"q:{block_coords[2]}-{block_coords[3]} intersects gap {gap[0]}-{gap[1]}"
-            )
-            verbose(verbose_msg)
+    exon_num_blocks = get_exon_blocks(
+        exon_nums, find_overlaps(block_t_lo, block_t_hi, exon_lo, exon_hi), block_ranks
+    )
+    fl_exon_num_blocks = get_exon_blocks(
+        exon_nums,
+        find_overlaps(block_t_lo, block_t_hi, exon_lo - flank, exon_hi + flank),
+        block_ranks,
+    )
+    aa_exon_num_blocks = get_exon_blocks(
+        exon_nums,
+        find_overlaps(block_t_lo, block_t_hi, exon_lo - uhq_flank, exon_hi + uhq_flank),
+        block_ranks,
+    )
+
+    block_gaps = {block_id(i): False for i in sorted(range(blocks_num), key=block_ranks.__getitem__)}
+    gap_lo, gap_hi = ranges_to_arrays(gap_coordinates)
+    gap_overlaps = find_overlaps(block_q_lo, block_q_hi, gap_lo, gap_hi, strict=True)
+    block_gap_pairs = sorted(
+        (block_ranks[b], gap_num, b)
+        for gap_num, blocks in enumerate(gap_overlaps)
+        for b in blocks.tolist()
+    )
+    # if a block intersects several gaps, the last one is saved
+    for _, gap_num, index in block_gap_pairs:
+        block_num = block_id(index)
+        block_coords = subchain_blocks[index].tolist()
+        gap = gap_coordinates[gap_num]
+        block_gaps[block_num] = gap_num
+        verbose_msg = (
+            f"Block num {block_num} in coords t:{block_coords[0]}-{block_coords[1]} "
+            f"q:{block_coords[2]}-{block_coords[3]} intersects gap {gap[0]}-{gap[1]}"
+        )
+        verbose(verbose_msg)
     # get missed exons to exclude
     missing_exons = [e for e in exon_coordinates.keys() if not exon_num_blocks.get(e)]
     not_covered_str = ", ".join([str(e) for e in missing_exons])
@@ -920,8 +944,10 @@ def intersect_exons_blocks_gaps(
 
     for exon_num, blocks in aa_exon_num_blocks.items():
         exon_range = exon_aa_flank_coordinates[exon_num]
-        i_block_coords = [(b, subchain_blocks[b]) for b in blocks]
-        fex_len, t_cov, q_cov = get_aa_ex_cov(exon_range, i_block_coords)
+        block_indexes = [block_index(b) for b in blocks]
+        block_coords = subchain_blocks[block_indexes]
+        interblock = np.array(block_indexes) % 2 == 1
+        fex_len, t_cov, q_cov = get_aa_ex_cov(exon_range, block_coords, interblock)
         # allow 20% deviation
         # if corresponding regions are in this range: it's OK
         dev_thr = uhq_flank * 0.2
@@ -941,38 +967,30 @@ def intersect_exons_blocks_gaps(
     )
 
 
-def sort_blocks(blocks_num):
-    """Return block: index and index: block dicts."""
-    block_to_index, index_to_block = {}, {}
-    pointer = -1
-    for i in range(blocks_num):
-        if i % 2 == 0:
-            # if so, it is a real block
-            pointer += 1
-            block_id = str(pointer)
-        else:  # otherwise an interblock range
-            block_id = f"{pointer}_{pointer + 1}"
-        block_to_index[block_id] = i
-        index_to_block[i] = block_id
-    return block_to_index, index_to_block
+def block_id(index):
+    """Get block ID by index in the blocks array: 0, 0_1, 1, 1_2..."""
+    pointer = index // 2
+    # even: a real block, otherwise an interblock range
+    return str(pointer) if index % 2 == 0 else f"{pointer}_{pointer + 1}"
+
+
+def block_index(block_num):
+    """Get index in the blocks array by block ID, see block_id."""
+    pointer = int(block_num.split("_")[0])
+    return 2 * pointer if "_" not in block_num else 2 * pointer + 1
 
 
 def classify_predict_exons(exon_blocks, block_coordinates, margin_cases):
     """Classify exons and get expected coordinates."""
     exon_class, exon_exp_q_region = {}, {}
-    block_deleted = {}
-    block_to_index, index_to_block = sort_blocks(len(block_coordinates))
-    # for each block compute if it corresponds to gap in query
-    for block_num, block_coords in block_coordinates.items():
-        block_deleted[block_num] = True if block_coords[2] == block_coords[3] else False
 
     for exon_num, blocks in exon_blocks.items():
         # extract expected query region
-        block_indexes = sorted([block_to_index.get(b) for b in blocks])
-        start_block_id = index_to_block.get(block_indexes[0])
-        end_block_id = index_to_block.get(block_indexes[-1])
-        start_block_coords = block_coordinates.get(start_block_id)
-        end_block_coords = block_coordinates.get(end_block_id)
+        block_indexes = sorted([block_index(b) for b in blocks])
+        start_block_id = block_id(block_indexes[0])
+        end_block_id = block_id(block_indexes[-1])
+        start_block_coords = block_coordinates[block_indexes[0]].tolist()
+        end_block_coords = block_coordinates[block_indexes[-1]].tolist()
         exp_q_region_start = min(start_block_coords[2], end_block_coords[2])
         exp_q_region_end = max(start_block_coords[3], end_block_coords[3])
         exon_exp_q_region[exon_num] = (exp_q_region_start, exp_q_region_end)
@@ -1021,7 +1039,6 @@ def find_exons_gaps(
 ):
     """For each flanked exon define if it overlaps gaps."""
     exon_gap = {}
-    block_to_index, index_to_block = sort_blocks(len(block_coordinates))
     for exon_num, exon_coordinates in fl_exon_coordinates.items():
         intersected_blocks = flanked_exon_blocks.get(exon_num)
         if not intersected_blocks:  # exon not covered
@@ -1050,10 +1067,8 @@ def find_exons_gaps(
             exon_gap[exon_num] = False
             continue
         # risky zone; more sophisticated cases
-        block_indexes = sorted([block_to_index.get(b) for b in intersected_blocks])
-        first_block, last_block = index_to_block.get(
-            block_indexes[0]
-        ), index_to_block.get(block_indexes[-1])
+        block_indexes = sorted([block_index(b) for b in intersected_blocks])
+        first_block, last_block = block_id(block_indexes[0]), block_id(block_indexes[-1])
         if "_" not in first_block and "_" not in last_block:
             # it is possible in only the one case
             #      exonexonexonexonexonexon
@@ -1072,9 +1087,8 @@ def find_exons_gaps(
         # blockblock============
         #             gapgap
         gap_coords_to_check = [gap_coordinates[i] for i in gap_numbers]
-        f_block_coords, l_block_coords = block_coordinates.get(
-            first_block
-        ), block_coordinates.get(last_block)
+        f_block_coords = block_coordinates[block_indexes[0]].tolist()
+        l_block_coords = block_coordinates[block_indexes[-1]].tolist()
         f_block_delta = intersect_ranges(
             exon_coordinates, (f_block_coords[0], f_block_coords[1])
         )
@@ -1156,9 +1170,14 @@ def make_in_filename(cesar_in, temp_dir):
 
 
 def make_cesar_in(exons, queries, u12_elems, cesar_in_filename, cesar_temp_dir):
-    """Make input for CESAR."""
+    """Make input for CESAR.
+
+    The input is a list of string chunks that refer to the exon
+    and query sequences, they are not concatenated: query sequences
+    might be several megabases long.
+    """
     cesar_in_filename, is_temp = make_in_filename(cesar_in_filename, cesar_temp_dir)
-    input_line = ""  # init var
+    input_chunks = []
 
     # write exons first
     exons_num = len(exons.keys())
@@ -1168,7 +1187,7 @@ def make_cesar_in(exons, queries, u12_elems, cesar_in_filename, cesar_temp_dir):
         if exons_num == 1:
             # if single exon -> don't do anything with profiles
             header = f">exon_{num}"
-            input_line += f"{header}\n{exon}\n"
+            input_chunks.extend((f"{header}\n", exon, "\n"))
             continue
         # not a single exon gene
         num_corr = num + 1
@@ -1180,24 +1199,35 @@ def make_cesar_in(exons, queries, u12_elems, cesar_in_filename, cesar_temp_dir):
         acc = acc if num != 0 else FIRST_CODON_PROFILE
         don = don if num != exons_last_ind else LAST_CODON_PROFILE
         header = f">exon_{num}\t{acc}\t{don}"
-        input_line += f"{header}\n{exon}\n"
+        input_chunks.extend((f"{header}\n", exon, "\n"))
 
-    input_line += "####\n"  # required by CESAR to separate target and query with ####
+    input_chunks.append("####\n")  # required by CESAR to separate target and query with ####
     # write queries
     for chain_id, chain_seq in queries.items():
-        input_line += f">{chain_id}\n{chain_seq}\n"
+        input_chunks.extend((f">{chain_id}\n", chain_seq, "\n"))
 
     if is_temp is True:
         # in TOGAs < 1.1.4 - we'd create a temp file in the /dev/shm
         # now, we don't do it - just pass to the CESAR /dev/stdin
-        return input_line, None, True
+        return input_chunks, None, True
     
     # user asked to create a specific file to store cesar's input
     with open(cesar_in_filename, "w") as f:
-        f.write(input_line)
+        f.writelines(input_chunks)
     return None, cesar_in_filename, False
 
 
+def write_stdin(stdin, input_chunks):
+    """Write input chunks to the process stdin, encoding one at a time."""
+    try:
+        for chunk in input_chunks:
+            stdin.write(chunk.encode())
+        stdin.close()
+    except BrokenPipeError:
+        # the process exited before reading all the input: its return code tells why
+        pass
+
+
 def get_exon_indexes(exon_sizes):
     """For an input file given return an array of letter indexes in exons."""
     exon_indexes = {}
@@ -1245,7 +1275,8 @@ def run_cesar(
 ):
     """Run CESAR for the input file or data.
 
-    Normally, runs using input_data -> a string representing the input data for CESAR
+    Normally, runs using input_data -> string chunks of the input data for CESAR,
+    they are written to CESAR stdin while its output is being read.
     Alternatively, can be executed using input_file -> temp file created to call CESAR.
     The second option may be useful if CESAR_wrapper.py is executed as a standalone tool.
     """
@@ -1279,7 +1310,17 @@ def run_cesar(
         b_stdout, b_stderr = p.communicate()
     elif input_data:
         # otherwise, feed the input_data using stdin
-        b_stdout, b_stderr = p.communicate(input=input_data.encode())
+        # CESAR may start writing output before it reads the entire input,
+        # so stdin is written and stderr is read in separate threads
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            stdin_writer = executor.submit(write_stdin, p.stdin, input_data)
+            stderr_reader = executor.submit(p.stderr.read)
+            b_stdout = p.stdout.read()
+            stdin_writer.result()
+            b_stderr = stderr_reader.result()
+        p.stdout.close()
+        p.stderr.close()
+        p.wait()
     else:
         # b_stdout, b_stderr = None, None
         raise RuntimeError("Unreachable condition")
@@ -2285,15 +2326,19 @@ def realign_exons(args):
     """Entry point."""
     memlim = float(args["memlim"]) if args["memlim"] != "Auto" else None
     os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"  # otherwise it could crash
-    # read gene-related data
-    bed_data = read_bed(
-        args["gene"], args["bdb_bed_file"]
-    )  # extract gene data from bed file
-    # bed_exons_num = len(bed_data["blocks"])
-    # parse gene bed-track: get exon coordinates, sequences and splice sites
-    exon_coordinates, exon_sequences, s_sites, exon_flanks = get_exons(
-        bed_data, args["tDB"]
+    # read gene-related data: precomputed in the reference pack, if provided
+    ref_exons = (
+        load_ref_exons(args["ref_exons"], args["gene"]) if args.get("ref_exons") else None
     )
+    if ref_exons:
+        bed_data, exons_data = ref_exons["bed_data"], ref_exons["exons_data"]
+    else:
+        bed_data = read_bed(
+            args["gene"], args["bdb_bed_file"]
+        )  # extract gene data from bed file
+        # parse gene bed-track: get exon coordinates, sequences and splice sites
+        exons_data = get_exons(bed_data, args["tDB"])
+    exon_coordinates, exon_sequences, s_sites, exon_flanks = exons_data
     # read chain IDs list:
     chains = (
         [int(x) for x in args["chains"].split(",") if x != ""]
@@ -2307,10 +2352,14 @@ def realign_exons(args):
         else args["bdb_chain_file"]
     )
 
-    # check if there are stop codons in reference -> we either mask them or halt execution
-    exon_sequences, sec_codons = check_ref_exons(exon_sequences, args["mask_stops"])
-    # CESAR require some formatting of the reference exon sequences:
-    prepared_exons = prepare_exons_for_cesar(exon_sequences)
+    if ref_exons and (args["mask_stops"] or not ref_exons["inframe_stops"]):
+        # stop codons were masked and exons formatted when the store was built
+        exon_sequences, sec_codons, prepared_exons = ref_exons["checked_exons"]
+    else:
+        # check if there are stop codons in reference -> we either mask them or halt execution
+        exon_sequences, sec_codons = check_ref_exons(exon_sequences, args["mask_stops"])
+        # CESAR require some formatting of the reference exon sequences:
+        prepared_exons = prepare_exons_for_cesar(exon_sequences)
 
     # read chain-related data
     query_sequences, query_loci, inverts = {}, {}, {}
@@ -2548,7 +2597,28 @@ def realign_exons(args):
     else:
         cesar_bin = DEFAULT_CESAR
 
-    if not args["cesar_output"]:
+    if not args["cesar_output"] and args.get("cesar_cache"):
+        # CESAR output is defined by its input -> check whether it was computed already
+        cesar_cache = CesarCache(args["cesar_cache"])
+        if cesar_in_data:
+            cache_key = get_cache_key(cesar_in_data, cesar_bin)
+        else:
+            with open(cesar_in_filename, "r") as f:
+                cache_key = get_cache_key(f, cesar_bin)
+        cesar_raw_out = cesar_cache.get(cache_key)
+        if cesar_raw_out is None:
+            cesar_raw_out = run_cesar(
+                cesar_in_filename,
+                cesar_in_data,
+                memory,
+                memlim,
+                cesar_bin
+            )
+            cesar_cache.put(cache_key, cesar_raw_out)
+        else:
+            verbose(f"Using cached CESAR output {cache_key}")
+            cesar_raw_out = set_query_ids(cesar_raw_out, query_sequences.keys())
+    elif not args["cesar_output"]:
         cesar_raw_out = run_cesar(
             cesar_in_filename,
             cesar_in_data,
@@ -2658,5 +2728,6 @@ def realign_exons(args):
 if __name__ == "__main__":
     t0 = dt.now()
     cmd_args = vars(parse_args())
-    realign_exons(cmd_args)
+    profiler = JobsProfiler("CESAR_wrapper", cmd_args["profile_dir"])
+    profiler.run(f"{cmd_args['gene']} {cmd_args['chains']}", realign_exons, cmd_args)
     sys.exit(0)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Deterministic stand-in for the CESAR2.0 binary.
+
+Reads CESAR input as CESAR_wrapper.make_cesar_in makes it:
+reference exons, then #### and then query sequences.
+Places each reference exon on each query without gaps, using
+the diagonal with most k-mer matches; exons are placed in order,
+exons that cannot be placed are reported as deleted.
+Output has the same format as CESAR2.0 output, so CESAR_wrapper.py
+can parse it. The same input always produces the same output.
+Usage is the same as for CESAR: fake_cesar.py input_file -x mem_limit
+"""
+import sys
+from collections import Counter
+from collections import defaultdict
+
+__author__ = "Bogdan M. Kirilenko"
+
+KMER_LEN = 10
+MIN_KMER_HITS = 2
+TARGET_QUERY_SEP = "####"
+REFERENCE_HEADER = ">referenceExon"
+
+
+def read_input(path):
+    """Read exon sequences and query ID: sequence pairs."""
+    f = open(path, "r")
+    lines = [x.rstrip("\n") for x in f if x.strip()]
+    f.close()
+    sep_index = lines.index(TARGET_QUERY_SEP)
+    # exon headers may contain splice sites profiles after a tab
+    exons = lines[1:sep_index:2]
+    query_lines = lines[sep_index + 1:]
+    queries = list(zip((x[1:] for x in query_lines[0::2]), query_lines[1::2]))
+    return exons, queries
+
+
+def index_kmers(seq):
+    """Get k-mer: positions dict."""
+    kmers = defaultdict(list)
+    for pos in range(len(seq) - KMER_LEN + 1):
+        kmers[seq[pos: pos + KMER_LEN]].append(pos)
+    return kmers
+
+
+def place_exon(exon, query_kmers, min_start, query_len):
+    """Find query start of the exon, None if it cannot be placed after min_start."""
+    max_start = query_len - len(exon)
+    diagonals = Counter()
+    for pos in range(len(exon) - KMER_LEN + 1):
+        for q_pos in query_kmers.get(exon[pos: pos + KMER_LEN], ()):
+            start = q_pos - pos
+            if min_start <= start <= max_start:
+                diagonals[start] += 1
+    if not diagonals:
+        return None
+    # most hits, then leftmost, so the result does not depend on the dict order
+    start, hits = min(diagonals.items(), key=lambda x: (-x[1], x[0]))
+    min_hits = MIN_KMER_HITS if len(exon) >= KMER_LEN + MIN_KMER_HITS else 1
+    return start if hits >= min_hits else None
+
+
+def align_query(exons, query):
+    """Make reference and query alignment lines."""
+    query_upper = query.upper()
+    query_kmers = index_kmers(query_upper)
+    placements = []
+    min_start = 0
+    for exon in exons:
+        start = place_exon(exon.upper(), query_kmers, min_start, len(query))
+        placements.append(start)
+        if start is not None:
+            min_start = start + len(exon) + 1  # exons are separated by an intron
+    target_parts, query_parts = [], []
+    q_pos = 0
+    for exon, start in zip(exons, placements):
+        if start is None:
+            # deleted exon: aligned to gaps, separated from other exons by a space
+            target_parts.append(" " + exon + " ")
+            query_parts.append("-" * (len(exon) + 2))
+            continue
+        intron = query[q_pos: start].lower()
+        target_parts.append(" " * len(intron))
+        query_parts.append(intron)
+        target_parts.append(exon)
+        query_parts.append(query_upper[start: start + len(exon)])
+        q_pos = start + len(exon)
+    target_parts.append(" " * (len(query) - q_pos))
+    query_parts.append(query[q_pos:].lower())
+    return "".join(target_parts), "".join(query_parts)
+
+
+def main():
+    """Entry point."""
+    if len(sys.argv) < 2:
+        sys.exit(f"Usage: {sys.argv[0]} input_file [-x mem_limit]")
+    exons, queries = read_input(sys.argv[1])
+    for query_id, query in queries:
+        target_line, query_line = align_query(exons, query)
+        sys.stdout.write(f"{REFERENCE_HEADER}\n{target_line}\n>{query_id}\n{query_line}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""Generate synthetic TOGA input of configurable size.
+
+Creates reference and query genomes in the 2bit format,
+reference annotation (bed12), isoforms file and chains.
+Reference genes are random coding sequences without in-frame
+stop codons and with canonical splice sites. The query genome
+is a mutated copy of the reference split in several scaffolds
+(only synonymous substitutions in the coding sequences),
+some scaffolds are reverse-complemented. In addition, the query
+contains duplicated gene loci and processed pseudogenes, that
+are aligned by separate chains. A fraction of query genes
+carries frameshifting deletions.
+The output is deterministic for the same arguments.
+"""
+import argparse
+import os
+import struct
+import sys
+import numpy as np
+
+__author__ = "Bogdan M. Kirilenko"
+
+TWO_BIT_SIGNATURE = 0x1A412743
+# 2bit encodes T, C, A, G as 0, 1, 2, 3
+TWO_BIT_ORDER = "TCAG"
+BASES = "ACGT"
+COMPLEMENT = np.array([3, 2, 1, 0], dtype=np.uint8)  # for ACGT codes
+ASCII_TO_CODE = np.zeros(256, dtype=np.uint8)
+ASCII_TO_CODE[[ord(x) for x in BASES]] = np.arange(4, dtype=np.uint8)
+STOP_CODONS = {"TAA", "TAG", "TGA"}
+SENSE_CODONS = [
+    a + b + c for a in BASES for b in BASES for c in BASES if a + b + c not in STOP_CODONS
+]
+# query genome properties
+EXON_SUBST_RATE = 0.03  # in gene copies
+SYNONYMOUS_SUBST_RATE = 0.2  # at the 3rd codon positions of orthologous genes
+NON_EXON_SUBST_RATE = 0.12
+INDEL_DISTANCE = 700  # average distance between indels outside exons
+MAX_INDEL_LEN = 40
+DUP_FLANK = 1000
+SPACER_LEN = 5000
+CHAIN_SCORE_PER_BASE = 80
+
+
+def parse_args():
+    """Parse command line arguments."""
+    app = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    app.add_argument("output_dir", help="Directory to save the dataset")
+    app.add_argument("--chroms", "-c", type=int, default=4, help="Number of reference chromosomes")
+    app.add_argument(
+        "--genes_per_chrom", "-g", type=int, default=100, help="Number of genes per chromosome"
+    )
+    app.add_argument(
+        "--gene_slot", "--gs", type=int, default=20000,
+        help="Reference region occupied by a gene and the intergenic region after it"
+    )
+    app.add_argument(
+        "--scaffold_genes", "--sg", type=int, default=25,
+        help="Number of genes per query scaffold, each scaffold is aligned by a separate chain"
+    )
+    app.add_argument(
+        "--dup_fraction", "--df", type=float, default=0.1,
+        help="Fraction of genes that have an additional copy in the query"
+    )
+    app.add_argument(
+        "--pseudogene_fraction", "--pf", type=float, default=0.05,
+        help="Fraction of genes that have a processed pseudogene in the query"
+    )
+    app.add_argument(
+        "--loss_fraction", "--lf", type=float, default=0.05,
+        help="Fraction of query genes with a frameshifting deletion"
+    )
+    app.add_argument(
+        "--isoforms_fraction", "--if", type=float, default=0.3,
+        help="Fraction of genes with an alternative isoform skipping an exon"
+    )
+    app.add_argument("--seed", "-s", type=int, default=1, help="Random seed")
+    if len(sys.argv) < 2:
+        app.print_help()
+        sys.exit(0)
+    args = app.parse_args()
+    return args
+
+
+def seq_to_codes(seq):
+    """Convert ACGT string to array of codes."""
+    return ASCII_TO_CODE[np.frombuffer(seq.encode(), dtype=np.uint8)]
+
+
+def rev_comp(codes):
+    """Reverse complement array of codes."""
+    return COMPLEMENT[codes[::-1]]
+
+
+def codes_to_two_bit(codes):
+    """Pack array of ACGT codes in 2bit format: 4 bases per byte."""
+    to_two_bit = np.array([TWO_BIT_ORDER.index(x) for x in BASES], dtype=np.uint8)
+    two_bit = to_two_bit[codes]
+    pad = (-len(two_bit)) % 4
+    two_bit = np.concatenate((two_bit, np.zeros(pad, dtype=np.uint8))).reshape(-1, 4)
+    packed = (two_bit[:, 0] << 6) | (two_bit[:, 1] << 4) | (two_bit[:, 2] << 2) | two_bit[:, 3]
+    return packed.astype(np.uint8).tobytes()
+
+
+def save_two_bit(sequences, path):
+    """Save name: codes dict as a 2bit file, no N or masked blocks."""
+    names = list(sequences.keys())
+    header_size = 16 + sum(1 + len(x.encode()) + 4 for x in names)
+    f = open(path, "wb")
+    f.write(struct.pack("<IIII", TWO_BIT_SIGNATURE, 0, len(names), 0))
+    offset = header_size
+    records = []
+    for name in names:
+        codes = sequences[name]
+        # dnaSize, nBlockCount, maskBlockCount, reserved
+        record = struct.pack("<IIII", len(codes), 0, 0, 0) + codes_to_two_bit(codes)
+        f.write(struct.pack("<B", len(name.encode())) + name.encode() + struct.pack("<I", offset))
+        offset += len(record)
+        records.append(record)
+    for record in records:
+        f.write(record)
+    f.close()
+
+
+def make_gene(rng, max_len):
+    """Make a gene locus in the transcript orientation.
+
+    Return codes of the locus and list of exon (start, end) within it.
+    """
+    exons_num = int(rng.integers(1, 13))
+    exon_lens = [int(x) * 3 for x in rng.integers(20, 100, exons_num)]
+    intron_lens = [int(x) for x in rng.integers(300, 3000, exons_num - 1)]
+    while sum(exon_lens) + sum(intron_lens) > max_len and len(exon_lens) > 1:
+        exon_lens.pop()
+        intron_lens.pop()
+    codons_num = sum(exon_lens) // 3
+    codons = rng.choice(SENSE_CODONS, codons_num)
+    codons[0] = "ATG"
+    codons[-1] = "TAA"
+    cds = seq_to_codes("".join(codons))
+    parts = []
+    exons = []
+    cds_pos = 0
+    locus_pos = 0
+    for num, exon_len in enumerate(exon_lens):
+        parts.append(cds[cds_pos: cds_pos + exon_len])
+        exons.append((locus_pos, locus_pos + exon_len))
+        cds_pos += exon_len
+        locus_pos += exon_len
+        if num == len(intron_lens):
+            break
+        intron = rng.integers(0, 4, intron_lens[num]).astype(np.uint8)
+        intron[:2] = seq_to_codes("GT")
+        intron[-2:] = seq_to_codes("AG")
+        parts.append(intron)
+        locus_pos += intron_lens[num]
+    return np.concatenate(parts), exons
+
+
+def make_bed_line(chrom, name, strand, exons):
+    """Make bed12 line, exons: sorted genomic (start, end) list."""
+    start = exons[0][0]
+    end = exons[-1][1]
+    sizes = ",".join(str(e - s) for s, e in exons)
+    starts = ",".join(str(s - start) for s, _ in exons)
+    fields = [chrom, start, end, name, 0, strand, start, end, "0,0,0", len(exons), sizes, starts]
+    return "\t".join(str(x) for x in fields) + "\n"
+
+
+def make_reference(args, rng):
+    """Make reference chromosomes and genes."""
+    chroms = {}
+    genes = []  # (chrom, name, strand, genomic exons, alt exons or None)
+    chrom_size = args.genes_per_chrom * args.gene_slot + args.gene_slot
+    for chrom_num in range(1, args.chroms + 1):
+        chrom = f"chr{chrom_num}"
+        seq = rng.integers(0, 4, chrom_size).astype(np.uint8)
+        for gene_num in range(args.genes_per_chrom):
+            locus, exons = make_gene(rng, args.gene_slot // 2)
+            strand = "+" if rng.random() < 0.5 else "-"
+            # genes start in the middle of the slot: first slot is intergenic
+            start = (gene_num + 1) * args.gene_slot + int(rng.integers(0, args.gene_slot // 4))
+            if strand == "-":
+                locus = rev_comp(locus)
+                exons = [(len(locus) - e, len(locus) - s) for s, e in exons[::-1]]
+            seq[start: start + len(locus)] = locus
+            exons = [(start + s, start + e) for s, e in exons]
+            alt_exons = None
+            if len(exons) >= 3 and rng.random() < args.isoforms_fraction:
+                skip = int(rng.integers(1, len(exons) - 1))
+                alt_exons = exons[:skip] + exons[skip + 1:]
+            genes.append((chrom, f"GENE_{chrom_num}_{gene_num}", strand, exons, alt_exons))
+        chroms[chrom] = seq
+    return chroms, genes
+
+
+def mutate(rng, codes, exon_mask, exon_rate=0.0):
+    """Introduce substitutions, fewer in exons."""
+    rates = np.where(exon_mask, exon_rate, NON_EXON_SUBST_RATE)
+    mutated = rng.random(len(codes)) < rates
+    codes = codes.copy()
+    codes[mutated] = (codes[mutated] + rng.integers(1, 4, mutated.sum())) % 4
+    return codes
+
+
+def get_synonymous_sites(genes, chrom, strand):
+    """Get 3rd codon positions of the chromosome genes on the strand.
+
+    All exons have length % 3 == 0 and start with a complete codon.
+    """
+    sites = []
+    for gene in genes:
+        if gene[0] != chrom or gene[2] != strand:
+            continue
+        for s, e in gene[3]:
+            sites.append(np.arange(s + 2, e, 3) if strand == "+" else np.arange(e - 3, s - 1, -3))
+    return np.concatenate(sites) if sites else np.zeros(0, dtype=np.int64)
+
+
+def mutate_synonymous(rng, codes, plus_sites, minus_sites):
+    """Make C <-> T transitions at 3rd codon positions.
+
+    They never create a stop codon and do not change the protein.
+    On the minus strand, these are A <-> G transitions. XOR 2 swaps
+    A and G (codes 0 and 2), C and T (codes 1 and 3).
+    """
+    plus_sites = plus_sites[codes[plus_sites] % 2 == 1]
+    minus_sites = minus_sites[codes[minus_sites] % 2 == 0]
+    sites = np.concatenate((plus_sites, minus_sites))
+    sites = sites[rng.random(len(sites)) < SYNONYMOUS_SUBST_RATE]
+    codes[sites] ^= 2
+    return codes
+
+
+def make_chain_line(score, t_name, t_size, t_start, t_end, q_name, q_size, q_strand, q_start, q_end, chain_id):
+    """Make chain header."""
+    return (
+        f"chain {score} {t_name} {t_size} + {t_start} {t_end} "
+        f"{q_name} {q_size} {q_strand} {q_start} {q_end} {chain_id}\n"
+    )
+
+
+def align_segment(rng, t_codes, t_start, t_end, events):
+    """Make query sequence of the reference segment with indels.
+
+    events: sorted list of (position, length, is_deletion).
+    Return query codes and chain blocks: (size, dt, dq) tuples.
+    """
+    parts = []
+    blocks = []
+    cur = t_start
+    for pos, length, is_deletion in events:
+        parts.append(t_codes[cur: pos])
+        if is_deletion:
+            blocks.append((pos - cur, length, 0))
+            cur = pos + length
+        else:
+            parts.append(rng.integers(0, 4, length).astype(np.uint8))
+            blocks.append((pos - cur, 0, length))
+            cur = pos
+    parts.append(t_codes[cur: t_end])
+    blocks.append((t_end - cur, 0, 0))
+    return np.concatenate(parts), blocks
+
+
+def get_events(rng, t_start, t_end, exon_mask, frameshifts):
+    """Select indel positions outside exons and frameshifts in exons."""
+    events_num = (t_end - t_start) // INDEL_DISTANCE
+    positions = np.unique(rng.integers(t_start + 100, t_end - 100 - MAX_INDEL_LEN, events_num))
+    events = []
+    last_end = t_start
+    for pos in positions:
+        pos = int(pos)
+        length = int(rng.integers(1, MAX_INDEL_LEN))
+        if pos < last_end + 50 or exon_mask[pos: pos + length + 1].any():
+            continue
+        events.append((pos, length, rng.random() < 0.5))
+        last_end = pos + length
+    events.extend((x, 1, True) for x in frameshifts)
+    return sorted(events)
+
+
+def save_chain(f, header, blocks):
+    """Write chain header and blocks."""
+    f.write(header)
+    for size, dt, dq in blocks[:-1]:
+        f.write(f"{size}\t{dt}\t{dq}\n")
+    f.write(f"{blocks[-1][0]}\n\n")
+
+
+def make_query(args, rng, chroms, genes, chain_path):
+    """Make query scaffolds and chains, save chains."""
+    query = {}
+    chains = []  # (score, t_name, t_start, t_end, q_name, q_strand, blocks)
+    exon_masks = {}
+    for chrom, seq in chroms.items():
+        mask = np.zeros(len(seq), dtype=bool)
+        for gene in genes:
+            if gene[0] == chrom:
+                for s, e in gene[3]:
+                    mask[s - 2: e + 2] = True  # keep splice sites
+        exon_masks[chrom] = mask
+    frameshifts = {}
+    for chrom, _, _, exons, _ in genes:
+        if rng.random() < args.loss_fraction:
+            s, e = exons[int(rng.integers(0, len(exons)))]
+            frameshifts.setdefault(chrom, []).append((s + e) // 2)
+
+    for chrom, seq in chroms.items():
+        mutated = mutate(rng, seq, exon_masks[chrom])
+        mutated = mutate_synonymous(
+            rng, mutated, get_synonymous_sites(genes, chrom, "+"), get_synonymous_sites(genes, chrom, "-")
+        )
+        chrom_frameshifts = sorted(frameshifts.get(chrom, []))
+        # scaffold borders lie in the intergenic regions
+        step = args.scaffold_genes * args.gene_slot
+        borders = list(range(0, len(seq), step)) + [len(seq)]
+        for num, (t_start, t_end) in enumerate(zip(borders[:-1], borders[1:])):
+            if t_start > 0:
+                t_start += args.gene_slot // 2 + args.gene_slot // 4
+            if t_end < len(seq):
+                t_end += args.gene_slot // 2 + args.gene_slot // 4
+            seg_frameshifts = [x for x in chrom_frameshifts if t_start < x < t_end]
+            events = get_events(rng, t_start, t_end, exon_masks[chrom], seg_frameshifts)
+            q_seq, blocks = align_segment(rng, mutated, t_start, t_end, events)
+            q_name = f"scaffold_{chrom}_{num}"
+            q_strand = "-" if (num + len(chains)) % 3 == 0 else "+"
+            query[q_name] = rev_comp(q_seq) if q_strand == "-" else q_seq
+            chains.append((t_start, t_end, chrom, q_name, q_strand, blocks))
+
+    # duplicated loci and processed pseudogenes on separate scaffolds
+    copies = []
+    for chrom, _, _, exons, _ in genes:
+        if rng.random() < args.dup_fraction:
+            t_start = exons[0][0] - DUP_FLANK
+            t_end = exons[-1][1] + DUP_FLANK
+            copy = mutate(
+                rng, chroms[chrom][t_start: t_end], exon_masks[chrom][t_start: t_end], EXON_SUBST_RATE
+            )
+            copies.append((chrom, t_start, t_end, copy, [(t_end - t_start, 0, 0)]))
+        if rng.random() < args.pseudogene_fraction and len(exons) > 1:
+            parts = [chroms[chrom][s: e] for s, e in exons]
+            blocks = [(e - s, exons[i + 1][0] - e, 0) for i, (s, e) in enumerate(exons[:-1])]
+            blocks.append((exons[-1][1] - exons[-1][0], 0, 0))
+            copy = mutate(
+                rng, np.concatenate(parts), np.ones(sum(len(x) for x in parts), dtype=bool), EXON_SUBST_RATE
+            )
+            copies.append((chrom, exons[0][0], exons[-1][1], copy, blocks))
+    for num, (chrom, t_start, t_end, copy, blocks) in enumerate(copies):
+        q_name = f"copy_{num}"
+        query[q_name] = np.concatenate(
+            (rng.integers(0, 4, SPACER_LEN).astype(np.uint8), copy,
+             rng.integers(0, 4, SPACER_LEN).astype(np.uint8))
+        )
+        # spacer at the scaffold start shifts query coordinates
+        chains.append((t_start, t_end, chrom, q_name, "+", blocks, SPACER_LEN))
+
+    f = open(chain_path, "w")
+    records = []
+    for chain in chains:
+        t_start, t_end, chrom, q_name, q_strand, blocks = chain[:6]
+        q_offset = chain[6] if len(chain) > 6 else 0
+        aligned = sum(x[0] for x in blocks)
+        q_len = aligned + sum(x[2] for x in blocks)
+        records.append(
+            (aligned * CHAIN_SCORE_PER_BASE, chrom, t_start, t_end, q_name, q_strand,
+             q_offset, q_offset + q_len, blocks)
+        )
+    records.sort(key=lambda x: -x[0])
+    for chain_id, (score, chrom, t_start, t_end, q_name, q_strand, q_start, q_end, blocks) in enumerate(
+        records, 1
+    ):
+        header = make_chain_line(
+            score, chrom, len(chroms[chrom]), t_start, t_end, q_name,
+            len(query[q_name]), q_strand, q_start, q_end, chain_id,
+        )
+        save_chain(f, header, blocks)
+    f.close()
+    return query, len(records)
+
+
+def make_synthetic_data(output_dir, args):
+    """Make the dataset, return dict of file paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(args.seed)
+    paths = {
+        "ref_2bit": os.path.join(output_dir, "ref.2bit"),
+        "query_2bit": os.path.join(output_dir, "query.2bit"),
+        "bed": os.path.join(output_dir, "ref_annotation.bed"),
+        "isoforms": os.path.join(output_dir, "isoforms.tsv"),
+        "chain": os.path.join(output_dir, "ref_to_query.chain"),
+    }
+    chroms, genes = make_reference(args, rng)
+    bed_f = open(paths["bed"], "w")
+    iso_f = open(paths["isoforms"], "w")
+    transcripts_num = 0
+    for chrom, name, strand, exons, alt_exons in genes:
+        bed_f.write(make_bed_line(chrom, f"{name}.1", strand, exons))
+        iso_f.write(f"{name}\t{name}.1\n")
+        transcripts_num += 1
+        if alt_exons:
+            bed_f.write(make_bed_line(chrom, f"{name}.2", strand, alt_exons))
+            iso_f.write(f"{name}\t{name}.2\n")
+            transcripts_num += 1
+    bed_f.close()
+    iso_f.close()
+    query, chains_num = make_query(args, rng, chroms, genes, paths["chain"])
+    save_two_bit(chroms, paths["ref_2bit"])
+    save_two_bit(query, paths["query_2bit"])
+    print(
+        f"Saved {len(chroms)} reference chromosomes, {len(genes)} genes, "
+        f"{transcripts_num} transcripts, {len(query)} query scaffolds "
+        f"and {chains_num} chains to {output_dir}"
+    )
+    return paths
+
+
+def main():
+    """Entry point."""
+    args = parse_args()
+    make_synthetic_data(args.output_dir, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""Measure runtime of TOGA stages on a synthetic dataset.
+
+Each stage entry point is called in this process, in the same
+order as TOGA calls them; the output of a stage is the input
+of the next stages. Only the stage function call is timed.
+By default, CESAR is replaced with fake_cesar.py, a deterministic
+stand-in, so the CESAR wrapper and the next stages are measured
+without the CESAR runtime; use --cesar_binary to call real CESAR.
+
+Results are saved as JSON to the results directory, named by
+commit hash and time; a run is compared with the latest saved
+run on the same dataset, or with the file provided with --compare.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from argparse import Namespace
+from datetime import datetime as dt
+
+LOCATION = os.path.dirname(os.path.abspath(__file__))
+TOGA_LOCATION = os.path.dirname(LOCATION)
+sys.path.append(TOGA_LOCATION)
+
+import CESAR_wrapper  # noqa: E402
+from chain_runner import chain_feat_extractor  # noqa: E402
+from chain_runner import save_records  # noqa: E402
+from constants import Constants  # noqa: E402
+from make_synthetic_data import make_synthetic_data  # noqa: E402
+from modules.bed_hdf5_index import bed_hdf5_index  # noqa: E402
+from modules.chain_bed_intersect import chain_bed_intersect  # noqa: E402
+from modules.chain_bst_index import chain_bst_index  # noqa: E402
+from modules.classify_chains import classify_chains  # noqa: E402
+from modules.common import load_chain_dict  # noqa: E402
+from modules.gene_losses_summary import gene_losses_summary  # noqa: E402
+from modules.make_query_isoforms import get_query_isoforms_data  # noqa: E402
+from modules.merge_cesar_output import merge_cesar_output  # noqa: E402
+from modules.merge_chains_output import merge_chains_output  # noqa: E402
+from modules.orthology_type_map import orthology_type_map  # noqa: E402
+from split_exon_realign_jobs import build_job  # noqa: E402
+from split_exon_realign_jobs import precompute_regions  # noqa: E402
+from split_exon_realign_jobs import read_bed  # noqa: E402
+from split_exon_realign_jobs import read_orthologs  # noqa: E402
+
+__author__ = "Bogdan M. Kirilenko"
+
+RESULTS_DIR = os.path.join(LOCATION, "results")
+MODELS_DIR = os.path.join(TOGA_LOCATION, "models")
+FAKE_CESAR = os.path.join(LOCATION, "fake_cesar.py")
+DATASET_ARGS = (
+    "chroms", "genes_per_chrom", "gene_slot", "scaffold_genes", "dup_fraction",
+    "pseudogene_fraction", "loss_fraction", "isoforms_fraction", "seed",
+)
+CESAR_RESULTS_FILE = "benchmark_jobs.txt"
+LOSS_DATA_FILE = "benchmark_jobs.inact_mut.txt"
+SLOWER_WARN_RATIO = 1.2
+
+
+def parse_args():
+    """Parse command line arguments."""
+    app = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    app.add_argument("work_dir", help="Directory for the dataset and the stages output")
+    app.add_argument(
+        "--cesar_binary", "--cb", default=FAKE_CESAR,
+        help="CESAR binary, fake_cesar.py by default"
+    )
+    app.add_argument(
+        "--stages", default=None,
+        help="Comma-separated list of stages to report, all by default. "
+        "Stages needed to make their input are executed anyway"
+    )
+    app.add_argument(
+        "--repeats", "-r", type=int, default=1,
+        help="Number of times to call each stage, the fastest call is reported"
+    )
+    app.add_argument("--results_dir", "--rd", default=RESULTS_DIR, help="Directory to save the results")
+    app.add_argument("--compare", default=None, help="Results JSON file to compare with")
+    app.add_argument("--no_save", "--ns", action="store_true", dest="no_save", help="Do not save results")
+    app.add_argument(
+        "--rebuild_data", "--rbd", action="store_true", dest="rebuild_data",
+        help="Generate the dataset even if it exists"
+    )
+    # dataset size, see make_synthetic_data.py
+    app.add_argument("--chroms", "-c", type=int, default=4, help="Number of reference chromosomes")
+    app.add_argument("--genes_per_chrom", "-g", type=int, default=100, help="Number of genes per chromosome")
+    app.add_argument("--gene_slot", "--gs", type=int, default=20000, help="Reference region per gene")
+    app.add_argument("--scaffold_genes", "--sg", type=int, default=25, help="Number of genes per query scaffold")
+    app.add_argument("--dup_fraction", "--df", type=float, default=0.1, help="Fraction of duplicated genes")
+    app.add_argument(
+        "--pseudogene_fraction", "--pf", type=float, default=0.05,
+        help="Fraction of genes with a processed pseudogene"
+    )
+    app.add_argument(
+        "--loss_fraction", "--lf", type=float, default=0.05,
+        help="Fraction of genes with a frameshift"
+    )
+    app.add_argument(
+        "--isoforms_fraction", "--if", type=float, default=0.3,
+        help="Fraction of genes with an alternative isoform"
+    )
+    app.add_argument("--seed", "-s", type=int, default=1, help="Random seed")
+    args = app.parse_args()
+    return args
+
+
+def get_commit():
+    """Get current commit hash and whether the tree has uncommitted changes."""
+    try:
+        commit = subprocess.check_output(
+            ["git", "-C", TOGA_LOCATION, "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+        status = subprocess.check_output(
+            ["git", "-C", TOGA_LOCATION, "status", "--porcelain", "--untracked-files=no"],
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown", False
+    return commit, len(status) > 0
+
+
+class StagesTimer:
+    """Call stage functions and keep their runtime."""
+
+    def __init__(self, repeats):
+        self.repeats = repeats
+        self.stages = {}
+
+    def run(self, stage, func, *args, **kwargs):
+        """Call func repeats times, keep the fastest call, return the last result."""
+        result = None
+        wall_times, cpu_times = [], []
+        for _ in range(self.repeats):
+            t0, c0 = time.perf_counter(), time.process_time()
+            result = func(*args, **kwargs)
+            wall_times.append(time.perf_counter() - t0)
+            cpu_times.append(time.process_time() - c0)
+        self.stages[stage] = {"wall_time": min(wall_times), "cpu_time": min(cpu_times)}
+        print(f"{stage}: {min(wall_times):.3f}s")
+        return result
+
+
+def get_data(args):
+    """Make the dataset unless it exists."""
+    data_dir = os.path.join(args.work_dir, "data")
+    params_file = os.path.join(data_dir, "params.json")
+    params = {k: getattr(args, k) for k in DATASET_ARGS}
+    if os.path.isfile(params_file) and not args.rebuild_data:
+        f = open(params_file, "r")
+        saved_params = json.load(f)
+        f.close()
+        if saved_params["params"] == params:
+            return saved_params["paths"], params
+    paths = make_synthetic_data(data_dir, Namespace(**params))
+    f = open(params_file, "w")
+    json.dump({"params": params, "paths": paths}, f, indent=2)
+    f.close()
+    return paths, params
+
+
+def extract_chain_features(chain_genes, chain_file, bed_index, chain_dict):
+    """Call chain_runner core function for each chain."""
+    records = []
+    for chain, transcripts in chain_genes.items():
+        unit_records, _ = chain_feat_extractor(
+            chain, ",".join(transcripts) + ",", chain_file, bed_index, chain_dict, records=True
+        )
+        records.extend(unit_records)
+    return records
+
+
+def make_cesar_jobs(regions, files, cesar_binary, temp_dir):
+    """Make one CESAR wrapper command per transcript."""
+    job_args = Namespace(
+        bdb_bed_file=files["bed_index"],
+        bdb_chain_file=files["chain_index"],
+        tDB=files["ref_2bit"],
+        qDB=files["query_2bit"],
+        cesar_binary=cesar_binary,
+        uhq_flank=50,
+        mask_stops=True,
+        check_loss=True,
+        no_fpi=False,
+        u12=None,
+        ref_exons=None,
+    )
+    jobs = []
+    for transcript, chains_data in regions.items():
+        if len(chains_data) == 0:
+            continue
+        chains_arg = ",".join(str(x) for x in chains_data.keys())
+        jobs.append(build_job(transcript, chains_arg, job_args, False, None, temp_dir))
+    return jobs
+
+
+def realign_exons_jobs(jobs):
+    """Call CESAR wrapper core function for each job.
+
+    Return jobs output and number of failed jobs.
+    """
+    outputs = []
+    failed = 0
+    for job in jobs:
+        sys.argv = shlex.split(job)
+        job_args = vars(CESAR_wrapper.parse_args())
+        CESAR_wrapper.t0 = dt.now()
+        # the wrapper writes results to stdout, cesar_runner.py reads them from there
+        job_out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(job_out), contextlib.redirect_stderr(io.StringIO()):
+                CESAR_wrapper.realign_exons(job_args)
+        except SystemExit as exit_err:
+            if exit_err.code not in (0, None):
+                failed += 1
+                continue
+        except Exception:  # same as a failed CESAR_wrapper.py job
+            failed += 1
+            continue
+        outputs.append((job_args["gene"], job_out.getvalue()))
+    return outputs, failed
+
+
+def save_cesar_results(outputs, results_dir, loss_dir):
+    """Save CESAR wrapper output like cesar_runner.py does."""
+    out = open(os.path.join(results_dir, CESAR_RESULTS_FILE), "w")
+    loss = open(os.path.join(loss_dir, LOSS_DATA_FILE), "w")
+    for gene, job_out in outputs:
+        lines = job_out.split("\n")
+        loss_lines = [x for x in lines if x.startswith("#") or x.startswith("!")]
+        out_lines = [x for x in lines if not x.startswith("#") and not x.startswith("!")]
+        out.write(f"#{gene}\n")
+        out.write("\n".join(out_lines) + "\n")
+        loss.write(f"GENE: {gene}\n")
+        loss.write("\n".join(loss_lines))
+        loss.write("\n\n")
+    out.close()
+    loss.close()
+
+
+def get_models():
+    """Get paths to the chain classification models, None if not trained."""
+    for ext in (".json", ".dat"):
+        se_model = os.path.join(MODELS_DIR, f"se_model{ext}")
+        me_model = os.path.join(MODELS_DIR, f"me_model{ext}")
+        if os.path.isfile(se_model) and os.path.isfile(me_model):
+            return se_model, me_model
+    return None, None
+
+
+def run_stages(args, paths):
+    """Call the stages, return timer and info about skipped stages."""
+    timer = StagesTimer(args.repeats)
+    out_dir = os.path.join(args.work_dir, "output")
+    dirs = {
+        x: os.path.join(out_dir, x)
+        for x in ("chain_results", "cesar_temp", "cesar_results", "loss_data")
+    }
+    for dir_path in dirs.values():
+        os.makedirs(dir_path, exist_ok=True)
+    files = dict(paths)
+    files["bed_index"] = os.path.join(out_dir, "genes_bed.hdf5")
+    # chain readers expect the index next to the chain file
+    files["chain_index"] = paths["chain"].replace(".chain", ".bst")
+    files["chain_index_txt"] = paths["chain"].replace(".chain", ".chain_ID_position")
+
+    timer.run("chain_bst_index", chain_bst_index, paths["chain"], files["chain_index"],
+              txt_index=files["chain_index_txt"])
+    timer.run("bed_hdf5_index", bed_hdf5_index, paths["bed"], files["bed_index"])
+    chain_genes, _ = timer.run("chain_bed_intersect", chain_bed_intersect, paths["chain"], paths["bed"])
+
+    chain_dict = load_chain_dict(files["chain_index_txt"])
+    records = timer.run(
+        "chain_feat_extractor", extract_chain_features,
+        chain_genes, paths["chain"], files["bed_index"], chain_dict
+    )
+    save_records(records, os.path.join(dirs["chain_results"], f"0{Constants.CHAIN_FEATURES_SHARD_EXT}"))
+    chain_features = timer.run(
+        "merge_chains_output", merge_chains_output,
+        paths["bed"], paths["isoforms"], dirs["chain_results"],
+        os.path.join(out_dir, "chain_results_df.tsv"), save_table=False,
+    )
+
+    se_model, me_model = get_models()
+    if se_model is None:
+        return timer, "chain classification models are not trained, see models/readme.md"
+    orthologs = os.path.join(out_dir, "trans_to_chain_classes.tsv")
+    orth_scores = os.path.join(out_dir, "orthology_scores.tsv")
+    timer.run(
+        "classify_chains", classify_chains, chain_features, orthologs, se_model, me_model,
+        raw_out=orth_scores, rejected=os.path.join(out_dir, "classify_chains_rejected.txt"),
+    )
+    batch, chain_gene_field, _, _ = read_orthologs(orthologs)
+    bed_data = read_bed(paths["bed"])
+    regions, _, _ = timer.run(
+        "precompute_regions", precompute_regions,
+        batch, bed_data, files["chain_index"], chain_gene_field, 15, paths["query_2bit"],
+    )
+
+    jobs = make_cesar_jobs(regions, files, os.path.abspath(args.cesar_binary), dirs["cesar_temp"])
+    outputs, failed = timer.run("realign_exons", realign_exons_jobs, jobs)
+    print(f"realign_exons: {len(jobs)} jobs, {failed} failed")
+    if len(outputs) == 0:
+        return timer, "all CESAR jobs failed"
+    save_cesar_results(outputs, dirs["cesar_results"], dirs["loss_data"])
+
+    intermediate_bed = os.path.join(out_dir, "intermediate.bed")
+    timer.run(
+        "merge_cesar_output", merge_cesar_output, dirs["cesar_results"], intermediate_bed,
+        os.path.join(out_dir, "nucleotide.fasta"), os.path.join(out_dir, "exons_meta_data.tsv"),
+        os.path.join(out_dir, "cesar_merge_skipped.txt"), os.path.join(out_dir, "prot.fasta"),
+        os.path.join(out_dir, "codon.fasta"), os.path.join(out_dir, "trash_exons.bed"),
+    )
+    query_annotation = os.path.join(out_dir, "query_annotation.bed")
+    loss_summ = os.path.join(out_dir, "loss_summ_data.tsv")
+    timer.run(
+        "gene_losses_summary", gene_losses_summary, dirs["loss_data"], paths["bed"],
+        intermediate_bed, query_annotation, loss_summ, iforms_file=paths["isoforms"],
+    )
+    query_isoforms = os.path.join(out_dir, "query_isoforms.tsv")
+    timer.run("make_query_isoforms", get_query_isoforms_data, query_annotation, query_isoforms)
+    timer.run(
+        "orthology_type_map", orthology_type_map, paths["bed"], query_annotation,
+        os.path.join(out_dir, "orthology_classification.tsv"), ref_iso=paths["isoforms"],
+        que_iso=query_isoforms, loss_data=loss_summ,
+        save_skipped=os.path.join(out_dir, "ref_orphan_transcripts.txt"), orth_scores_arg=orth_scores,
+    )
+    return timer, None
+
+
+def find_previous_results(results_dir, params):
+    """Find the latest saved results for the same dataset."""
+    if not os.path.isdir(results_dir):
+        return None
+    candidates = []
+    for filename in os.listdir(results_dir):
+        if not filename.endswith(".json"):
+            continue
+        path = os.path.join(results_dir, filename)
+        f = open(path, "r")
+        results = json.load(f)
+        f.close()
+        if results["dataset"] == params:
+            candidates.append((results["date"], path))
+    return max(candidates)[1] if candidates else None
+
+
+def compare_results(results, previous_path):
+    """Print runtime of the stages next to the previous results."""
+    f = open(previous_path, "r")
+    previous = json.load(f)
+    f.close()
+    print(f"\nComparison with {previous['commit']} ({previous_path}):")
+    print("stage\tprevious\tcurrent\tratio")
+    for stage, timing in results["stages"].items():
+        prev_timing = previous["stages"].get(stage)
+        if prev_timing is None:
+            print(f"{stage}\t-\t{timing['wall_time']:.3f}\t-")
+            continue
+        ratio = timing["wall_time"] / prev_timing["wall_time"] if prev_timing["wall_time"] > 0 else 1.0
+        mark = "\tSLOWER" if ratio > SLOWER_WARN_RATIO else ""
+        print(f"{stage}\t{prev_timing['wall_time']:.3f}\t{timing['wall_time']:.3f}\t{ratio:.2f}{mark}")
+
+
+def main():
+    """Entry point."""
+    args = parse_args()
+    os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
+    paths, params = get_data(args)
+    timer, stopped_reason = run_stages(args, paths)
+    if stopped_reason:
+        print(f"Remaining stages skipped: {stopped_reason}")
+    stages = timer.stages
+    if args.stages:
+        selected = args.stages.split(",")
+        stages = {k: v for k, v in stages.items() if k in selected}
+
+    commit, dirty = get_commit()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": str(dt.now()),
+        "repeats": args.repeats,
+        "cesar_binary": args.cesar_binary,
+        "dataset": params,
+        "stages": stages,
+    }
+    previous_path = args.compare or find_previous_results(args.results_dir, params)
+    if previous_path:
+        compare_results(results, previous_path)
+    if args.no_save:
+        return
+    os.makedirs(args.results_dir, exist_ok=True)
+    timestamp = dt.now().strftime("%Y%m%d_%H%M%S")
+    results_path = os.path.join(args.results_dir, f"{commit}{'_dirty' if dirty else ''}_{timestamp}.json")
+    f = open(results_path, "w")
+    json.dump(results, f, indent=2)
+    f.close()
+    print(f"Results saved to {results_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,12 @@ import argparse
 import os.path
 import sys
 import subprocess
+import time
 from subprocess import PIPE
 from modules.common import to_log
 from modules.common import setup_logger
+from modules.job_profiler import JobsProfiler
+from modules.resource_usage import save_job_usage
 from version import __version__
 
 __author__ = "Bogdan M. Kirilenko"
@@ -30,6 +33,14 @@ def parse_args():
     app.add_argument("--log_file", help="Main log file")
     app.add_argument("--rejected_log", default=None, help="Log gene rejection events")
     app.add_argument("--unproc_log", "--ul", default=None, help="Log unprocessed genes")
+    app.add_argument(
+        "--cesar_cache", default=None, help="Reuse CESAR output cached in this directory"
+    )
+    app.add_argument(
+        "--stats_file",
+        default=None,
+        help="Save job wall time, CPU time, peak memory and I/O to this JSON file",
+    )
     # print help if there are no args
     if len(sys.argv) < 2:
         app.print_help()
@@ -72,6 +83,7 @@ def __job_to_transcript(job):
 
 def main():
     """Entry point."""
+    start_time = time.time()
     args = parse_args()
     setup_logger(args.log_file, write_to_console=False)
     filename = os.path.basename(args.jobs_file)
@@ -87,11 +99,16 @@ def main():
     out = open(args.output, "w")  # handle output file
     gene_loss_data = []  # list to keep gene loss detector out
     rejected = []  # keep genes that were skipped at this stage + reason
+    # the slowest CESAR wrapper jobs are saved if profiling is enabled
+    profiler = JobsProfiler("CESAR_wrapper")
 
     for num, job in enumerate(jobs, 1):
         to_log(f"{log_prefix}: calling job {job}")
         # catch job stdout
-        job_out, rc = call_job(job)
+        job_cmd = f"{job} --cesar_cache {args.cesar_cache}" if args.cesar_cache else job
+        job_t0 = time.time()
+        job_out, rc = call_job(job_cmd)
+        profiler.add_timing(" ".join(job.split()[1:3]), time.time() - job_t0)
         to_log(f"{log_prefix}: return code: {rc}")
         if rc == FRAGM_CHAIN_ISSUE_CODE:
             # very special case -> nothig we can do
@@ -161,18 +178,23 @@ def main():
             f.write("\n\n")  # separator for diff genes
         f.close()
 
-    if args.rejected_log:
-        # save list of unprocessed genes + reasons
-        f = open(args.rejected_log, "w")
-        f.write("".join(rejected))
-        f.close()
-
     if args.unproc_log and len(unprocessed_genes) > 0:
         f = open(args.unproc_log, "w")
         for elem in unprocessed_genes:
             f.write(f"{elem}\n")
         f.close()
 
+    profiler.save_slowest(filename)
+    if args.stats_file:
+        save_job_usage(args.stats_file, "cesar_runner", filename, start_time, jobs_num)
+
+    if args.rejected_log:
+        # save list of unprocessed genes + reasons
+        # written last: marks that the joblist is done
+        f = open(args.rejected_log, "w")
+        f.write("".join(rejected))
+        f.close()
+
 
 if __name__ == "__main__":
     main()
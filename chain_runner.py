@@ -9,6 +9,8 @@ import argparse
 import sys
 import os
 from datetime import datetime as dt
+import numpy as np
+from constants import Constants
 from modules.overlap_select import overlap_select
 from modules.common import bed_extract_id
 from modules.common import make_cds_track
@@ -16,6 +18,8 @@ from modules.common import die
 from modules.common import load_chain_dict
 from modules.common import setup_logger
 from modules.common import to_log
+from modules.job_profiler import JobsProfiler
+from modules.resource_usage import save_job_usage
 from version import __version__
 
 __author__ = "Bogdan M. Kirilenko"
@@ -50,6 +54,23 @@ def parse_args():
         help="Write the output in extended (human readable) format. "
         "Is not recommended for genome-wide scale.",
     )
+    app.add_argument(
+        "--records_out",
+        default=None,
+        help="Save chain features as typed records (numpy .npz shard) to this file "
+        "instead of writing text features to stdout. Used by TOGA.",
+    )
+    app.add_argument(
+        "--profile_dir",
+        default=None,
+        help="Profile a fraction of chains and save the profiles and the slowest "
+        "chains to this directory, TOGA_PROFILE_DIR environment variable is used if not set",
+    )
+    app.add_argument(
+        "--stats_file",
+        default=None,
+        help="Save job wall time, CPU time, peak memory and I/O to this JSON file",
+    )
     # print help if there are no args
     if len(sys.argv) < 2:
         app.print_help()
@@ -375,6 +396,9 @@ def get_features(work_data, result, bed_lines_extended, nested=False):
         assert local_exo >= 0
         assert local_exo <= 1
         result["local_exons"] += "{0}={1},".format(gene, local_exo)
+        result["transcript_feats"].append(
+            (gene, blocks_v_cds, blocks_v_introns, flank_feature, local_exo)
+        )
         # increase synteny if > 0 CDS bases covered
         if blocks_v_cds > 0:
             result["chain_synteny"] += 1
@@ -441,6 +465,41 @@ def make_output(work_data, result, t0):
     return chain_output, genes_output, time_output
 
 
+def make_records(work_data, result):
+    """Arrange the output as chain-transcript records.
+
+    Record fields follow Constants.CHAIN_FEATURES_RECORD_FIELDS.
+    """
+    chain_id = int(work_data["chain_id"])
+    records = []
+    for gene, exon_cover, intr_cover, flank_cov, loc_exo in result["transcript_feats"]:
+        record = (
+            gene,
+            chain_id,
+            result["chain_synteny"],
+            result["chain_global_score"],
+            result["global_exo"],
+            result["Exlen_to_Qlen"],
+            loc_exo,
+            exon_cover,
+            intr_cover,
+            flank_cov,
+            result["chain_len"],
+        )
+        records.append(record)
+    return records
+
+
+def save_records(records, path):
+    """Save chain-transcript records as a numpy columnar shard."""
+    columns = {}
+    for num, (field, dtype) in enumerate(Constants.CHAIN_FEATURES_RECORD_FIELDS):
+        columns[field] = np.array([r[num] for r in records], dtype=dtype)
+    # np.savez appends .npz to the filename otherwise
+    with open(path, "wb") as f:
+        np.savez(f, **columns)
+
+
 def extended_output(result, t0):
     """Make human-readable output for small tests."""
     chain_output = "Chain-related features:\n"
@@ -456,9 +515,19 @@ def extended_output(result, t0):
 
 
 def chain_feat_extractor(
-    chain_id, transcripts, chain_file, bed_file, chain_dict, verbose_arg=None, extended=False
+    chain_id,
+    transcripts,
+    chain_file,
+    bed_file,
+    chain_dict,
+    verbose_arg=None,
+    extended=False,
+    records=False,
 ):
-    """Chain features extractor entry point."""
+    """Chain features extractor entry point.
+
+    If records is set, return a list of chain-transcript records
+    and the time output instead of the text output."""
     # global vars
     t0 = dt.now()
     to_log(f"processing chain_id: {chain_id} transcripts: {transcripts}")
@@ -485,6 +554,7 @@ def chain_feat_extractor(
         "local_exons": "",
         "gene_overlaps": [],
         "Exlen_to_Qlen": 0,
+        "transcript_feats": [],
     }
     # check if all the files, dependencies etc are correct
     check_args(
@@ -516,7 +586,10 @@ def chain_feat_extractor(
         bed_lines_extended += f"{work_data['nested']}\n"
         get_features(work_data, result, bed_lines_extended, nested=True)
     # make a tuple with chain, genes and time output
-    if not extended:
+    if records:
+        # typed records, TOGA merges them without parsing text
+        output = make_records(work_data, result), f"#estimated time: {dt.now() - t0}\n"
+    elif not extended:
         # provide short version of output
         output = make_output(work_data, result, t0)
     else:
@@ -547,10 +620,14 @@ def main():
 
     # call main processing tool
     # TODO: rename genes to transcripts where appropropriate
+    records = []  # used if args.records_out is set
+    profiler = JobsProfiler("chain_runner", args.profile_dir)
     for job_num, (chain, transcripts) in enumerate(batch.items(), 1):
         # one unit: one chain + intersected genes
         # call routine that extracts chain feature
-        unit_output = chain_feat_extractor(
+        unit_output = profiler.run(
+            f"chain {chain} transcripts {transcripts}",
+            chain_feat_extractor,
             chain,
             transcripts,
             args.chain_file,
@@ -558,14 +635,27 @@ def main():
             chain_dict,
             verbose_arg=args.verbose,
             extended=args.extended,
+            records=args.records_out is not None,
         )
+        if args.records_out:
+            unit_records, time_output = unit_output
+            records.extend(unit_records)
+            sys.stdout.write(time_output)
+            continue
         chain_output, genes_output, time_output = unit_output
         # stdout is used by subsequent TOGA commands
         sys.stdout.write(chain_output)
         sys.stdout.write(genes_output)
         sys.stdout.write(time_output)
         # sys.stderr.write(f"Job {job_num}/{task_size} done\r") if args.verbose else None
+    if args.records_out:
+        save_records(records, args.records_out)
+        to_log(f"Saved {len(records)} chain-transcript records to {args.records_out}")
     to_log(f"Total job time: {dt.now() - t0}")
+    if args.stats_file:
+        job_name = os.path.basename(args.input_file)
+        save_job_usage(args.stats_file, "chain_runner", job_name, t0.timestamp(), task_size)
+    profiler.save_slowest(os.path.basename(args.input_file))
 
 
 if __name__ == "__main__":
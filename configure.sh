@@ -35,6 +35,7 @@ if $CLEANUP; then
     rm -f "${my_dir}"/modules/chain_filter_by_id
     rm -rf ./CESAR2.0
     rm -f ./models/*.dat
+    rm -f ./models/*.json
     echo "Cleanup completed"
 fi
 
@@ -59,6 +60,12 @@ gcc $CFLAGS -fPIC -shared -o "${my_dir}"/modules/chain_bst_lib.so "${my_dir}"/mo
 if ! $OVERRIDE && { [[ -f "./models/se_model.dat" ]] || [[ -f "./models/me_model.dat" ]]; }
 then
     printf "Model found\n";
+    for model in se_model me_model; do
+        if [[ -f "./models/${model}.dat" ]] && [[ ! -f "./models/${model}.json" ]]; then
+            printf "Exporting ${model} to JSON\n"
+            python3 modules/tree_model.py "./models/${model}.dat" "./models/${model}.json"
+        fi
+    done
 else
     printf "XGBoost model not found\nTraining...\n"
     eval "python3 train_model.py"
@@ -13,8 +13,9 @@ class Constants:
     ISOFORMS_FILE_COLS = 2
     NF_DIR_NAME = "nextflow_logs"
     NEXTFLOW = "nextflow"
-    CESAR_PUSH_INTERVAL = 30  # CESAR jobs push interval
-    ITER_DURATION = 60  # CESAR jobs check interval
+    MONITOR_MIN_INTERVAL = 1  # first parallel jobs check interval, seconds
+    MONITOR_MAX_INTERVAL = 60  # check interval grows up to this value
+    MONITOR_BACKOFF = 2  # check interval multiplier
     MEMLIM_ARG = "--memlim"
     FRAGM_ARG = "--fragments"
 
@@ -29,14 +30,56 @@ class Constants:
     CESAR_PRECOMPUTED_ORTHO_LOCI_DATA = "cesar_precomputed_orthologous_loci.tsv"
 
     NUM_CESAR_MEM_PRECOMP_JOBS = 500
-    PARA_STRATEGIES = ["nextflow", "para", "custom"]  # TODO: add snakemake
+    PARA_STRATEGIES = ["nextflow", "para", "local", "custom"]  # TODO: add snakemake
 
     TEMP_CHAIN_CLASS = "temp_chain_trans_class"
     MODULES_DIR = "modules"
     RUNNING = "RUNNING"
     CRASHED = "CRASHED"
+    MANIFEST = "toga_manifest.json"
+    # these arguments do not affect the results: can be changed to resume a run
+    RESUME_IGNORED_ARGS = {
+        "resume",
+        "quiet",
+        "time_marks",
+        "keep_temp",
+        "nextflow_dir",
+        "nextflow_config_dir",
+        "do_not_del_nf_logs",
+        "parallelization_strategy",
+        "cluster_queue_name",
+        "local_pool_size",
+        "cesar_split_processes",
+        "stitch_processes",
+        "orthology_processes",
+        "local_memory_limit",
+        "max_poll_interval",
+        "incremental_merge",
+        "cesar_exec_seq",
+        "cesar_cache_dir",
+        "cesar_cache_size",
+        "profile_dir",
+        "profile_fraction",
+    }
     TEMP = "temp"
 
+    # typed chain features records: chain_runner.py -> merge_chains_output.py
+    # field name and numpy dtype, one record per chain-transcript pair
+    CHAIN_FEATURES_SHARD_EXT = ".npz"
+    CHAIN_FEATURES_RECORD_FIELDS = (
+        ("gene", "U"),
+        ("chain", "int64"),
+        ("synt", "int64"),
+        ("gl_score", "int64"),
+        ("gl_exo", "float64"),
+        ("exon_qlen", "float64"),
+        ("loc_exo", "float64"),
+        ("exon_cover", "int64"),
+        ("intr_cover", "int64"),
+        ("flank_cov", "float64"),
+        ("chain_len", "int64"),
+    )
+
     # lists of features required by single and multi exon models
     SE_MODEL_FEATURES = ["gl_exo", "flank_cov", "exon_perc", "synt_log"]
     ME_MODEL_FEATURES = ["gl_exo", "loc_exo", "flank_cov", "synt_log", "intr_perc"]
@@ -0,0 +1,135 @@
+"""Content-addressed cache of CESAR output.
+
+CESAR input contains everything that defines its output:
+reference exon sequences with splice site profiles (U12 data,
+masked stop codons) and query loci sequences. So, the cache key
+is a hash of CESAR input and the CESAR binary.
+Chain IDs and coordinates are not a part of the key: they change
+each time chains are re-computed. Query headers in the key are
+replaced by query numbers, query headers of the cached output are
+replaced by the current chain IDs. The -x CESAR flag only sets
+the memory limit, it does not change the output.
+
+Each output is a file in the cache directory, reading updates
+file modification time, the least recently used files are
+removed if the cache is too big.
+"""
+import hashlib
+import os
+import shutil
+import uuid
+
+try:
+    from modules.common import to_log
+except ImportError:
+    from common import to_log
+
+__author__ = "Bogdan M. Kirilenko"
+
+MODULE_NAME_FOR_LOG = "cesar_cache"
+CACHE_VERSION = "2"
+BYTES_IN_GB = 1024 ** 3
+TARGET_QUERY_SEP = "####\n"
+CESAR_OUT_BLOCK_LEN = 4  # reference header and sequence, query header and sequence
+QUERY_HEADER_IND = 2
+
+
+def get_cache_key(cesar_input, cesar_binary):
+    """Get hash of CESAR input and binary.
+
+    cesar_input: iterable of strings, CESAR input is their concatenation;
+    query headers must be separate strings, as make_cesar_in writes them.
+    """
+    cesar_binary = os.path.realpath(shutil.which(cesar_binary) or cesar_binary)
+    binary_stat = os.stat(cesar_binary)
+    key_hash = hashlib.sha256()
+    key_hash.update(
+        f"{CACHE_VERSION}\t{cesar_binary}\t"
+        f"{binary_stat.st_size}\t{binary_stat.st_mtime_ns}\n".encode()
+    )
+    query_num = None  # None for reference exons, before ####
+    for chunk in cesar_input:
+        if query_num is not None and chunk.startswith(">"):
+            chunk = f">query_{query_num}\n"  # do not hash chain IDs
+            query_num += 1
+        elif chunk == TARGET_QUERY_SEP:
+            query_num = 0
+        key_hash.update(chunk.encode())
+    return key_hash.hexdigest()
+
+
+def set_query_ids(cesar_out, query_ids):
+    """Replace query headers of CESAR output with the current query IDs.
+
+    CESAR writes the alignments in the order of the input queries.
+    """
+    lines = cesar_out.split("\n")
+    for num, query_id in enumerate(query_ids):
+        lines[num * CESAR_OUT_BLOCK_LEN + QUERY_HEADER_IND] = f">{query_id}"
+    return "\n".join(lines)
+
+
+class CesarCache:
+    """CESAR output cache, shared by concurrent CESAR jobs."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def __get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """Get cached CESAR output, None if not found."""
+        path = self.__get_path(key)
+        try:
+            f = open(path, "r")
+            cesar_out = f.read()
+            f.close()
+            os.utime(path)  # mark recently used
+        except FileNotFoundError:  # not cached or evicted
+            return None
+        return cesar_out
+
+    def put(self, key, cesar_out):
+        """Save CESAR output."""
+        path = self.__get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file first: other jobs never read a partial output
+        temp_path = f"{path}.{uuid.uuid4()}.tmp"
+        f = open(temp_path, "w")
+        f.write(cesar_out)
+        f.close()
+        os.replace(temp_path, path)
+
+
+def evict_cesar_cache(cache_dir, max_size_gb):
+    """Remove the least recently used outputs until the cache fits max size."""
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    total_size = 0
+    for dirpath, _, filenames in os.walk(cache_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+            total_size += stat.st_size
+    max_size = max_size_gb * BYTES_IN_GB
+    to_log(
+        f"{MODULE_NAME_FOR_LOG}: {len(entries)} CESAR outputs cached, "
+        f"{total_size / BYTES_IN_GB:.2f}Gb of {max_size_gb}Gb"
+    )
+    if total_size <= max_size:
+        return
+    entries.sort()
+    removed = 0
+    for _, size, path in entries:
+        if total_size <= max_size:
+            break
+        os.remove(path) if os.path.isfile(path) else None
+        total_size -= size
+        removed += 1
+    to_log(f"{MODULE_NAME_FOR_LOG}: removed {removed} least recently used CESAR outputs")
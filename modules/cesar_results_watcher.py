@@ -0,0 +1,91 @@
+"""Process CESAR results while CESAR jobs are still running.
+
+cesar_runner.py writes the rejection log after the results and the
+inactivating mutations data files. So, if a rejection log exists,
+the job that has the same output filename is done, and its output
+can be merged without waiting for the rest of CESAR jobs.
+"""
+import os
+
+try:
+    from modules.common import to_log
+    from modules.gene_losses_summary import init_loss_data
+    from modules.gene_losses_summary import read_loss_file
+except ImportError:
+    from common import to_log
+    from gene_losses_summary import init_loss_data
+    from gene_losses_summary import read_loss_file
+
+__author__ = "Bogdan M. Kirilenko"
+
+MODULE_NAME_FOR_LOG = "cesar_results_watcher"
+RESULTS_EXT = ".txt"
+LOSS_DATA_EXT = ".inact_mut.txt"
+
+
+class CesarResultsWatcher:
+    """Merge output of finished CESAR jobs.
+
+    merger: CesarOutputMerger that saves the merged CESAR output,
+    inactivating mutations data is read into the loss_data attribute,
+    see gene_losses_summary.read_loss_data.
+    """
+
+    def __init__(self, merger, results_dir, loss_data_dir, done_marks_dir):
+        self.merger = merger
+        self.results_dir = results_dir
+        self.loss_data_dir = loss_data_dir
+        self.done_marks_dir = done_marks_dir
+        self.loss_data = init_loss_data()
+        self.merged_results = set()
+        self.read_loss_files = set()
+
+    def __add_results(self, filename):
+        self.merger.add_file(os.path.join(self.results_dir, filename))
+        self.merged_results.add(filename)
+
+    def __add_loss_data(self, filename):
+        read_loss_file(os.path.join(self.loss_data_dir, filename), self.loss_data)
+        self.read_loss_files.add(filename)
+
+    def poll(self):
+        """Merge output of the CESAR jobs finished since the last call."""
+        if not os.path.isdir(self.results_dir) or not os.path.isdir(self.done_marks_dir):
+            return
+        done = set(os.listdir(self.done_marks_dir))
+        new_results = [
+            x for x in os.listdir(self.results_dir)
+            if x.endswith(RESULTS_EXT) and x in done and x not in self.merged_results
+        ]
+        for filename in new_results:
+            self.__add_results(filename)
+            loss_filename = filename[: -len(RESULTS_EXT)] + LOSS_DATA_EXT
+            if os.path.isfile(os.path.join(self.loss_data_dir, loss_filename)):
+                self.__add_loss_data(loss_filename)
+        if new_results:
+            to_log(
+                f"{MODULE_NAME_FOR_LOG}: merged output of {len(new_results)} finished CESAR jobs, "
+                f"{len(self.merged_results)} in total"
+            )
+
+    def finalize(self):
+        """Merge output of the remaining CESAR jobs, including re-executed ones.
+
+        Return list of files that were not parsed, like merge_cesar_output.
+        """
+        remaining_results = [
+            x for x in os.listdir(self.results_dir)
+            if x.endswith(RESULTS_EXT) and x not in self.merged_results
+        ]
+        remaining_loss_files = [
+            x for x in os.listdir(self.loss_data_dir) if x not in self.read_loss_files
+        ]
+        to_log(
+            f"{MODULE_NAME_FOR_LOG}: {len(self.merged_results)} CESAR output files were merged "
+            f"while the jobs were running, merging the remaining {len(remaining_results)}"
+        )
+        for filename in remaining_results:
+            self.__add_results(filename)
+        for filename in remaining_loss_files:
+            self.__add_loss_data(filename)
+        return self.merger.close()
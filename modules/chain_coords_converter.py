@@ -0,0 +1,54 @@
+"""Project reference regions to the query through a chain.
+
+Python interface of the chain_coords_converter_slib shared library.
+"""
+import ctypes
+import os
+import numpy as np
+
+__author__ = "Bogdan M. Kirilenko"
+
+LOCATION = os.path.dirname(os.path.abspath(__file__))
+CHAIN_INFO_SIZE = 8  # tSize, tStrand, tStart, tEnd, qSize, qStrand, qStart, qEnd
+
+# connect shared lib; define input and output data types
+ch_lib = ctypes.CDLL(os.path.join(LOCATION, "chain_coords_converter_slib.so"))
+ch_lib.chain_coords_converter_batch.argtypes = [
+    ctypes.c_char_p,
+    ctypes.c_int,
+    np.ctypeslib.ndpointer(dtype=np.intc, flags="C_CONTIGUOUS"),
+    ctypes.c_int,
+    np.ctypeslib.ndpointer(dtype=np.int64, flags="C_CONTIGUOUS"),
+    np.ctypeslib.ndpointer(dtype=np.int64, flags="C_CONTIGUOUS"),
+    np.ctypeslib.ndpointer(dtype=np.int64, flags="C_CONTIGUOUS"),
+]
+ch_lib.chain_coords_converter_batch.restype = ctypes.c_int
+
+
+def chain_coords_converter(chain_str, t_regions, shifts=(2,)):
+    """Project regions through a chain, for each shift.
+
+    t_regions: (start, end) pairs in the chain reference chromosome.
+    shifts: numbers of flanking chain blocks to add to query regions.
+    Return chain header values: (t_size, t_strand, t_start, t_end,
+    q_size, q_strand, q_start, q_end) and int64 array of query
+    regions with shape (shifts number, regions number, 2).
+    """
+    t_regions_arr = np.array(t_regions, dtype=np.int64).reshape(-1, 2)
+    regions_num = len(t_regions_arr)
+    q_regions_arr = np.zeros((len(shifts), regions_num, 2), dtype=np.int64)
+    chain_info = np.zeros(CHAIN_INFO_SIZE, dtype=np.int64)
+    ret = ch_lib.chain_coords_converter_batch(
+        chain_str.encode(),
+        len(shifts),
+        np.array(shifts, dtype=np.intc),
+        regions_num,
+        t_regions_arr,
+        q_regions_arr,
+        chain_info,
+    )
+    if ret != 0:
+        raise RuntimeError("chain_coords_converter: cannot parse the chain")
+    t_size, t_strand, t_start, t_end, q_size, q_strand, q_start, q_end = chain_info.tolist()
+    chain_data = (t_size, bool(t_strand), t_start, t_end, q_size, bool(q_strand), q_start, q_end)
+    return chain_data, q_regions_arr
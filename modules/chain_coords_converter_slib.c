@@ -1,16 +1,29 @@
 /*
 To be compiled as a shared library
-chain_coords_converter function
+chain_coords_converter_batch function
 For a chain and a list of regions in the reference genome
 make a list of corresponding regions in the query genome
 Briefly: project regions through a chain
 
+The chain is parsed once, then regions are projected with each shift.
+Results are written to the arrays allocated by the caller,
+the function frees all memory it allocates.
+
 Input:
 chain -> string containing chain (header + blocks)
-shift -> integer > 0: number of flanking blocks; the bigger is shift
-         the bigger are corresponding regions in the query
-regions num -> integer > 0, number of reference genome regions
-granges -> list of strings, each string: reference genome region
+shifts_num -> integer > 0, number of shifts
+shifts -> array of integers >= 0: number of flanking blocks; the bigger is shift
+          the bigger are corresponding regions in the query
+regions_num -> integer > 0, number of reference genome regions
+t_regions -> int64 array of regions_num (start, end) pairs, regions
+             in the chain reference chromosome
+
+Output:
+q_regions -> int64 array of shifts_num * regions_num (start, end) pairs:
+             corresponding regions in the query, for each shift
+chain_info -> int64 array of CHAIN_INFO_SIZE values from the chain header:
+              tSize, tStrand, tStart, tEnd, qSize, qStrand, qStart, qEnd
+Returns 0, or 1 if the chain cannot be parsed or memory cannot be allocated
 
 Author: Bogdan Kirilenko, 2020;
 */
@@ -21,310 +34,279 @@ Author: Bogdan Kirilenko, 2020;
 #include <stdint.h>
 #include "chain.h"
 
-#define MAXCHAR 255
-#define DEFAULT_SHIFT 2
 #define NUM_BASE 10
+#define CHAIN_INFO_SIZE 8
 
-
-char ** chain_coords_converter(char *chain, int shift, int regions_num, char **granges)
+// absolute coordinates of chain blocks
+struct Chain_blocks
 {
-    // parse region from argv[2]; looks like chromN:start-end
-    struct Regions t_regions[regions_num];
-
-    for (int i = 0; i < regions_num; i++)
-    {
-        // parse regions; their format should be chrom:start-end
-        int reg_index = i;
-        char *current_region = granges[i];
-        // format requires 2 splits: by : and then by -
-        char *reg_split = strtok(current_region, ":");
-        strcpy(t_regions[reg_index].chrom, reg_split);
-        reg_split = strtok(NULL, ":");
+    int64_t num;
+    int64_t *t_starts;
+    int64_t *t_ends;
+    int64_t *q_starts;
+    int64_t *q_ends;
+};
 
-        char *split_range = strtok(reg_split, "-");
-        t_regions[reg_index].start = strtol(split_range, NULL, NUM_BASE);
-        split_range = strtok(NULL, "-");
-        t_regions[reg_index].end = strtol(split_range, NULL, NUM_BASE);
-    }  // end regions parsing
 
-    for (int i = 0; i<regions_num; i++)
-    {
-        // check that start < end in each region
-        // if that not true -> switch them
-        if (t_regions[i].start > t_regions[i].end)
-        {
-            // this is an extraordinary situation, so let user know about this
-            fprintf(stderr, "Warning! End < Start in the region num %d! Switching...\n", i);
-            int temp = t_regions[i].start;
-            t_regions[i].start = t_regions[i].end;
-            t_regions[i].end = temp;
-        }
-    }  // end regions checking
-
-    // global search iterables
-    // about most of them: they are arrays, one per region
-    bool head_caught = false;  // flag; true if header was parsed
-    bool starts_found[regions_num];
-    bool ends_found[regions_num];
-    bool finished[regions_num];
-
-    // need to do memset here
-    memset(starts_found, false, regions_num * sizeof(bool));
-    memset(ends_found, false, regions_num * sizeof(bool));
-    memset(finished, false, regions_num * sizeof(bool));
-
-    struct Chain_info head;  // parse head information there
+void free_chain_blocks(struct Chain_blocks *blocks)
+{
+    free(blocks->t_starts);
+    free(blocks->t_ends);
+    free(blocks->q_starts);
+    free(blocks->q_ends);
+}
 
-    // variables to collect the results I need
-    int starts_in_q[regions_num];
-    int ends_in_q[regions_num];
-    memset(starts_in_q, 0, regions_num * sizeof(int));
-    memset(ends_in_q, 0, regions_num * sizeof(int));
 
-    // hold previous SHIFT + 1 values and NEXT SHIFT + 1 values
-    int *starts_buff = (int*)calloc((shift + 2), sizeof(int));
-    int *ks = (int*)calloc(regions_num, sizeof(int));
+int64_t parse_field(const char **pos, const char *line_end)
+{
+    // read integer field of a chain block line, move to the next field
+    if (*pos >= line_end) {return 0;}
+    char *num_end;
+    int64_t value = strtoll(*pos, &num_end, NUM_BASE);
+    if (num_end > line_end) {return 0;}  // the field is empty, number belongs to the next line
+    *pos = (num_end < line_end) ? num_end + 1 : line_end;
+    return value;
+}
 
-    // variables describing each block
-    // intermediate loop values
-    // variables called as pointers BUT
-    // they are not pointers!
-    int t_start_pointer = 0;
-    int q_start_pointer = 0;
-    int blockTStarts = 0;
-    int blockTEnds = 0;
-    int blockQStarts = 0;
-    int blockQEnds = 0;
-    int prevBlockQEnds = 0;
 
-    // this is how we can read a string
-    // line-by-line (lines separated by \n)
-    char * curLine = chain;
+int parse_chain(const char *chain, struct Chain_info *head, struct Chain_blocks *blocks)
+{
+    // parse chain header and blocks
+    // each line is a block, the header line is a block of size 0
+    // at the chain start, the same is true for empty lines
+    const char *header_end = strchr(chain, '\n');
+    size_t header_len = header_end ? (size_t)(header_end - chain) : strlen(chain);
+    char *header = malloc(header_len + 1);
+    if (header == NULL) {return 1;}
+    memcpy(header, chain, header_len);
+    header[header_len] = '\0';
+    *head = parse_head(header);  // parse_head changes the string
+    free(header);
+
+    int64_t lines_num = 1;
+    for (const char *c = chain; *c; c++) {if (*c == '\n') {lines_num++;}}
+    blocks->num = 0;
+    blocks->t_starts = malloc(lines_num * sizeof(int64_t));
+    blocks->t_ends = malloc(lines_num * sizeof(int64_t));
+    blocks->q_starts = malloc(lines_num * sizeof(int64_t));
+    blocks->q_ends = malloc(lines_num * sizeof(int64_t));
+    if (!blocks->t_starts || !blocks->t_ends || !blocks->q_starts || !blocks->q_ends)
+    {
+        free_chain_blocks(blocks);
+        return 1;
+    }
 
-    while(curLine)
+    int64_t t_start_pointer = head->tStart;
+    int64_t q_start_pointer = head->qStart;
+    const char *cur_line = chain;
+    bool is_header = true;
+    while (cur_line)
     {
-        char * nextLine = strchr(curLine, '\n');
-        if (nextLine)
+        const char *next_line = strchr(cur_line, '\n');
+        const char *line_end = next_line ? next_line : cur_line + strlen(cur_line);
+        int64_t size = 0, dt = 0, dq = 0;
+        if (!is_header)
         {
-            *nextLine = '\0';
+            const char *pos = cur_line;
+            size = parse_field(&pos, line_end);
+            dt = parse_field(&pos, line_end);
+            dq = parse_field(&pos, line_end);
         }
+        is_header = false;
+        int64_t i = blocks->num;
+        blocks->t_starts[i] = t_start_pointer;
+        blocks->q_starts[i] = q_start_pointer;
+        blocks->t_ends[i] = t_start_pointer + size;
+        blocks->q_ends[i] = q_start_pointer + size;
+        t_start_pointer = blocks->t_ends[i] + dt;
+        q_start_pointer = blocks->q_ends[i] + dq;
+        blocks->num++;
+        cur_line = next_line ? next_line + 1 : NULL;
+    }
+    return 0;
+}
 
-        // parse head if it wasn't
-        // this should happen at the first iteration
-        if (!head_caught)
-        {
-            // chain head should be caught only once
-            // because we operate with a single chain
-            // which is also produced by TOGA
-            head_caught = true;
-            head = parse_head(curLine);
-            t_start_pointer = head.tStart;
-            q_start_pointer = head.qStart;
-
-            prevBlockQEnds = head.qStart;  // init previous block end with the chain's start
-
-            for (int i = 0; i < regions_num; i++)
-            // go region-by-region
-            {
-                if (strcmp(t_regions[i].chrom, head.tName) != 0)
-                {
-                    // if the range starts with chrN, but chain is aligned to the chrM,
-                    // it is wrong, so those regions must be skipped
-                    // likely an error, it also might happen if some gene identifier
-                    // belongs to some different chromosomes
-                    fprintf(stderr, "Error! Requested range num %d lies in the chromosome %s "
-                                    "meanwhile the chain covers chrom %s in target genome\n",
-                            i, t_regions[i].chrom, head.tName);
-                    starts_found[i] = true;
-                    ends_found[i] = true;
-                    starts_in_q[i] = 0;
-                    ends_in_q[i] = 0;
 
-                // it the region lies outside the chain, it also should be noticed
-                } else if (t_regions[i].end < head.tStart) {
-                    fprintf(stderr, "Warning! Query %d lies outside the chain borders (to the left)\n", i);
-                    starts_found[i] = true;
-                    ends_found[i] = true;
-                    starts_in_q[i] = (!head.qStrand) ? head.qSize - head.qEnd : head.qStart;
-                    ends_in_q[i] = starts_in_q[i] + 1;
-                    // ends_in_q[i] = (!head.qStrand) ? head.qSize - head.qStart : head.qEnd;
-                
-                // the same situation here
-                } else if (t_regions[i].start > head.tEnd) {
-                    fprintf(stderr, "Warning! Query %d lies outside the chain borders (to the right)\n", i);
-                    starts_found[i] = true;
-                    ends_found[i] = true;
-                    // start_in_q = (!head.qStrand) ? head.qSize - head.qEnd : head.qStart;
-                    ends_in_q[i] = (!head.qStrand) ? head.qSize - head.qStart : head.qEnd;
-                    starts_in_q[i] = ends_in_q[i] - 1;
-                }
-
-            }  // end region checking
-        }  // end chain header parsing
+int convert_regions(struct Chain_info *head, struct Chain_blocks *blocks, int shift,
+                    int regions_num, int64_t *t_regions, int64_t *q_regions)
+{
+    // project regions through the chain with the shift given
+    bool *starts_found = calloc(regions_num, sizeof(bool));
+    bool *ends_found = calloc(regions_num, sizeof(bool));
+    bool *finished = calloc(regions_num, sizeof(bool));
+    int64_t *starts_in_q = calloc(regions_num, sizeof(int64_t));
+    int64_t *ends_in_q = calloc(regions_num, sizeof(int64_t));
+    int *ks = calloc(regions_num, sizeof(int));
+    // hold previous SHIFT + 1 values
+    int64_t *starts_buff = calloc(shift + 2, sizeof(int64_t));
+    int ret = 0;
+    if (!starts_found || !ends_found || !finished || !starts_in_q || !ends_in_q || !ks || !starts_buff)
+    {
+        ret = 1;
+        goto cleanup;
+    }
 
-        // each chain ends with double /n
-        else if (strcmp(curLine, "\n") == 0) 
+    for (int i = 0; i < regions_num; i++)
+    {
+        int64_t t_start = t_regions[2 * i];
+        int64_t t_end = t_regions[2 * i + 1];
+        // it the region lies outside the chain, it should be noticed
+        if (t_end < head->tStart)
         {
-            // if the chain is over -> break
-            // because the input consists on a single chain
-            break;
+            fprintf(stderr, "Warning! Query %d lies outside the chain borders (to the left)\n", i);
+            starts_found[i] = true;
+            ends_found[i] = true;
+            starts_in_q[i] = (!head->qStrand) ? head->qSize - head->qEnd : head->qStart;
+            ends_in_q[i] = starts_in_q[i] + 1;
+        } else if (t_start > head->tEnd) {
+            fprintf(stderr, "Warning! Query %d lies outside the chain borders (to the right)\n", i);
+            starts_found[i] = true;
+            ends_found[i] = true;
+            ends_in_q[i] = (!head->qStrand) ? head->qSize - head->qStart : head->qEnd;
+            starts_in_q[i] = ends_in_q[i] - 1;
         }
+    }
 
-        // now we're parsing each block
-        struct Block block = parse_block(curLine);
-        // convert relative block coordinates to
-        // absolute coords
-        blockTStarts = t_start_pointer;
-        blockQStarts = q_start_pointer;
-        blockTEnds = blockTStarts + block.size;
-        blockQEnds = blockQStarts + block.size;
-        t_start_pointer = blockTEnds + block.dt;
-        q_start_pointer = blockQEnds + block.dq;
-
-        // then restore newline-char, just to be tidy
-        if (nextLine) *nextLine = '\n';
-        curLine = nextLine ? (nextLine + 1) : NULL;
-
-        // need to make >= 1 not > 0 because unsigned
-        // otherwise unsigned int behaves weird
-        for (int k = shift + 1; k >= 1; k--)
-        {
-            starts_buff[k] = starts_buff[k - 1];
-        }
+    int64_t prev_block_q_end = head->qStart;  // init previous block end with the chain's start
+    for (int64_t b = 0; b < blocks->num; b++)
+    {
+        int64_t block_t_start = blocks->t_starts[b];
+        int64_t block_t_end = blocks->t_ends[b];
+        int64_t block_q_start = blocks->q_starts[b];
+        int64_t block_q_end = blocks->q_ends[b];
 
-        starts_buff[0] = blockQStarts;
-        // all_finished == true is default value
-        // it could be changed further
+        for (int k = shift + 1; k >= 1; k--) {starts_buff[k] = starts_buff[k - 1];}
+        starts_buff[0] = block_q_start;
         bool all_finished = true;
 
         // then intersect this chain block with each region
         for (int i = 0; i < regions_num; i++)
         {
             // if the region was mapped -> skip it
-            // if not -> all_finished flag to false
             if (finished[i]) {continue;} else {all_finished = false;}
+            int64_t t_start = t_regions[2 * i];
+            int64_t t_end = t_regions[2 * i + 1];
 
-            if ((!starts_found[i]) && (blockTStarts > t_regions[i].start))
+            if ((!starts_found[i]) && (block_t_start > t_start))
             {  // start in between of blocks
-                // block-------T.start----------------block
                 starts_found[i] = true;
-                starts_in_q[i] = (shift == 0) ? blockQStarts : starts_buff[shift + 1];
-                // starts_in_q[i] = blockQStarts;
-                // block------block-----block--TSTART--block
-                // _____ - get this block
+                starts_in_q[i] = (shift == 0) ? block_q_start : starts_buff[shift + 1];
             }
-            else if ((!starts_found[i]) && (blockTEnds > t_regions[i].start))
+            else if ((!starts_found[i]) && (block_t_end > t_start))
             {  // start intersects the block
                 starts_found[i] = true;
-                int delta = t_regions[i].start - blockTStarts;
-                starts_in_q[i] = (shift == 0) ? blockQStarts + delta : starts_buff[shift];
-
+                int64_t delta = t_start - block_t_start;
+                starts_in_q[i] = (shift == 0) ? block_q_start + delta : starts_buff[shift];
             }  // do not search the end before we find the start
 
-            // parse ends
             // if shift = N is > 0 then we need to add +/- N blocks
             // up and downstream
             if (shift > 0)
             {
-                if (starts_found[i] && !ends_found[i] && blockTEnds > t_regions[i].end)
+                if (starts_found[i] && !ends_found[i] && block_t_end > t_end)
                 {
                     ends_found[i] = true;
                     ks[i] = 0;  // I will use this pointer to get this position + SHIFT
                 }
-
                 if (ends_found[i])
                 {
                     if (ks[i] >= shift)
                     {
-                        ends_in_q[i] = blockQEnds;
+                        ends_in_q[i] = block_q_end;
                         finished[i] = true;
                     }
                     else {ks[i] += 1;}
-                }  // I need index of end found + SHIFT
+                }
             }
             else
             {
-                // a bit more complicated in case if no shift required
-                if (starts_found[i] && !ends_found[i] && blockTStarts > t_regions[i].end)
+                if (starts_found[i] && !ends_found[i] && block_t_start > t_end)
                 {  // reference region ends between the chain blocks
                     ends_found[i] = true;
-                    ends_in_q[i] = prevBlockQEnds;
+                    ends_in_q[i] = prev_block_q_end;
                     finished[i] = true;
-                // get the end of the previous block
                 }
-                else if (starts_found[i] && !ends_found[i] && blockTEnds >= t_regions[i].end)
-                {
-                    // reference region ends inside a block
+                else if (starts_found[i] && !ends_found[i] && block_t_end >= t_end)
+                {  // reference region ends inside a block
                     ends_found[i] = true;
-                    int delta = t_regions[i].end - blockTStarts;
-                    ends_in_q[i] = blockQStarts + delta;
+                    ends_in_q[i] = block_q_start + t_end - block_t_start;
                     finished[i] = true;
                 }
             }
         }  // end mapping this block with regions
-        // current block will be the previous in the next iteration
-        prevBlockQEnds = blockQEnds;
-
-        // if all blocks are finished -> nothing could switch this flag to false
+        prev_block_q_end = block_q_end;
         if (all_finished) {break;}
     }
 
     // post-process
     for (int i = 0; i < regions_num; i++)
     {
-        if (ends_in_q[i] == 0)
-        { 
-            // we didn't reach +SHIFT block
-            // then assign it to the chain end
-            ends_in_q[i] = head.qEnd;
-        }
-        if (starts_in_q[i] == 0)
+        // we didn't reach +SHIFT block or out of borders
+        // then assign it to the chain end or start
+        if (ends_in_q[i] == 0) {ends_in_q[i] = head->qEnd;}
+        if (starts_in_q[i] == 0) {starts_in_q[i] = head->qStart;}
+        if (!head->qStrand)
         {
-            // out of borders too
-            // assign block to the chain start
-            starts_in_q[i] = head.qStart;
-        }
-        if (!head.qStrand)
-        {   
             // if strand is negative we need to reverse coordinates
-            int temp = starts_in_q[i];
-            // not the most elegant way, yes
-            starts_in_q[i] = head.qSize - ends_in_q[i];
-            ends_in_q[i] = head.qSize - temp;
+            int64_t temp = starts_in_q[i];
+            starts_in_q[i] = head->qSize - ends_in_q[i];
+            ends_in_q[i] = head->qSize - temp;
         }
+        q_regions[2 * i] = starts_in_q[i];
+        q_regions[2 * i + 1] = ends_in_q[i];
     }
 
-    // convert 1\0 (strand) to +\- (human-readable)
-    char *tStrand = (head.tStrand == 1) ? "+" : "-";
-    char *qStrand = (head.qStrand == 1) ? "+" : "-";
-    
-    // allocate memory for answer -> array of strings
-    char ** answer = malloc (sizeof (char *) * (regions_num + 1));
-    for (int i = 0; i < regions_num + 1; i++)
-    {
-        answer[i] = malloc(MAXCHAR * sizeof(char));
-    }
+cleanup:
+    free(starts_found);
+    free(ends_found);
+    free(finished);
+    free(starts_in_q);
+    free(ends_in_q);
+    free(ks);
+    free(starts_buff);
+    return ret;
+}
+
 
-    // save general chain info in the first line of answer
-    sprintf(answer[0], "chain %s %s %d %d %d %s %s %d %d %d\n",
-            head.tName, tStrand, head.tSize, head.tStart, head.tEnd,
-            head.qName, qStrand, head.qSize, head.qStart, head.qEnd);
+int chain_coords_converter_batch(const char *chain, int shifts_num, int *shifts, int regions_num,
+                                 int64_t *t_regions, int64_t *q_regions, int64_t *chain_info)
+{
+    struct Chain_info head;
+    struct Chain_blocks blocks;
+    if (parse_chain(chain, &head, &blocks) != 0) {return 1;}
+
+    chain_info[0] = head.tSize;
+    chain_info[1] = head.tStrand;
+    chain_info[2] = head.tStart;
+    chain_info[3] = head.tEnd;
+    chain_info[4] = head.qSize;
+    chain_info[5] = head.qStrand;
+    chain_info[6] = head.qStart;
+    chain_info[7] = head.qEnd;
 
     for (int i = 0; i < regions_num; i++)
     {
-        // write regions strings to answer array
-        // each line contains:
-        // region number (ordered as in the granges array)
-        // region in the reference
-        // corresponding region in the query
-        // fields are tab-separated
-        sprintf(answer[i + 1],
-                "%d\t%s:%d-%d\t%s:%d-%d\n",
-                i, head.qName, starts_in_q[i], ends_in_q[i],
-                t_regions[i].chrom, t_regions[i].start,
-                t_regions[i].end);
+        // check that start < end in each region
+        // if that not true -> switch them
+        if (t_regions[2 * i] > t_regions[2 * i + 1])
+        {
+            // this is an extraordinary situation, so let user know about this
+            fprintf(stderr, "Warning! End < Start in the region num %d! Switching...\n", i);
+            int64_t temp = t_regions[2 * i];
+            t_regions[2 * i] = t_regions[2 * i + 1];
+            t_regions[2 * i + 1] = temp;
+        }
+    }
+
+    int ret = 0;
+    for (int s = 0; s < shifts_num && ret == 0; s++)
+    {
+        ret = convert_regions(
+            &head, &blocks, shifts[s], regions_num, t_regions, q_regions + 2 * (int64_t)s * regions_num
+        );
     }
-    return answer;
+    free_chain_blocks(&blocks);
+    return ret;
 }
 
 int main()
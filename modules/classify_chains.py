@@ -3,23 +3,29 @@
 
 Each chain-gene pair has a set of features.
 We have a XGBoost pre-trained model that can classify them.
+Models exported to JSON (see tree_model.py) are applied without XGBoost.
 """
 import argparse
+import os
+import shutil
 import sys
+import tempfile
 import numpy as np
 import pandas as pd
-import joblib
-import xgboost as xgb
 from version import __version__
 
 try:  # TODO: check whether it's needed
     from modules.common import setup_logger
     from modules.common import to_log
     from modules.common import die
+    from modules.tree_model import TreeModel
+    from modules.tree_model import is_tree_model
 except ImportError:
     from modules.common import setup_logger
     from modules.common import to_log
     from common import die
+    from tree_model import TreeModel
+    from tree_model import is_tree_model
 
 __author__ = "Bogdan M. Kirilenko"
 
@@ -43,6 +49,8 @@ ME_MODEL_FEATURES = ["gl_exo", "loc_exo", "flank_cov", "synt_log", "intr_perc"]
 LD_MODEL_FEATURES = ["gl_exo", "flank_cov", "exon_perc", "synt_log", "loc_exo",
                      "intr_perc", "score", "single_exon"]
 
+CHUNK_SIZE = 500000  # classify chain features table by chunks of this size
+
 
 def parse_args():
     """Read args, check."""
@@ -55,6 +63,9 @@ def parse_args():
         "--raw_model_out", "--ro", default=None, help="Save gene: chain xgboost output"
     )
     app.add_argument("--ld_model", action="store_true", dest="ld_model", help="Apply LD model")
+    app.add_argument(
+        "--threads", "-t", type=int, default=None, help="Number of XGBoost threads (default: all cores)"
+    )
     app.add_argument("--log_file", default=None, help="Path to the log file")
     # print help if there are no args
     if len(sys.argv) < 2:
@@ -64,23 +75,124 @@ def parse_args():
     return args
 
 
-def classify_chains(
-    table,
-    output,
-    se_model_path,
-    me_model_path,
-    raw_out=None,
-    rejected=None,
-    annot_threshold=0.5,
-    ld_model=None
-):
-    """Core chain classifier function."""
-    # read dataframe
-    df = pd.read_csv(table, header=0, sep="\t")
-    init_transcripts_set = set(df["gene"])
-    to_log(f"classify_chains: loaded dataframe of size {len(df)}")
-    to_log(f"classify_chains: total number of transcripts: {len(df)}")
+def iter_gene_chunks(df, chunk_size=CHUNK_SIZE):
+    """Split a gene-oriented dataframe into chunks of ~chunk_size rows.
+
+    Rows of the same gene are contiguous in merge_chains_output tables;
+    chunks are cut at gene borders, so a gene is never split.
+    """
+    rows_num = len(df)
+    if rows_num <= chunk_size:
+        yield df
+        return
+    genes = df["gene"].to_numpy()
+    gene_starts = np.flatnonzero(np.r_[True, genes[1:] != genes[:-1]])
+    cut_ids = np.searchsorted(gene_starts, np.arange(chunk_size, rows_num, chunk_size))
+    cuts = np.unique(np.r_[0, gene_starts[cut_ids[cut_ids < len(gene_starts)]], rows_num])
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        yield df.iloc[start:end]
+
+
+def iter_table_chunks(table, chunk_size=CHUNK_SIZE):
+    """Iterate over the chain features table in chunks.
+
+    Table is either a dataframe or a path to the merged table.
+    Rows of the last gene in a chunk read from file are carried over
+    to the next chunk: each gene is classified within a single chunk.
+    """
+    if isinstance(table, pd.DataFrame):
+        yield from iter_gene_chunks(table, chunk_size)
+        return
+    carry = None
+    for chunk in pd.read_csv(table, header=0, sep="\t", chunksize=chunk_size):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        if len(chunk) == 0:
+            continue
+        genes = chunk["gene"].to_numpy()
+        other_gene = np.flatnonzero(genes != genes[-1])
+        if len(other_gene) == 0:
+            carry = chunk
+            continue
+        cut = other_gene[-1] + 1
+        carry = chunk.iloc[cut:]
+        yield chunk.iloc[:cut]
+    if carry is not None:
+        yield carry
+
+
+def load_model(model_path):
+    """Load model: exported JSON trees or XGBoost model saved with joblib."""
+    if is_tree_model(model_path):
+        return TreeModel.load(model_path)
+    import joblib
+    import xgboost as xgb
+
+    try:
+        return joblib.load(model_path)
+    except (xgb.core.XGBoostError, AttributeError):
+        xgboost_version = xgb.__version__
+        err_msg = (
+            f"Cannot load model {model_path} "
+            f"Probably, models were trained with a different version of "
+            f"XGBoost. You used XBGoost version: {xgboost_version}; "
+            f"Please make sure you called train_model.py with the same version."
+        )
+        to_log(f"classify_chains: ERROR! {err_msg}")
+        raise ValueError(err_msg)
+
+
+def load_models(se_model_path, me_model_path):
+    """Load SE and ME models."""
+    try:  # there are 2 potential problems:
+        # no files at all and
+        # cannot load files (see load_model)
+        to_log(f"classify_chains: loading models at {se_model_path} (SE) and {me_model_path} (ME)")
+        se_model = load_model(se_model_path)
+        me_model = load_model(me_model_path)
+    except FileNotFoundError:
+        err_msg = (
+            f"Cannot find models {se_model_path} and {me_model_path}\n"
+            f"Please call train_model.py to create them.\nAbort."
+        )
+        to_log(f"classify_chains: ERROR! {err_msg}")
+        raise FileNotFoundError(err_msg)
+    return se_model, me_model
 
+
+def get_booster(model, nthread=None):
+    """Get the native booster of a sklearn-like XGBoost model.
+
+    Exported tree models are returned as is.
+    """
+    if isinstance(model, TreeModel):
+        return model
+    booster = model.get_booster()
+    if nthread:
+        booster.set_param({"nthread": nthread})
+    return booster
+
+
+def predict_scores(booster, df, features):
+    """Predict the positive class probability for each row of df.
+
+    Features go to the booster as a contiguous float32 array, XGBoost
+    converts the input to float32 anyway, so the scores are equal
+    to predict_proba(df[features])[:, 1].
+    """
+    if len(df) == 0:
+        return np.array([])
+    X = np.ascontiguousarray(df[features].to_numpy(dtype=np.float32))
+    return booster.inplace_predict(X)
+
+
+def classify_chunk(df, se_model, me_model, ld_model, annot_threshold):
+    """Classify a chunk of the chain features table.
+
+    Models are native XGBoost boosters or tree models, see get_booster.
+    Return gene, chain and pred dataframes for single-exon,
+    multi-exon and spanning chains.
+    """
     # get indexes of processed pseudogene chains
     # if a chain has synteny = 1, introns are deleted and exon_num > 1
     # -> then this is a proc pseudogene
@@ -88,173 +200,91 @@ def classify_chains(
     # TODO: rename trans -> spanning
     # trans chain -> a syntenic chain that passes throw the gene body
     #                but has no aligning bases in the CDS
-    spanning_ts_lines = df[(df["exon_cover"] == 0) & (df["synt"] > 1)]
-    to_log(f"classify_chains: {len(spanning_ts_lines)} rows with spanning chains")
+    spanning_mask = (df["exon_cover"] == 0) & (df["synt"] > 1)
+    spanning_chains_result = df.loc[spanning_mask, ["gene", "chain"]]
     # remove from dataframe: (this includes trans chains)
     # 1) chains that don't cover CDS
     # 2) remove chains that have synteny == 0
-    df = df[(df["exon_cover"] > 0) & (df["synt"] > 0)]
-    df_final = df.copy()  # filtered dataframe: what we will classify
-    to_log(f"classify_chains: filtered dataset contains {len(df_final)} records")
+    # boolean indexing creates a new frame: what we will classify
+    df_final = df[(df["exon_cover"] > 0) & (df["synt"] > 0)]
     # compute some necessary features
-    to_log("classify_chains: omputing additional features...")
-    df_final["exon_perc"] = df_final["exon_cover"] / df_final["ex_fract"]
-    df_final["chain_len_log"] = np.log10(df_final["chain_len"])
-    df_final["synt_log"] = np.log10(df_final["synt"])
-    df_final["intr_perc"] = df_final["intr_cover"] / df_final["intr_fract"]
+    df_final = df_final.assign(
+        exon_perc=df_final["exon_cover"] / df_final["ex_fract"],
+        chain_len_log=np.log10(df_final["chain_len"]),
+        synt_log=np.log10(df_final["synt"]),
+        intr_perc=df_final["intr_cover"] / df_final["intr_fract"],
+    )
     df_final = df_final.fillna(0.0)  # fill NA values with 0.0
-
-    if len(df_final) > 0:
-        # add "is single exon" column -> to separate it for different models
-        # need to do this only if the df is not empty
-        df_final.loc[df_final["ex_num"] == 1, "single_exon"] = 1
-        df_final.loc[df_final["ex_num"] != 1, "single_exon"] = 0
-    else:  # this df is empty anyway, so any value fits
-        to_log("classify_chains: WARNING! The final df for classification is empty")
-        df_final["single_exon"] = 0
+    # add "is single exon" column -> to separate it for different models
+    df_final["single_exon"] = np.where(df_final["ex_num"] == 1, 1, 0)
 
     # split df into two: for single and multi exon models
     df_se = df_final[df_final["single_exon"] == 1]
     df_me = df_final[df_final["single_exon"] == 0]
-    to_log(f"classify_chains: df for single-exon model contains {len(df_se)} records")
-    to_log(f"classify_chains: df for multi-exon model contains {len(df_me)} records")
-
-    # create X dataframes: skip unnecessary columns
-    X_se = df_se.copy()
-    X_me = df_me.copy()
-    X_se = X_se[SE_MODEL_FEATURES]
-    X_me = X_me[ME_MODEL_FEATURES]
-
-    # load models
-    try:  # there are 2 potential problems:
-        # no files at all and
-        # cannot load files
-        to_log(f"classify_chains: loading models at {se_model_path} (SE) and {me_model_path} (ME)")
-        se_model = joblib.load(se_model_path)
-        me_model = joblib.load(me_model_path)
-    except FileNotFoundError:
-        err_msg = (
-            f"Cannot find models {se_model_path} and {me_model_path}\n"
-            f"Please call train_model.py to create them.\nAbort."
-        )
-        to_log(f"classify_chains: ERROR! {err_msg}")
-        raise FileNotFoundError(err_msg)
-    except (xgb.core.XGBoostError, AttributeError):
-        xgboost_version = xgb.__version__
-        err_msg = (
-            f"Cannot load models {se_model_path} and {me_model_path} "
-            f"Probably, models were trained with a different version of "
-            f"XGBoost. You used XBGoost version: {xgboost_version}; "
-            f"Please make sure you called train_model.py with the same version."
-        )
-        to_log(f"classify_chains: ERROR! {err_msg}")
-        raise ValueError(err_msg)
-
-    # and apply them
-    to_log(f"classify_chains: applying models to SE and ME datasets...")
-    me_pred = me_model.predict_proba(X_me)[:, 1] if len(X_me) > 0 else np.array([])
-    se_pred = se_model.predict_proba(X_se)[:, 1] if len(X_se) > 0 else np.array([])
-
-    # add predictions to the dataframe
-    # prediction is basically a single-column
-    df_se_result = df_se.copy()
-    df_me_result = df_me.copy()
-    spanning_chains_result = spanning_ts_lines.copy()
 
-    df_se_result["pred"] = se_pred
-    df_me_result["pred"] = me_pred
+    # apply models, X dataframes: skip unnecessary columns
+    me_pred = predict_scores(me_model, df_me, ME_MODEL_FEATURES)
+    se_pred = predict_scores(se_model, df_se, SE_MODEL_FEATURES)
 
     if ld_model:
-        to_log(f"classify_chains: applying model for higher molecular distances")
-        to_log(f"classify_chains: WARNING! This is an experimental feature")
-        to_log(f"classify_chains: it is not recommended to use for research purposes yet")
         # apply LD model in addition
         # score from previous prediction is a feature for the LD model
-        ld_model = joblib.load(ld_model)
-        df_se_result = df_se_result.rename({"pred": "score"}, axis="columns")
-        df_me_result = df_me_result.rename({"pred": "score"}, axis="columns")
-        X_LD_me = df_me_result[LD_MODEL_FEATURES].copy()
-        X_LD_se = df_se_result[LD_MODEL_FEATURES].copy()
-        me_ld_pred = ld_model.predict_proba(X_LD_me)[:, 1] if len(X_LD_me) > 0 else np.array([])
-        se_ld_pred = ld_model.predict_proba(X_LD_se)[:, 1] if len(X_LD_se) > 0 else np.array([])
-        df_se_result["pred"] = se_ld_pred
-        df_me_result["pred"] = me_ld_pred
+        df_se = df_se.assign(score=se_pred)
+        df_me = df_me.assign(score=me_pred)
+        me_pred = predict_scores(ld_model, df_me, LD_MODEL_FEATURES)
+        se_pred = predict_scores(ld_model, df_se, LD_MODEL_FEATURES)
 
     # model prediction is a float from 0 to 1, -1 -> for trans chains
-    to_log(f"classify_chains: applying -1.0 score to the spanning chains")
-    spanning_chains_result["pred"] = SPANNING_SCORE
+    spanning_chains_result = spanning_chains_result.assign(pred=SPANNING_SCORE)
     # identify processed pseudogenes, they satisfy the following criteria:
     # 1) multi-exon (single-exon ones are out of score of the method)
     # 2) synteny == 1
     # 3) cds_to_qlen > 0.95
     # set them score -2
-    to_log(f"classify_chains: applying -2.0 score to the processed pseudogene alignments")
-    df_me_result.loc[
-        (df_me_result["synt"] == 1)
-        & (df_me_result["exon_qlen"] > 0.95)
-        & (df_me_result["pred"] < annot_threshold)
-        & (df_me_result["exon_perc"] > 0.65),
-        "pred",
-    ] = PPGENE_SCORE
-
-    pp_gene_count = df_me_result[df_me_result["pred"] == PPGENE_SCORE].shape[0]
-    to_log(f"classify_chains: number of processed pseudogene alignments: {pp_gene_count}")
+    ppgene_mask = (
+        (df_me["synt"].to_numpy() == 1)
+        & (df_me["exon_qlen"].to_numpy() > 0.95)
+        & (me_pred < annot_threshold)
+        & (df_me["exon_perc"].to_numpy() > 0.65)
+    )
+    me_pred = np.where(ppgene_mask, PPGENE_SCORE, me_pred)
 
     # we need gene -> chain -> prediction from each row
-    to_log(f"classify_chains: arranging the final output")
-    df_se_result = df_se_result.loc[:, ["gene", "chain", "pred"]]
-    df_me_result = df_me_result.loc[:, ["gene", "chain", "pred"]]
-    spanning_chains_result = spanning_chains_result.loc[:, ["gene", "chain", "pred"]]
-    # concatenate the results
-    overall_result = pd.concat([df_se_result, df_me_result, spanning_chains_result])
-    # some stats
-    paralogs_count = overall_result[overall_result["pred"] < annot_threshold].shape[0]
-    orthologs_count = overall_result[overall_result["pred"] >= annot_threshold].shape[0]
-    spanning_chains_count = overall_result[overall_result["pred"] == 1.0].shape[0]
-    pp_genes_count = overall_result[overall_result["pred"] == 2.0].shape[0]
-    stats_msg = (
-        f"* orthologs: {orthologs_count}\n"
-        f"* paralogs: {paralogs_count}\n"
-        f"* spanning chains: {spanning_chains_count}\n"
-        f"* processed pseudogenes: {pp_genes_count}"
-    )
-    to_log(f"classify_chains: classification result stats:\n{stats_msg}")
-    to_log(f"classify_chains: using {annot_threshold} as a threshold to separate orthologs from paralogs")
+    df_se_result = pd.DataFrame({"gene": df_se["gene"], "chain": df_se["chain"], "pred": se_pred})
+    df_me_result = pd.DataFrame({"gene": df_me["gene"], "chain": df_me["chain"], "pred": me_pred})
+    return df_se_result, df_me_result, spanning_chains_result
 
-    if raw_out:  # save raw scores if required
-        overall_result.to_csv(raw_out, sep="\t", index=False)
 
-    # create a different TSV
-    # transcript: lists of different chain classes
-    # such as transcript A: [orthologous chains] [paralogous chains] etc
-    # 0 -> placeholder, means "the class if empty"
-    gene_class_chains = {}
-    transcripts = set(overall_result["gene"])
-    for transcript in transcripts:
-        gene_class_chains[transcript] = {ORTH: [], PARA: [], SPAN: [], P_PGENES: []}
+def get_gene_class_chains(chunk_result, annot_threshold):
+    """Group classified chains by transcript and chain class.
 
-    to_log(f"classify_chains: combining results for {len(transcripts)} individual transcripts")
-    for data in overall_result.itertuples():
+    Return transcript: {class: [chains]} dict.
+    """
+    gene_class_chains = {}
+    for data in chunk_result.itertuples():
         gene = data.gene
         chain = data.chain
         pred = data.pred
+        classes = gene_class_chains.get(gene)
+        if classes is None:
+            classes = {ORTH: [], PARA: [], SPAN: [], P_PGENES: []}
+            gene_class_chains[gene] = classes
 
         if pred == SPANNING_SCORE:  # spanning (trans) chain
-            gene_class_chains[gene][SPAN].append(chain)
+            classes[SPAN].append(chain)
         elif pred == PPGENE_SCORE:  # processed pseudogene
-            gene_class_chains[gene][P_PGENES].append(chain)
+            classes[P_PGENES].append(chain)
         elif pred < annot_threshold:
-            gene_class_chains[gene][PARA].append(chain)
+            classes[PARA].append(chain)
         else:  # > annot_threshold
-            gene_class_chains[gene][ORTH].append(chain)
+            classes[ORTH].append(chain)
+    return gene_class_chains
 
-    # save orthologs output
-    to_log(f"classify_chains: saving the classification to {output}")
-    f = open(output, "w") if output != "stdout" else sys.stdout
-    f.write(f"GENE\t{ORTH}\t{PARA}\t{SPAN}\t{P_PGENES}\n")
-    i = 0
+
+def write_gene_class_chains(f, gene_class_chains):
+    """Write transcript: chain classes lines to an open file."""
+    # 0 -> placeholder, means "the class if empty"
     for k, v in gene_class_chains.items():
-        i += 1
         orth = v[ORTH]
         para = v[PARA]
         trans = v[SPAN]
@@ -264,7 +294,118 @@ def classify_chains(
         trans_f = ",".join(str(x) for x in trans) if trans else "0"
         p_pgenes_f = ",".join(str(x) for x in pp) if pp else "0"
         f.write("\t".join([k, orth_f, para_f, trans_f, p_pgenes_f]) + "\n")
+
+
+def write_raw_scores(f, df):
+    """Write gene, chain and score rows to an open file.
+
+    Model scores are float32, they are written with float32 precision.
+    """
+    df = df.assign(pred=df["pred"].to_numpy(dtype=np.float32).astype(str))
+    df.to_csv(f, sep="\t", index=False, header=False)
+
+
+def classify_chains(
+    table,
+    output,
+    se_model_path,
+    me_model_path,
+    raw_out=None,
+    rejected=None,
+    annot_threshold=0.5,
+    ld_model=None,
+    chunk_size=CHUNK_SIZE,
+    nthread=None,
+):
+    """Core chain classifier function.
+
+    Table is either a path to the merged chain features table
+    or the dataframe returned by merge_chains_output.
+    The table is classified in chunks of chunk_size rows, results
+    of each chunk are written to the output file right away.
+    Raw scores of single-exon chains are written right away, multi-exon
+    and spanning chains scores are kept in temporary files and appended
+    after them, to keep the order of the whole table classification.
+    nthread: number of XGBoost threads, all cores if None.
+    """
+    se_model, me_model = load_models(se_model_path, me_model_path)
+    se_model = get_booster(se_model, nthread)
+    me_model = get_booster(me_model, nthread)
+    if ld_model:
+        to_log(f"classify_chains: applying model for higher molecular distances")
+        to_log(f"classify_chains: WARNING! This is an experimental feature")
+        to_log(f"classify_chains: it is not recommended to use for research purposes yet")
+        ld_model = get_booster(load_model(ld_model), nthread)
+
+    # create a different TSV
+    # transcript: lists of different chain classes
+    # such as transcript A: [orthologous chains] [paralogous chains] etc
+    to_log(f"classify_chains: saving the classification to {output}")
+    f = open(output, "w") if output != "stdout" else sys.stdout
+    f.write(f"GENE\t{ORTH}\t{PARA}\t{SPAN}\t{P_PGENES}\n")
+    raw_f = open(raw_out, "w") if raw_out else None  # save raw scores if required
+    if raw_f:
+        raw_f.write("gene\tchain\tpred\n")
+    # multi-exon and spanning chains scores, appended to raw_f in the end
+    raw_tmp_dir = os.path.dirname(os.path.abspath(raw_out)) if raw_out else None
+    raw_tmp = [tempfile.TemporaryFile("w+", dir=raw_tmp_dir) for _ in range(2)] if raw_f else []
+
+    init_transcripts_set = set()
+    transcripts = set()
+    rows_num, se_num, me_num, spanning_num = 0, 0, 0, 0
+    paralogs_count, orthologs_count = 0, 0
+    spanning_chains_count, pp_genes_count, pp_gene_count = 0, 0, 0
+    to_log(f"classify_chains: applying models to SE and ME datasets...")
+    for chunk in iter_table_chunks(table, chunk_size):
+        init_transcripts_set.update(chunk["gene"])
+        rows_num += len(chunk)
+        df_se_result, df_me_result, spanning_chains_result = classify_chunk(
+            chunk, se_model, me_model, ld_model, annot_threshold
+        )
+        se_num += len(df_se_result)
+        me_num += len(df_me_result)
+        spanning_num += len(spanning_chains_result)
+        chunk_results = [df_se_result, df_me_result, spanning_chains_result]
+        chunk_result = pd.concat([x for x in chunk_results if len(x) > 0] or chunk_results)
+        preds = chunk_result["pred"].to_numpy()
+        paralogs_count += np.count_nonzero(preds < annot_threshold)
+        orthologs_count += np.count_nonzero(preds >= annot_threshold)
+        spanning_chains_count += np.count_nonzero(preds == 1.0)
+        pp_genes_count += np.count_nonzero(preds == 2.0)
+        pp_gene_count += np.count_nonzero(preds == PPGENE_SCORE)
+
+        if raw_f:
+            for raw_chunk_f, chunk_class_result in zip([raw_f, *raw_tmp], chunk_results):
+                write_raw_scores(raw_chunk_f, chunk_class_result)
+        gene_class_chains = get_gene_class_chains(chunk_result, annot_threshold)
+        write_gene_class_chains(f, gene_class_chains)
+        transcripts.update(gene_class_chains.keys())
     f.close() if output != "stdout" else None
+    for raw_tmp_f in raw_tmp:
+        raw_tmp_f.seek(0)
+        shutil.copyfileobj(raw_tmp_f, raw_f)
+        raw_tmp_f.close()
+    raw_f.close() if raw_f else None
+
+    to_log(f"classify_chains: classified dataframe of size {rows_num}")
+    to_log(f"classify_chains: total number of transcripts: {len(init_transcripts_set)}")
+    if rows_num == 0:
+        to_log("classify_chains: WARNING! The final df for classification is empty")
+    to_log(f"classify_chains: df for single-exon model contains {se_num} records")
+    to_log(f"classify_chains: df for multi-exon model contains {me_num} records")
+    to_log(f"classify_chains: {spanning_num} rows with spanning chains")
+    to_log(f"classify_chains: number of processed pseudogene alignments: {pp_gene_count}")
+    # some stats
+    stats_msg = (
+        f"* orthologs: {orthologs_count}\n"
+        f"* paralogs: {paralogs_count}\n"
+        f"* spanning chains: {spanning_chains_count}\n"
+        f"* processed pseudogenes: {pp_genes_count}"
+    )
+    to_log(f"classify_chains: classification result stats:\n{stats_msg}")
+    to_log(f"classify_chains: using {annot_threshold} as a threshold to separate orthologs from paralogs")
+    to_log(f"classify_chains: combined results for {len(transcripts)} individual transcripts")
+
     # for some transcripts there are no classifiable chains, save them
     transcripts_missing = list(init_transcripts_set.difference(transcripts))
     to_log(f"classify_chains: found no classifiable chains for {len(transcripts_missing)} transcripts")
@@ -287,6 +428,7 @@ def main():
         args.me_model,
         raw_out=args.raw_model_out,
         ld_model=args.ld_model,
+        nthread=args.threads,
     )
 
 
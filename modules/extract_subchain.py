@@ -0,0 +1,41 @@
+"""Extract chain blocks intersecting a genomic region.
+
+Python interface of the extract_subchain_slib shared library.
+"""
+import ctypes
+import os
+import numpy as np
+
+__author__ = "Bogdan M. Kirilenko"
+
+LOCATION = os.path.dirname(os.path.abspath(__file__))
+BLOCK_FIELDS = 4  # tStart, tEnd, qStart, qEnd
+
+# connect shared lib; define input and output data types
+ex_lib = ctypes.CDLL(os.path.join(LOCATION, "extract_subchain_slib.so"))
+ex_lib.extract_subchain.argtypes = [
+    ctypes.c_char_p,
+    ctypes.c_char_p,
+    ctypes.c_char_p,
+    ctypes.c_int64,
+    np.ctypeslib.ndpointer(dtype=np.int64, flags="C_CONTIGUOUS"),
+]
+ex_lib.extract_subchain.restype = ctypes.c_int64
+
+
+def extract_subchain_blocks(chain_str, search_locus, mode="q"):
+    """Get blocks of the chain that intersect chrom:start-end locus.
+
+    mode: "q" if the locus is in the query genome, "t" if in the reference.
+    Return int64 array of shape (blocks number, 4):
+    t_start, t_end, q_start, q_end of each block, in the chain order.
+    """
+    # each chain line is a block, so the number of lines is always enough
+    max_blocks = chain_str.count("\n") + 1
+    blocks = np.empty((max_blocks, BLOCK_FIELDS), dtype=np.int64)
+    blocks_num = ex_lib.extract_subchain(
+        chain_str.encode(), mode.encode(), search_locus.encode(), max_blocks, blocks
+    )
+    if blocks_num < 0:
+        raise RuntimeError("extract_subchain: cannot extract chain blocks")
+    return blocks[:blocks_num]
@@ -4,7 +4,7 @@ Function to be called: extract_subchain
 
 Extract chain blocks that intersect the requested region.
 You can request subchain for the target or the query genome.
-Usage: extract_subchain [chain] [q/t] [target/query genome range]
+Usage: extract_subchain [chain] [q/t] [target/query genome range] [max blocks] [blocks]
 
 Arguments:
 chain -> string, a chain itself
@@ -12,14 +12,16 @@ mode_cd -> char, "q" or "t" -> stands or "query" or "target" genome
 search_region -> string formatted as chrom:start-end
                  Region in the query or reference (depending on the mode param)
                  Function extracts chain blocks that intersect this region
+max_blocks -> capacity of the blocks array, in rows; the number of chain
+              lines is always enough
+blocks -> int64 array of max_blocks * 4 values allocated by the caller
 
-Output structure:
-list of strings
-each string except the last one contains the following:
+Output:
+blocks rows are filled with chain blocks that intersect the region of interest:
     chain block start and end in the reference, chain block start and end in the query
-    values are space-separated
-    each of those chain blocks intersect the region of interest (which is specified)
-The last string is "END"
+Returns the number of rows written, or -1 if the chain and region strings
+cannot be copied or blocks do not fit to the array.
+Input strings are not changed.
 
 Author: Bogdan Kirilenko, 2020;
 */
@@ -30,15 +32,21 @@ Author: Bogdan Kirilenko, 2020;
 #include <stdbool.h>
 #include <stdint.h>
 #include "chain.h"
-#define MAXCHAR 255
-#define ALLOC_START 500
-#define ALLOC_EXT 75
-#define MEM_CHUNK 5
+#define BLOCK_FIELDS 4
 
 
-char ** extract_subchain(char *chain, char *mode_ch, char *search_region)
+char *copy_string(const char *str)
+{
+    // strdup is not a part of C99
+    size_t len = strlen(str) + 1;
+    char *copy = malloc(len);
+    if (copy != NULL) {memcpy(copy, str, len);}
+    return copy;
+}
+
+int64_t extract_subchain(const char *chain_str, const char *mode_ch, const char *search_region_str,
+                         int64_t max_blocks, int64_t *blocks)
 {
-    // read the chain file OR stdin
     // read genomic range mode
     bool mode;
     // the region we are interested in might lie in the target
@@ -54,6 +62,16 @@ char ** extract_subchain(char *chain, char *mode_ch, char *search_region)
         mode = true;
     }
 
+    // header and block parsers split strings in place: work with copies
+    char *chain = copy_string(chain_str);
+    char *search_region = copy_string(search_region_str);
+    if (chain == NULL || search_region == NULL)
+    {
+        free(chain);
+        free(search_region);
+        return -1;
+    }
+
     // parse the range | chrN:X-Y
     struct Regions request_region;
     char *reg_split = strtok(search_region, ":");
@@ -63,6 +81,7 @@ char ** extract_subchain(char *chain, char *mode_ch, char *search_region)
     request_region.start = strtol(split_range, NULL, 10);
     split_range = strtok(NULL, "-");
     request_region.end = strtol(split_range, NULL, 10);
+    free(search_region);
 
     // state of the program
     // if reading -> we're going throw the region of interest
@@ -72,24 +91,19 @@ char ** extract_subchain(char *chain, char *mode_ch, char *search_region)
     // variables describing the block
     // variables called as pointers BUT
     // they are not pointers! (in C-meaning)
-    int t_start_pointer = 0;
-    int q_start_pointer = 0;
-    int blockTStarts = 0; 
-    int blockTEnds = 0;
-    int blockQStarts = 0;
-    int blockQEnds = 0;
-    int req_block_starts = 0;
-    int req_block_ends = 0;
+    int64_t t_start_pointer = 0;
+    int64_t q_start_pointer = 0;
+    int64_t blockTStarts = 0;
+    int64_t blockTEnds = 0;
+    int64_t blockQStarts = 0;
+    int64_t blockQEnds = 0;
+    int64_t req_block_starts = 0;
+    int64_t req_block_ends = 0;
 
     struct Chain_info in_chain_head;
 
-    unsigned long long int rows_added = 0;
+    int64_t rows_added = 0;
     char * curLine = chain;
-    // answer is an array of strings (array)
-    // we don't know the size of this array now
-    // so will dynamically reallocate memory for this
-    unsigned long long int arr_size = ALLOC_START;
-    char ** answer = (char**)malloc(sizeof(char*) * arr_size);
 
     while (curLine)
     {
@@ -150,8 +164,6 @@ char ** extract_subchain(char *chain, char *mode_ch, char *search_region)
         t_start_pointer = blockTEnds + block.dt;
         q_start_pointer = blockQEnds + block.dq;
 
-        // then restore newline-char, just to be tidy   
-        if (nextLine) *nextLine = '\n'; 
         curLine = nextLine ? (nextLine + 1) : NULL;
 
         // depending on mode we are interested in we look at
@@ -172,13 +184,6 @@ char ** extract_subchain(char *chain, char *mode_ch, char *search_region)
             // ----regionregion------------------
             //     ^ we are here
             reading = true;
-            // for each row we allocate a string in the answer
-            answer[rows_added] = (char*)malloc(MAXCHAR * sizeof(char));
-            // and write this block to answer
-            sprintf(answer[rows_added], "%d %d %d %d\n", blockTStarts, blockTEnds, blockQStarts, blockQEnds);
-            rows_added++;
-            // it is the first row --> a answer has place a priori
-            continue;
         } 
         else if (req_block_starts >= request_region.end) 
         {
@@ -197,27 +202,25 @@ char ** extract_subchain(char *chain, char *mode_ch, char *search_region)
             // ---chainchainchainchainchain------
             // ----regionregion------------------
             //          ^ we are here
-            answer[rows_added] = (char*)malloc(MAXCHAR * sizeof(char));
-            sprintf(answer[rows_added], "%d %d %d %d\n", blockTStarts, blockTEnds, blockQStarts, blockQEnds);
-            rows_added++;
-
-            if (rows_added + MEM_CHUNK > arr_size)
-            // make sure that we have allocated enough memory
+            if (rows_added == max_blocks)
             {
-                // need to realloc answer array
-                arr_size += ALLOC_EXT;
-                answer = (char**)realloc(answer, sizeof(char*) * arr_size);
+                fprintf(stderr, "Error! Subchain blocks do not fit to the array of %ld rows!\n", (long)max_blocks);
+                rows_added = -1;
+                break;
             }
+            int64_t *row = blocks + BLOCK_FIELDS * rows_added;
+            row[0] = blockTStarts;
+            row[1] = blockTEnds;
+            row[2] = blockQStarts;
+            row[3] = blockQEnds;
+            rows_added++;
         }
 
         // if not reading: just go to the next block
         // no need to write this condition
     }
-    // finish answer with END
-    // will be simpler to parse the output in the python func
-    answer[rows_added] = (char*)malloc(MAXCHAR * sizeof(char));
-    sprintf(answer[rows_added], "END");
-    return answer;
+    free(chain);
+    return rows_added;
 }
 
 
@@ -8,9 +8,10 @@ import argparse
 import sys
 import os
 from collections import defaultdict
-from collections import Counter
 from datetime import datetime as dt
 
+import numpy as np
+
 from constants import ConstColors, InactMutClassesConst
 
 try:
@@ -100,100 +101,131 @@ def parse_args():
     return args
 
 
-def read_loss_data(loss_dir):
-    """Read inact mutations data for each projection.
+def init_loss_data():
+    """Create empty inact mutations data collectors.
 
-    Projection is a predicted transcript in the query.
-    TOGA gets a projection when projects a transcript via a chain.
-    We parse two sorts of information associated with each transcript.:
-    1) There are 6 features such as %intact.
-    2) A list of inactivating mutations (could be empty).
+    Order of the collectors is the order of read_loss_data output.
     """
-    # initiate dictionaries for features / mutations:
+    projection_to_mutations = defaultdict(list)
     projection_to_p_intact_M_ignore = {}
     projection_to_p_intact_M_intact = {}
     projection_to_i_codon_prop = {}
     proj_to_prop_oub = {}
     proj_to_80_p_intact = {}
     proj_to_80_p_present = {}
-    projection_to_mutations = defaultdict(list)
-    loss_files = os.listdir(loss_dir)
-
-    for l_file in loss_files:
-        to_log(f"* reading data from {l_file}...")
-        # go file-by-file; because CESAR jobs produce a number of files
-        path = os.path.join(loss_dir, l_file)
-        f = open(path, "r")
-        for line in f:
-            # then line-by-line
-            if not line.startswith("#"):
-                # mutations-related lines should start with #
-                continue
-            # parse inact mutation data
-            # [2:] to cut "# "
-            line_data = line[2:].rstrip().split("\t")
-            transcript_id = line_data[0]
-            query_name = line_data[1]  # synonym for chain_id
-            projection_id = f"{transcript_id}.{query_name}"
-
-            # a section of %intact-related features
-            if line_data[2].startswith("INTACT_PERC_IGNORE_M"):
-                # intact percent branch; ignore missing sequence mode
-                perc = float(line_data[2].split()[1])
-                projection_to_p_intact_M_ignore[projection_id] = perc
-                continue
-            elif line_data[2].startswith("INTACT_PERC_INTACT_M"):
-                # intact percent branch; consider missing part as intact
-                perc = float(line_data[2].split()[1])
-                projection_to_p_intact_M_intact[projection_id] = perc
-                continue
-            elif line_data[2].startswith("MIDDLE_IS_INTACT"):
-                # flag: are there inact mutations in the first 90%/mid 80% of CDS?
-                raw_val = line_data[2].split()[1]
-                val = True if raw_val == "TRUE" else False
-                proj_to_80_p_intact[projection_id] = val
-                continue
-            elif line_data[2].startswith("MIDDLE_80%_INTACT"):
-                # BACKWARDS COMPATIBILITY
-                raw_val = line_data[2].split()[1]
-                val = True if raw_val == "TRUE" else False
-                proj_to_80_p_intact[projection_id] = val
-                continue
-            elif line_data[2].startswith("MIDDLE_IS_PRESENT"):
-                # flag: any missing fragment in the middle 80% if CDS?
-                raw_val = line_data[2].split()[1]
-                val = True if raw_val == "TRUE" else False
-                proj_to_80_p_present[projection_id] = val
-                continue
-            elif line_data[2].startswith("MIDDLE_80%_PRESENT"):
-                # BACKWARDS COMPATIBILITY
-                raw_val = line_data[2].split()[1]
-                val = True if raw_val == "TRUE" else False
-                proj_to_80_p_present[projection_id] = val
-                continue
-            elif line_data[2].startswith("INTACT_CODONS_PROP"):
-                # proportion of intact codons
-                # codons that are not deleted, missing and have no inact mutations
-                perc = float(line_data[2].split()[1])
-                projection_to_i_codon_prop[projection_id] = perc
-                continue
-            elif line_data[2].startswith("OUT_OF_CHAIN_PROP"):
-                # proportion of transcript that lies beyond the chain
-                perc = float(line_data[2].split()[1])
-                proj_to_prop_oub[projection_id] = perc
-                continue
+    return (
+        projection_to_mutations,
+        projection_to_p_intact_M_ignore,
+        projection_to_p_intact_M_intact,
+        projection_to_i_codon_prop,
+        proj_to_prop_oub,
+        proj_to_80_p_intact,
+        proj_to_80_p_present,
+    )
 
-            # a section of inactivating mutations
-            exon_num = int(line_data[2])
-            codon_num = line_data[3]
-            mut_class = line_data[4]
-            mut_itself = line_data[5]
-            masked = True if line_data[6] == "masked" else False
-            mut_ = (exon_num, codon_num, mut_class, mut_itself, masked)
-            projection_to_mutations[projection_id].append(mut_)
-        f.close()
+
+def read_loss_file(path, loss_data):
+    """Read a single inact mutations file into the loss_data collectors."""
+    (
+        projection_to_mutations,
+        projection_to_p_intact_M_ignore,
+        projection_to_p_intact_M_intact,
+        projection_to_i_codon_prop,
+        proj_to_prop_oub,
+        proj_to_80_p_intact,
+        proj_to_80_p_present,
+    ) = loss_data
+    f = open(path, "r")
+    for line in f:
+        # then line-by-line
+        if not line.startswith("#"):
+            # mutations-related lines should start with #
+            continue
+        # parse inact mutation data
+        # [2:] to cut "# "
+        line_data = line[2:].rstrip().split("\t")
+        transcript_id = line_data[0]
+        query_name = line_data[1]  # synonym for chain_id
+        projection_id = f"{transcript_id}.{query_name}"
+
+        # a section of %intact-related features
+        if line_data[2].startswith("INTACT_PERC_IGNORE_M"):
+            # intact percent branch; ignore missing sequence mode
+            perc = float(line_data[2].split()[1])
+            projection_to_p_intact_M_ignore[projection_id] = perc
+            continue
+        elif line_data[2].startswith("INTACT_PERC_INTACT_M"):
+            # intact percent branch; consider missing part as intact
+            perc = float(line_data[2].split()[1])
+            projection_to_p_intact_M_intact[projection_id] = perc
+            continue
+        elif line_data[2].startswith("MIDDLE_IS_INTACT"):
+            # flag: are there inact mutations in the first 90%/mid 80% of CDS?
+            raw_val = line_data[2].split()[1]
+            val = True if raw_val == "TRUE" else False
+            proj_to_80_p_intact[projection_id] = val
+            continue
+        elif line_data[2].startswith("MIDDLE_80%_INTACT"):
+            # BACKWARDS COMPATIBILITY
+            raw_val = line_data[2].split()[1]
+            val = True if raw_val == "TRUE" else False
+            proj_to_80_p_intact[projection_id] = val
+            continue
+        elif line_data[2].startswith("MIDDLE_IS_PRESENT"):
+            # flag: any missing fragment in the middle 80% if CDS?
+            raw_val = line_data[2].split()[1]
+            val = True if raw_val == "TRUE" else False
+            proj_to_80_p_present[projection_id] = val
+            continue
+        elif line_data[2].startswith("MIDDLE_80%_PRESENT"):
+            # BACKWARDS COMPATIBILITY
+            raw_val = line_data[2].split()[1]
+            val = True if raw_val == "TRUE" else False
+            proj_to_80_p_present[projection_id] = val
+            continue
+        elif line_data[2].startswith("INTACT_CODONS_PROP"):
+            # proportion of intact codons
+            # codons that are not deleted, missing and have no inact mutations
+            perc = float(line_data[2].split()[1])
+            projection_to_i_codon_prop[projection_id] = perc
+            continue
+        elif line_data[2].startswith("OUT_OF_CHAIN_PROP"):
+            # proportion of transcript that lies beyond the chain
+            perc = float(line_data[2].split()[1])
+            proj_to_prop_oub[projection_id] = perc
+            continue
+
+        # a section of inactivating mutations
+        exon_num = int(line_data[2])
+        codon_num = line_data[3]
+        mut_class = line_data[4]
+        mut_itself = line_data[5]
+        masked = True if line_data[6] == "masked" else False
+        mut_ = (exon_num, codon_num, mut_class, mut_itself, masked)
+        projection_to_mutations[projection_id].append(mut_)
+    f.close()
+
+
+def read_loss_data(loss_dir, loss_data=None):
+    """Read inact mutations data for each projection.
+
+    Projection is a predicted transcript in the query.
+    TOGA gets a projection when projects a transcript via a chain.
+    We parse two sorts of information associated with each transcript.:
+    1) There are 6 features such as %intact.
+    2) A list of inactivating mutations (could be empty).
+    If loss_data is provided, it is the data that was already read
+    while CESAR jobs were running; loss_dir is not read then.
+    """
+    if loss_data is None:
+        loss_data = init_loss_data()
+        loss_files = os.listdir(loss_dir)
+        for l_file in loss_files:
+            to_log(f"* reading data from {l_file}...")
+            # go file-by-file; because CESAR jobs produce a number of files
+            read_loss_file(os.path.join(loss_dir, l_file), loss_data)
     # to avoid returning a bunch of variables I packed them into a tuple
-    output = (
+    (
         projection_to_mutations,
         projection_to_p_intact_M_ignore,
         projection_to_p_intact_M_intact,
@@ -201,7 +233,7 @@ def read_loss_data(loss_dir):
         proj_to_prop_oub,
         proj_to_80_p_intact,
         proj_to_80_p_present,
-    )
+    ) = loss_data
     to_log(f"{MODULE_NAME_FOR_LOG} inactivating mutations output sizes:")
     to_log(f"* projection_to_mutations: {len(projection_to_mutations)}")
     to_log(f"* projection_to_p_intact_M_ignore: {len(projection_to_p_intact_M_ignore)}")
@@ -211,7 +243,7 @@ def read_loss_data(loss_dir):
     to_log(f"* proj_to_80_p_intact: {len(proj_to_80_p_intact)}")
     to_log(f"* proj_to_80_p_present: {len(proj_to_80_p_present)}")
 
-    return output
+    return loss_data
 
 
 def read_bed(bed_file):
@@ -225,6 +257,70 @@ def read_bed(bed_file):
     return gene_line
 
 
+# mutation kinds used by the vectorized classifier
+_MUT_MISS = 0
+_MUT_DEL = 1
+_MUT_OTHER = 2
+# exon status codes, same meaning as I / M / D / L exon statuses
+_EX_I = 0
+_EX_M = 1
+_EX_D = 2
+_EX_L = 3
+
+# decision tree leaves: rule ID -> explanation written to the log
+# fields are filled with the projection values returned by ProjectionFeatures.classify
+_RULE_REASONS = {
+    0: "was present in the paralogs list",
+    1: "found no exons sizes!",
+    2: "0 inact mutations, % intact {p_intact_m_ign} > 60%",
+    3: (
+        "% intact codons {p_i_codons} < threshold " f"{REM_T_L}" ", frame out of chain "
+        "boundaries {frame_oub} > 65%"
+    ),
+    4: (
+        "% intact codons {p_i_codons} < threshold " f"{REM_T_L}" ", frame out of chain "
+        "boundaries {frame_oub} < 65%, potentially whole deletion"
+    ),
+    5: (
+        "all exons are missing + fraction out of chain boundaries {frame_oub} > "
+        f"threshold {PART_THR}"
+    ),
+    6: "all exons are missing",
+    7: "all exons are deleted",
+    8: "% intact {p_intact_m_int} < 0.2",
+    9: (
+        "% intact codons {p_i_codons} < " f"{REM_T_G}" " but no inactivating mutations "
+        "in the middle 80%"
+    ),
+    10: "no missing exons and inact mutations in the middle 80% of ORF",
+    11: "missing sequence is not present in the middle 80% of ORF",
+    12: "missing sequence is present in the middle 80% of ORF, but takes {missing_prop} < 50%",
+    13: (
+        "{missing_prop} > 50% of the ORF missing, ORF out of the chain boundaries "
+        "{frame_oub} > " f"threshold {PART_THR}"
+    ),
+    14: "{missing_prop} > 50% of the ORF missing",
+    15: "single exon is deleted",
+    16: (
+        "single exon is missing, ORF out of the chain boundaries {frame_oub} > "
+        f"threshold {PART_THR}"
+    ),
+    17: "single exon is missing",
+    18: "%intact {p_intact_m_ign} < 60% && {other_mut_num} >= 2 incat mut",
+    19: "not enough evidence to call it L",
+    20: (
+        "%intact {p_intact_m_int} < 60% and # exons with inactivating mutations "
+        "{affected_num} >= threshold for this gene {affected_thr}"
+    ),
+    21: "it has exons that take > 40% ORF having 2+ inactivating mutations",
+    22: "some of the exons that take > 40% of ORF are entirely deleted",
+    23: (
+        "inact muts in the middle %80 of ORF, but too big fraction {frame_oub} out of "
+        f"the chain borders, threshold {PART_THR}"
+    ),
+}
+
+
 def get_l_exon_num(exon_num):
     """20% of exons must be affected to lost the gene."""
     if exon_num == 1:
@@ -236,6 +332,269 @@ def get_l_exon_num(exon_num):
         return twenty_perc
 
 
+def _get_l_exon_num_arr(exon_nums):
+    """Vectorized get_l_exon_num."""
+    return np.where(exon_nums == 1, 1.0, np.where(exon_nums <= 10, 2.0, exon_nums / 5))
+
+
+def _dict_to_arr(projections, dct, default, dtype):
+    """Extract projection values from a dict into a numpy array."""
+    return np.fromiter(
+        (dct.get(p, default) for p in projections), dtype=dtype, count=len(projections)
+    )
+
+
+def _flag_dict_to_arr(projections, dct):
+    """Encode True / False / None flags as 1 / 0 / -1."""
+    codes = {True: 1, False: 0}
+    return np.fromiter(
+        (codes.get(dct.get(p), -1) for p in projections), dtype=np.int8, count=len(projections)
+    )
+
+
+def _seg_sum(seg_ids, values, n_seg):
+    """Sum values within segments; seg_ids must be in [0, n_seg)."""
+    return np.bincount(seg_ids, weights=values, minlength=n_seg)
+
+
+def _seg_any(seg_ids, mask, n_seg):
+    """Check whether any value within a segment is True."""
+    return np.bincount(seg_ids[mask], minlength=n_seg) > 0
+
+
+class ProjectionFeatures:
+    """Columnar representation of the projection features.
+
+    Holds the %intact-related features as per-projection arrays and
+    the reference exons of each projection (the exon status table)
+    as flat per-exon arrays + per-projection offsets.
+    The exon table is extended with exon numbers that appear in the
+    mutations list but do not exist in the reference transcript, as
+    the original per-projection exon status dict did.
+    """
+
+    def __init__(
+            self,
+            projections,
+            trans_exon_sizes,
+            p_to_pint_m_ign,
+            p_to_pint_m_int,
+            projection_to_mutations,
+            p_to_i_codon_prop,
+            p_to_p_out_of_bord,
+            p_80_int,
+            p_80_pre,
+            paral,
+    ):
+        self.projections = projections
+        n = len(projections)
+        self.n = n
+        self.p_intact_m_ign = _dict_to_arr(projections, p_to_pint_m_ign, -1, np.float64)
+        self.p_intact_m_int = _dict_to_arr(projections, p_to_pint_m_int, -1, np.float64)
+        self.p_i_codons = _dict_to_arr(projections, p_to_i_codon_prop, -1, np.float64)
+        self.frame_oub = _dict_to_arr(projections, p_to_p_out_of_bord, 0.0, np.float64)
+        self.no_loss_in_80_p = _flag_dict_to_arr(projections, p_80_int)
+        self.m_80_present = _flag_dict_to_arr(projections, p_80_pre)
+        self.is_paral = np.fromiter((p in paral for p in projections), dtype=bool, count=n)
+
+        # transcript-level data: exon sizes are stored once per transcript
+        self.transcripts = [split_proj_name(p)[0] for p in projections]
+        self.has_exons = np.fromiter(
+            (t in trans_exon_sizes for t in self.transcripts), dtype=bool, count=n
+        )
+        # exon_num: size dicts are 1-based and contiguous (see get_exon_sizes)
+        self.exon_num = np.fromiter(
+            (len(trans_exon_sizes.get(t, ())) for t in self.transcripts), dtype=np.int64, count=n
+        )
+        self._build_mutation_arrays(projection_to_mutations)
+        self._build_exon_table(trans_exon_sizes)
+
+    def _build_mutation_arrays(self, projection_to_mutations):
+        """Flatten inactivating mutations that affect the classification."""
+        mut_proj, mut_exon, mut_kind = [], [], []
+        for num, projection in enumerate(self.projections):
+            for m in projection_to_mutations.get(projection, ()):
+                # m[4]: bool MASKED; missing exons are considered even if masked
+                if m[4] is not False and m[2] != InactMutClassesConst.MISS_EXON:
+                    continue
+                if m[2] == InactMutClassesConst.COMPENSATION:
+                    continue
+                if m[2] == InactMutClassesConst.MISS_EXON:
+                    kind = _MUT_MISS
+                elif m[2] == InactMutClassesConst.DEL_EXON:
+                    kind = _MUT_DEL
+                else:
+                    kind = _MUT_OTHER
+                mut_proj.append(num)
+                mut_exon.append(m[0])
+                mut_kind.append(kind)
+        self.mut_proj = np.array(mut_proj, dtype=np.int64)
+        self.mut_exon = np.array(mut_exon, dtype=np.int64)
+        self.mut_kind = np.array(mut_kind, dtype=np.int8)
+        self.mut_num = np.bincount(self.mut_proj, minlength=self.n)
+
+    def _build_exon_table(self, trans_exon_sizes):
+        """Create flat per-exon arrays for all projections."""
+        n = self.n
+        # exons that are absent in the reference transcript get extra slots
+        out_of_range = (self.mut_exon < 1) | (self.mut_exon > self.exon_num[self.mut_proj])
+        extra_pairs, extra_idx = np.unique(
+            np.stack([self.mut_proj[out_of_range], self.mut_exon[out_of_range]], axis=1),
+            axis=0,
+            return_inverse=True,
+        )
+        extra_pairs = extra_pairs.reshape(-1, 2)
+        extra_idx = extra_idx.reshape(-1)
+        extra_num = np.bincount(extra_pairs[:, 0], minlength=n)
+        slots_num = self.exon_num + extra_num
+        self.offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(slots_num, out=self.offsets[1:])
+        total = int(self.offsets[-1])
+        self.slot_proj = np.repeat(np.arange(n, dtype=np.int64), slots_num)
+        slot_rank = np.arange(total, dtype=np.int64) - self.offsets[self.slot_proj]
+        self.slot_in_range = slot_rank < self.exon_num[self.slot_proj]
+
+        # exon sizes: reference sizes for real exons, 0 for the extra slots
+        sizes = np.zeros(total, dtype=np.int64)
+        uniq_trans = {}
+        for num in np.flatnonzero(self.exon_num):
+            transcript = self.transcripts[num]
+            t_sizes = uniq_trans.get(transcript)
+            if t_sizes is None:
+                exon_sizes = trans_exon_sizes[transcript]
+                t_sizes = np.array([exon_sizes[k] for k in sorted(exon_sizes)], dtype=np.int64)
+                uniq_trans[transcript] = t_sizes
+            start = self.offsets[num]
+            sizes[start: start + len(t_sizes)] = t_sizes
+        self.slot_size = sizes
+
+        # map each mutation to its exon slot
+        mut_slot = self.offsets[self.mut_proj] + self.mut_exon - 1
+        if len(extra_pairs) > 0:
+            # extra_pairs are sorted by projection: rank of the extra exon within a projection
+            extra_first = np.searchsorted(extra_pairs[:, 0], extra_pairs[:, 0], side="left")
+            extra_rank = np.arange(len(extra_pairs)) - extra_first
+            oor_proj = self.mut_proj[out_of_range]
+            mut_slot[out_of_range] = (
+                self.offsets[oor_proj] + self.exon_num[oor_proj] + extra_rank[extra_idx]
+            )
+        self.mut_slot = mut_slot
+
+    def classify(self):
+        """Apply the I/PI/UL/L/M/PG decision tree to all projections at once.
+
+        Return arrays of classes and IDs of the decision tree leaves,
+        and name: array dict of the values the decisions are based on.
+        """
+        n = self.n
+        classes = np.full(n, N_, dtype=np.int8)
+        rules = np.full(n, -1, dtype=np.int16)
+        undecided = np.ones(n, dtype=bool)
+
+        def assign(mask, class_, rule):
+            hit = undecided & mask
+            classes[hit] = class_
+            rules[hit] = rule
+            undecided[hit] = False
+
+        total = len(self.slot_proj)
+        slot_proj = self.slot_proj
+        kind = self.mut_kind
+        is_m = np.bincount(self.mut_slot[kind == _MUT_MISS], minlength=total) > 0
+        is_d = np.bincount(self.mut_slot[kind == _MUT_DEL], minlength=total) > 0
+        # deleted exon status overrides missing
+        status = np.full(total, _EX_I, dtype=np.int8)
+        status[is_m] = _EX_M
+        status[is_d] = _EX_D
+        # smaller mutations in deleted/missing exons are not considered
+        other_num = np.bincount(self.mut_slot[kind == _MUT_OTHER], minlength=total)
+        other_num[is_m | is_d] = 0
+        is_l = other_num > 0
+        present = self.slot_in_range | is_m | is_d
+
+        ign = self.p_intact_m_ign
+        int_ = self.p_intact_m_int
+        codons = self.p_i_codons
+        oub = self.frame_oub
+        with np.errstate(divide="ignore", invalid="ignore"):
+            overall_len = _seg_sum(slot_proj, self.slot_size, n)
+            missed_len = _seg_sum(slot_proj, self.slot_size * (status == _EX_M), n)
+            missing_prop = missed_len / overall_len
+            exon_40 = self.slot_in_range & (self.slot_size / overall_len[slot_proj] > 0.4)
+        present_num = _seg_sum(slot_proj, present, n)
+        all_missing = _seg_sum(slot_proj, status == _EX_M, n) == present_num
+        all_deleted = _seg_sum(slot_proj, status == _EX_D, n) == present_num
+        has_missing = _seg_any(slot_proj, is_m, n)
+        other_mut_num = _seg_sum(slot_proj, other_num, n)
+        affected_num = _seg_sum(slot_proj, (status == _EX_D) | is_l, n)
+        affected_thr = _get_l_exon_num_arr(self.exon_num)
+        exon_40_two_muts = _seg_any(slot_proj, exon_40 & (other_num >= 2), n)
+        exon_40_deleted = _seg_any(slot_proj, exon_40 & (status == _EX_D), n)
+        first_status = np.full(n, _EX_I, dtype=np.int8)
+        has_first = self.exon_num > 0
+        first_status[has_first] = status[self.offsets[:-1][has_first]]
+
+        assign(self.is_paral, PG, 0)
+        assign(~self.has_exons, N_, 1)
+        assign((self.mut_num == 0) & (ign > 0.6), I, 2)
+        lost_codons = codons < REM_T_L
+        assign(lost_codons & (oub > 0.65), M, 3)
+        assign(lost_codons, L, 4)
+        assign(all_missing & (oub > PART_THR), PM, 5)
+        assign(all_missing, M, 6)
+        assign(all_deleted, L, 7)
+        assign(int_ < 0.2, L, 8)
+
+        # first branch -> no inact mutations in the middle 80% of CDS
+        br_1 = self.no_loss_in_80_p == 1
+        assign(br_1 & (codons < REM_T_G), UL, 9)
+        assign(br_1 & ~has_missing, I, 10)
+        assign(br_1 & (self.m_80_present == 1), I, 11)
+        assign(br_1 & (missing_prop < 0.5), PI, 12)
+        assign(br_1 & (oub > PART_THR), PM, 13)
+        assign(br_1, M, 14)
+
+        # second branch: there ARE inact mutations in the middle 80% of CDS
+        single = self.exon_num == 1
+        assign(single & (first_status == _EX_D), L, 15)
+        single_m = single & (first_status == _EX_M)
+        assign(single_m & (oub > PART_THR), PM, 16)
+        assign(single_m, M, 17)
+        assign(single & (ign < 0.6) & (other_mut_num >= 2), L, 18)
+        assign(single, UL, 19)
+        low_int = int_ < 0.6
+        assign(low_int & (affected_num >= affected_thr), L, 20)
+        assign(low_int & exon_40_two_muts, L, 21)
+        assign(low_int & exon_40_deleted, L, 22)
+        assign(low_int, UL, 19)
+        assign(oub > PART_THR, PM, 23)
+        assign(undecided, UL, 19)
+        values = {
+            "p_intact_m_ign": ign,
+            "p_intact_m_int": int_,
+            "p_i_codons": codons,
+            "frame_oub": oub,
+            "missing_prop": missing_prop,
+            "other_mut_num": other_mut_num.astype(np.int64),
+            "affected_num": affected_num.astype(np.int64),
+            "affected_thr": affected_thr,
+        }
+        return classes, rules, values
+
+    def trace(self, num, values):
+        """Print features of a projection, values: projection values returned by classify."""
+        print(f"Projection: {self.projections[num]}")
+        print(f"%intact_Mign: {values['p_intact_m_ign']} | %intact_Mint: {values['p_intact_m_int']}")
+        print(f"No int in m80%: {self.no_loss_in_80_p[num]} | no miss in m80: {self.m_80_present[num]}")
+        print(f"Inact mutations: {self.mut_num[num]}")
+        print(f"Prop intact codons: {values['p_i_codons']}")
+        print(f"Out of chain borders prop: {values['frame_oub']}")
+        start, end = self.offsets[num], self.offsets[num + 1]
+        print(f"Exon sizes:\n{self.slot_size[start: end].tolist()}")
+        print(f"% Missing: {values['missing_prop']}")
+        print(f"Affected exons: {values['affected_num']}; required: {values['affected_thr']}")
+
+
 def get_projection_classes(
         all_projections,
         trans_exon_sizes,
@@ -249,359 +608,50 @@ def get_projection_classes(
         trace=None,
         paral_=None,
 ):
-    """Classify projections as intact, lost, uncertain, etc."""
-    to_log(f"{MODULE_NAME_FOR_LOG}: classifying query projections: decision tree part")
-    projection_class = {}  # our answer: projection -> class
-    # deal with paral_ argument
-    if paral_ is None:
-        # means that ids of paralogous projections are not provided
-        # = set() because we check each projection whether it appears
-        # in the paral set
-        paral = set()
-    else:
-        # if is defined: it's already a set
-        paral = paral_
-
-    for num, projection in enumerate(all_projections):
-        if projection in paral:
-            # paralogous projection -> separate class automatically
-            to_log(f"* {projection} classified as PG: was present in the paralogs list")
-            projection_class[projection] = PG
-            continue
-        # unpack all features for this projection
-        p_intact_M_ign = p_to_pint_m_ign.get(projection, -1)
-        p_intact_M_int = p_to_pint_m_int.get(projection, -1)
-        p_i_codons = p_to_i_codon_prop.get(projection, -1)
-        # TODO: rename to NO LOSS IN FIRST 90%
-        no_loss_in_80_p = p_80_int.get(projection, None)
-        m_80_present = p_80_pre.get(projection, None)
-        frame_oub = p_to_p_out_of_bord.get(projection, 0.0)
-        transcript, _ = split_proj_name(projection)
-        # tracing_: works if called as a standalone script
-        # if set, script writes additional information about
-        # the traced transcript -> like what decision made and why
-        tracing_ = trace and transcript == trace
-
-        exon_sizes = trans_exon_sizes.get(transcript)
-        if exon_sizes is None:
-            # sanity check, this must never happen
-            print(
-                f"Cannot find transcript {transcript}; probably an error"
-            ) if tracing_ else None
-            projection_class[projection] = N_
-            to_log(f"! {projection} classified as N: found no exons sizes!")
-            continue
-
-        # parse inactivating mutations
-        all_mutations = projection_to_mutations.get(projection, [])
-        # get only inactivating mutations, which are not compensations and not masked
-        mutations = [
-            m for m in all_mutations if m[4] is False or m[2] == InactMutClassesConst.MISS_EXON
-        ]  # m[4]: bool MASKED
-        mutations = [m for m in mutations if m[2] != InactMutClassesConst.COMPENSATION]
-
-        if tracing_:
-            # verbosity
-            print(f"Projection: {projection}")
-            print(f"%intact_Mign: {p_intact_M_ign} | %intact_Mint: {p_intact_M_int}")
-            print(f"No int in m80%: {no_loss_in_80_p} | no miss in m80: {m_80_present}")
-            print(f"Overall events: {len(all_mutations)}")
-            print(f"Inact mutations: {len(mutations)}")
-            print(f"Prop intact codons: {p_i_codons}")
-            print(f"Exon sizes:\n{exon_sizes}")
-
-        if len(mutations) == 0 and p_intact_M_ign > 0.6:
-            # intact, >60% CDS is presented
-            if tracing_:
-                print("No mutations, p_M_ign > 0.6: Intact")
-            # nothing to talk about
-            projection_class[projection] = I
-            to_log(f"* {projection} classified as I: 0 inact mutations, % intact > 60%")
-            continue
-        elif p_i_codons < REM_T_L:
-            # too small fraction of CDS is presented
-            if tracing_:
-                print(f"In this projection only {p_i_codons} codons remain intact")
-                print(f"Threshold is {REM_T_L} codons; decide between L and M")
-                # print(f"-> class L")
-            if frame_oub > 0.65:
-                # print(f"Out of chain prob > 0.65: {frame_oub}")
-                # print(f"-> class M")
-                to_log(
-                    f"* {projection} classified as M: % inact codons {frame_oub} < "
-                    f"threshold {REM_T_L}, frame out of chain boundaries > 65%"
-                )
-                projection_class[projection] = M
-            else:
-                to_log(
-                    f"* {projection} classified as L: % inact codons {frame_oub} < "
-                    f"threshold {REM_T_L}, frame out of chain boundaries < 65%, "
-                    f"potentially whole deletion"
-                )
-                projection_class[projection] = L
-            continue
-
-        # initiate exon -> status dict, exon could be intact, deleted, missing or have inact mut
-        exon_status = {k: "I" for k in exon_sizes}
-        exon_num = len(exon_sizes.keys())
-        overall_seq_len = sum(exon_sizes.values())
-        # get list of exons that hold > 40% of CDS
-        exon_40_p = {k: v / overall_seq_len > 0.4 for k, v in exon_sizes.items()}
-        exon_40_p_nums = [k for k, v in exon_40_p.items() if v is True]
-
-        # select missing and deleted exons
-        missing_exons = [m[0] for m in mutations if m[2] == InactMutClassesConst.MISS_EXON]
-        deleted_exons = [m[0] for m in mutations if m[2] == InactMutClassesConst.DEL_EXON]
-        # update status for deleted and missing exons:
-        for me in missing_exons:
-            exon_status[me] = "M"
-        for de in deleted_exons:
-            exon_status[de] = "D"
-
-        print(f"Exon statuses initial\n{exon_status}") if tracing_ else None
-        # deal with smaller mutations (such as frameshifts, stop codons, and so on)
-        other_muts = [
-            m
-            for m in mutations
-            if m[2] != InactMutClassesConst.MISS_EXON
-            and m[2] != InactMutClassesConst.DEL_EXON
-            and m[2] != InactMutClassesConst.COMPENSATION
-        ]
-        # don't need events happened in the deleted/missing exons
-        other_muts = [
-            m
-            for m in other_muts
-            if m[0] not in deleted_exons and m[0] not in missing_exons
-        ]
-        # also compute % of missing sequence
-        missed_seq_len = sum(exon_sizes[k] for k, v in exon_status.items() if v == "M")
-        missing_prop = missed_seq_len / overall_seq_len
-        if tracing_:
-            print(f"% Missing: {missing_prop}")
-            print(
-                f"Missing seq len: {missed_seq_len}; overall seq len: {overall_seq_len}"
-            )
-        # compute number of exons that we require to have inact mutations to call the gene Lost:
-        affected_thr = get_l_exon_num(exon_num)
-
-        # special cases: all exons are missed or deleted
-        if all(v == "M" for v in exon_status.values()):
-            print("All exons are Missing: transcript is missing") if tracing_ else None
-            print(f"Out of borders prop is {frame_oub}") if tracing_ else None
-            if frame_oub > PART_THR:
-                print(
-                    "-> class PM, too big fraction ouf of chain borders"
-                ) if tracing_ else None
-                to_log(
-                    f"* {projection} classified as PM: all exons are missing + fraction "
-                    f"out of chain boundaries {frame_oub} > threshold {PART_THR}"
-                )
-                projection_class[projection] = PM
-            else:
-                to_log(f"* {projection} classified as M: all exons are missing")
-                projection_class[projection] = M
-            continue
-        elif all(v == "D" for v in exon_status.values()):
-            print("All exons are Deleted -> class L") if tracing_ else None
-            to_log(f"* {projection} classified as L: all exons are deleted")
-            projection_class[projection] = L
-            continue
+    """Classify projections as intact, lost, uncertain, etc.
 
-        if p_intact_M_int < 0.2:
-            # < 20% intact, this gene is clearly lost
-            print("P_intact_M_int < 20%: class L") if tracing_ else None
-            to_log(f"* {projection} classified as L: % intact {p_intact_M_int} < 0.2")
-            projection_class[projection] = L
-            continue
-
-        # the main classification process
-        if no_loss_in_80_p is True:
-            print("GO TO BRANCH 1: No inact mut in m80%") if tracing_ else None
-            # first branch -> no inact mutations in the middle 80% of CDS
-            # possible: Intact, partially intact, missed
-            # uncertain if too small fraction is left
-            # if there are any inact mutations -> it doesn't really matter
-            if p_i_codons < REM_T_G:
-                # %intact codons is less than UL threshold: it's UL
-                # if it is also less that lost threshold: it was classified above
-                print(f"Prop of intact codons is {p_i_codons}") if tracing_ else None
-                print(f"Need > {REM_T_G} to be I/PI") if tracing_ else None
-                print(f"-> Class Uncertain Loss") if tracing_ else None
-                to_log(f"* {projection} classified as UL: % intact {p_intact_M_int} codons < {REM_T_G} "
-                       f"but no inactivating mutations in the middle 80%")
-                projection_class[projection] = UL
-                continue
-            if len(missing_exons) == 0:
-                # everything is fine, no missing sequence at all, middle 80% intact
-                print(
-                    "No missing exons, no inact mut in m80%: class I"
-                ) if tracing_ else None
-                to_log(
-                    f"* {projection} classified as I: no missing exons and "
-                    f"inact mutations in the middle 80% of ORF"
-                )
-                projection_class[projection] = I
-                continue
-
-            # there are missing sequence, need to check carefully
-            if m_80_present:
-                # means that there are no missing sequence in the middle 80%
-                print("No M exons in m80%: class I") if tracing_ else None
-                to_log(
-                    f"* {projection} classified as intact: missing "
-                    f"sequence is not present in the middle 80% of ORF"
-                )
-                projection_class[projection] = I
-                continue
-            else:
-                # there are missing sequence in the middle 80%
-                # need a %missing value to decide, M or PI class (or even PM)
-                print("There are M in m80%...") if tracing_ else None
-                # partially intact or missed
-                if missing_prop < 0.5:
-                    print("Missing prop < 50%: class PI") if tracing_ else None
-                    # > 50% CDS is presented
-                    to_log(
-                        f"* {projection} classified as PI: missing sequence is present "
-                        f"in the middle 80% of ORF, but takes less than 50%"
-                    )
-                    projection_class[projection] = PI
-                    continue
-                else:
-                    print("Missing prop > 50%: PM or M branch") if tracing_ else None
-                    # > 50% of CDS missed, just call it missed
-                    if frame_oub > PART_THR:
-                        print(
-                            "-> class PM, too big fraction out of chain borders"
-                        ) if tracing_ else None
-                        to_log(
-                            f"* {projection} classified as PM: {missing_prop} > 50% of the ORF missing, "
-                            f"ORF out of the chain boundaries {frame_oub} > threshold {PART_THR}"
-                        )
-                        projection_class[projection] = PM
-                    else:
-                        to_log(
-                            f"* {projection} classified as M: {missing_prop} > 50% of the ORF missing"
-                        )
-                        projection_class[projection] = M
-                    continue
-
-        else:  # second major branch
-            print("GO TO BRANCH 2: there are inact mut in m80%") if tracing_ else None
-            # second major branch: there ARE inact mutations in the middle 80% of CDS
-            # possible classes: uncertain loss or lost
-            for m in other_muts:  # update exon status
-                exon_status[m[0]] = "L"
-            print(f"Exon status is:\n{exon_status}") if tracing_ else None
-
-            # different decision tree for single and multi-exon genes
-            if exon_num == 1:
-                # special case, for a single exon gene we require > 2 mutations
-                print("Single exon branch") if tracing_ else None
-                if exon_status[1] == "D":
-                    print("Single exon deleted: class L") if tracing_ else None
-                    # the only exon is deleted -> lost
-                    to_log(f"* {projection} classified as L: single exon is deleted")
-                    projection_class[projection] = L
-                elif exon_status[1] == "M":
-                    print("Single exon missing: class M") if tracing_ else None
-                    # the only exon is missed -> M (redundant branch highly likely)
-                    if frame_oub > PART_THR:
-                        print(
-                            "-> class PM, too big fraction out of chain borders"
-                        ) if tracing_ else None
-                        to_log(
-                            f"* {projection} classified as PM: single exon is missing, "
-                            f"ORF out of the chain boundaries {frame_oub} > threshold {PART_THR}")
-                        projection_class[projection] = PM
-                    else:
-                        to_log(f"* {projection} classified as M: single exon is missing")
-                        projection_class[projection] = M
-                elif p_intact_M_ign < 0.6 and len(other_muts) >= 2:
-                    # less than 60% intact and >= 2 inact mut: Lost according to our methodology
-                    print("%intact < 60% && 2 incat mut: class L") if tracing_ else None
-                    to_log(f"* {projection} classified as L: %intact {p_intact_M_ign} < 60% && 2 incat mut")
-                    projection_class[projection] = L
-                else:
-                    # there are inact mutations in the middle 80% of CDS
-                    # not enough evidence to say it's lost: Uncertain
-                    print("Not enough evidence for L -> UL") if tracing_ else None
-                    to_log(f"* {projection} classified as UL: not enough evidence to call it L")
-                    projection_class[projection] = UL
-                continue
-            # multi-exon gene branch
-            num_exons_affected = len(
-                [k for k, v in exon_status.items() if v == "D" or v == "L"]
-            )
-            # the first question: is %intact < 60%?
-            if p_intact_M_int < 0.6:
-                print(f"% intact M int < 60 branch") if tracing_ else None
-                # well, %intact < 60, maybe a loss!
-                if tracing_:
-                    print(
-                        f"Affected exons: {num_exons_affected}; required: {affected_thr}"
-                    )
-                if num_exons_affected >= affected_thr:
-                    # check number of affected exons (with inactivating mutations)
-                    print(f"Enough affected exons -> L") if tracing_ else None
-                    to_log(
-                        f"* {projection} classified as L: %intact {p_intact_M_int} <"
-                        f" 60% and #  exons with inactivating mutations {num_exons_affected} "
-                        f" > threshold for this gene {affected_thr}")
-                    projection_class[projection] = L
-                    continue
-
-                # also check whether there is an exon covering > 40% CDS that has TWO inact mutations
-                muts_occur = Counter(m[0] for m in other_muts)
-                muts_in_40_exons = [muts_occur[x] for x in exon_40_p_nums]
-                if any(x >= 2 for x in muts_in_40_exons):
-                    # if there is an exon that takes >40% of CDS and has >= 2 inact muts: it's lost
-                    print(
-                        f"There are exons > 40% with 2+ mutations -> L"
-                    ) if tracing_ else None
-                    to_log(
-                        f"* {projection} classified as L: it has exons that take"
-                        f" > 40% ORF having 2+ inactivating mutations"
-                    )
-                    projection_class[projection] = L
-                    continue
-                if any(exon_status[x] == "D" for x in exon_40_p_nums):
-                    # also: if any of significant exons is deleted
-                    print(
-                        f"Some of exons > 40% are Deleted -> Lost"
-                    ) if tracing_ else None
-                    to_log(
-                        f"* {projection} classified as L: some of the exons that take > "
-                        f"40% of ORF are entirely deleted"
-                    )
-                    projection_class[projection] = L
-                    continue
-                print(
-                    f"Not enough evidence for Lost -> Uncertain"
-                ) if tracing_ else None
-                to_log(f"* {projection} classified as UL: not enough evidence to call it L")
-                projection_class[projection] = UL
-            else:
-                # if %intact > 60: cannot be intact
-                # but not enough evidence to call it lost
-                # class uncertain loss OR missing
-                print(f"% intact M int > 60 branch") if tracing_ else None
-                if frame_oub > PART_THR:
-                    print(
-                        "-> class PM, too big fraction out of chain borders"
-                    ) if tracing_ else None
-                    to_log(
-                        f"* {projection} classified as PM: inact muts in the middle %80 of ORF, but too big "
-                        f"fraction {frame_oub} out of the chain borders, threshold {PART_THR}"
-                    )
-                    projection_class[projection] = PM
-                else:
-                    print(
-                        f"not enough evidence for L -> Uncertain"
-                    ) if tracing_ else None
-                    to_log(f"* {projection} classified as UL: not enough evidence to call it L")
-                    projection_class[projection] = UL
+    Features of all projections are packed into arrays (see ProjectionFeatures)
+    and the decision tree is evaluated for all of them with boolean masks.
+    """
+    to_log(f"{MODULE_NAME_FOR_LOG}: classifying query projections: decision tree part")
+    # paral_ is None -> ids of paralogous projections are not provided
+    paral = paral_ if paral_ is not None else set()
+    projections = list(all_projections)
+    features = ProjectionFeatures(
+        projections,
+        trans_exon_sizes,
+        p_to_pint_m_ign,
+        p_to_pint_m_int,
+        projection_to_mutations,
+        p_to_i_codon_prop,
+        p_to_p_out_of_bord,
+        p_80_int,
+        p_80_pre,
+        paral,
+    )
+    classes, rules, values = features.classify()
+    projection_class = dict(zip(projections, classes.tolist()))
+    # python scalars: logged the same way as by the per-projection decision tree
+    values = {k: v.tolist() for k, v in values.items()}
+    values["p_intact_m_ign"] = [p_to_pint_m_ign.get(p, -1) for p in projections]
+    values["p_intact_m_int"] = [p_to_pint_m_int.get(p, -1) for p in projections]
+    values["p_i_codons"] = [p_to_i_codon_prop.get(p, -1) for p in projections]
+    values["frame_oub"] = [p_to_p_out_of_bord.get(p, 0.0) for p in projections]
+    values["affected_thr"] = [get_l_exon_num(x) for x in features.exon_num.tolist()]
+    reasons = []
+    for num, (projection, class_, rule) in enumerate(zip(projections, classes.tolist(), rules.tolist())):
+        reason = _RULE_REASONS[rule].format(**{k: v[num] for k, v in values.items()})
+        reasons.append(reason)
+        prefix = "!" if class_ == N_ else "*"
+        to_log(f"{prefix} {projection} classified as {NUM_TO_CLASS[class_]}: {reason}")
+
+    if trace:
+        # tracing: works if called as a standalone script
+        for num, transcript in enumerate(features.transcripts):
+            if transcript != trace:
                 continue
+            features.trace(num, {k: v[num] for k, v in values.items()})
+            print(f"-> class {NUM_TO_CLASS[int(classes[num])]}: {reasons[num]}")
     return projection_class
 
 
@@ -722,12 +772,19 @@ def gene_losses_summary(
         paral=None,
         exclude_arg=None,
         predefined_class=None,
+        loss_data=None,
 ):
-    """Gene losses summary core function."""
+    """Gene losses summary core function.
+
+    loss_data: inact mutations data already read by read_loss_file,
+    if provided, the loss_data_arg directory is not read.
+    """
     t0 = dt.now()
     func_args = locals()
     to_log(f"{MODULE_NAME_FOR_LOG}: called module with the following arguments:")
     for k, v in func_args.items():
+        if k == "loss_data" and v is not None:
+            v = "read while CESAR jobs were running"
         to_log(f"* {k}: {v}")
     # TOGA don't make any conclusions about projections via paralogous chains
     paralogs_set = get_paralogs_data(paral)
@@ -739,7 +796,7 @@ def gene_losses_summary(
     to_log(f"{MODULE_NAME_FOR_LOG}: extracted length data for {len(trans_exon_sizes)} reference exons")
     # parse inactivating mutations data
     to_log(f"{MODULE_NAME_FOR_LOG}: reading inactivating mutations data...")
-    loss_data_all = read_loss_data(loss_data_arg)
+    loss_data_all = read_loss_data(loss_data_arg, loss_data)
     # unpack the returned tuple:
     projection_to_mutations = loss_data_all[0]
     p_to_pintact_M_ign = loss_data_all[1]
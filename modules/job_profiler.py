@@ -0,0 +1,139 @@
+"""Opt-in profiling of chain feature extraction and CESAR wrapper jobs.
+
+Profiling is enabled with the --profile_dir argument or the
+TOGA_PROFILE_DIR environment variable (TOGA sets it for the
+parallel jobs). A fraction of jobs, TOGA_PROFILE_FRACTION, is
+profiled with cProfile. Wall time of all jobs is measured and
+the slowest jobs of each batch are saved with their IDs.
+"""
+import cProfile
+import heapq
+import io
+import os
+import pstats
+import re
+import time
+import zlib
+
+__author__ = "Bogdan M. Kirilenko"
+
+PROFILE_DIR_ENV = "TOGA_PROFILE_DIR"
+PROFILE_FRACTION_ENV = "TOGA_PROFILE_FRACTION"
+DEFAULT_PROFILE_FRACTION = 0.01
+SLOWEST_JOBS_NUM = 20
+SLOWEST_JOBS_DIR = "slowest_jobs"
+PROFILE_EXT = ".prof"
+MAX_FILENAME_LEN = 100
+
+
+def get_profile_dir(profile_dir_arg=None):
+    """Get profile dir from argument or environment, None if profiling is off."""
+    return profile_dir_arg if profile_dir_arg else os.environ.get(PROFILE_DIR_ENV)
+
+
+def is_sampled(job_id, fraction):
+    """Decide whether to profile the job, same decision for the same job ID."""
+    return zlib.crc32(job_id.encode()) / 2 ** 32 < fraction
+
+
+def job_id_to_filename(job_id):
+    """Make a filename from job ID."""
+    filename = re.sub(r"[^\w.-]+", "_", job_id)[:MAX_FILENAME_LEN]
+    return f"{filename}_{zlib.crc32(job_id.encode()):08x}"
+
+
+class JobsProfiler:
+    """Measure jobs wall time, profile a sampled fraction of jobs.
+
+    Does nothing except calling the job function if profiling is off.
+    """
+
+    def __init__(self, runner, profile_dir=None):
+        self.runner = runner
+        self.profile_dir = get_profile_dir(profile_dir)
+        self.enabled = self.profile_dir is not None
+        self.fraction = float(os.environ.get(PROFILE_FRACTION_ENV, DEFAULT_PROFILE_FRACTION))
+        self.slowest = []  # heap of (seconds, job_id)
+
+    def add_timing(self, job_id, seconds):
+        """Keep the job if it is among the slowest."""
+        if not self.enabled:
+            return
+        if len(self.slowest) < SLOWEST_JOBS_NUM:
+            heapq.heappush(self.slowest, (seconds, job_id))
+        else:
+            heapq.heappushpop(self.slowest, (seconds, job_id))
+
+    def run(self, job_id, func, *args, **kwargs):
+        """Call func, profile it if the job is sampled."""
+        if not self.enabled:
+            return func(*args, **kwargs)
+        profiler = cProfile.Profile() if is_sampled(job_id, self.fraction) else None
+        t0 = time.time()
+        try:
+            if profiler:
+                return profiler.runcall(func, *args, **kwargs)
+            return func(*args, **kwargs)
+        finally:  # CESAR wrapper ends with sys.exit
+            self.add_timing(job_id, time.time() - t0)
+            if profiler:
+                self.__save_profile(job_id, profiler)
+
+    def __save_profile(self, job_id, profiler):
+        runner_dir = os.path.join(self.profile_dir, self.runner)
+        os.makedirs(runner_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(runner_dir, job_id_to_filename(job_id) + PROFILE_EXT))
+
+    def save_slowest(self, batch_name):
+        """Save the slowest jobs of this batch."""
+        if not self.enabled or len(self.slowest) == 0:
+            return
+        slowest_dir = os.path.join(self.profile_dir, SLOWEST_JOBS_DIR)
+        os.makedirs(slowest_dir, exist_ok=True)
+        path = os.path.join(slowest_dir, f"{self.runner}_{job_id_to_filename(batch_name)}.tsv")
+        f = open(path, "w")
+        for seconds, job_id in sorted(self.slowest, reverse=True):
+            f.write(f"{self.runner}\t{seconds:.3f}\t{job_id}\n")
+        f.close()
+
+
+def read_slowest_jobs(profile_dir, top):
+    """Read the slowest jobs saved by all batches."""
+    slowest_dir = os.path.join(profile_dir, SLOWEST_JOBS_DIR)
+    if not os.path.isdir(slowest_dir):
+        return []
+    jobs = []
+    for filename in os.listdir(slowest_dir):
+        f = open(os.path.join(slowest_dir, filename), "r")
+        for line in f:
+            runner, seconds, job_id = line.rstrip("\n").split("\t", 2)
+            jobs.append((float(seconds), runner, job_id))
+        f.close()
+    return sorted(jobs, reverse=True)[:top]
+
+
+def summarize_profiles(profile_dir, top=30, sort_key="tottime"):
+    """Aggregate job profiles into a hotspots summary, return it as text."""
+    out = io.StringIO()
+    runners = sorted(
+        x for x in os.listdir(profile_dir)
+        if x != SLOWEST_JOBS_DIR and os.path.isdir(os.path.join(profile_dir, x))
+    )
+    for runner in runners:
+        runner_dir = os.path.join(profile_dir, runner)
+        profiles = [
+            os.path.join(runner_dir, x) for x in os.listdir(runner_dir) if x.endswith(PROFILE_EXT)
+        ]
+        if len(profiles) == 0:
+            continue
+        out.write(f"### {runner}: hotspots in {len(profiles)} profiled jobs\n")
+        stats = pstats.Stats(*profiles, stream=out)
+        stats.files = []  # otherwise, a header line per profile is printed
+        stats.strip_dirs().sort_stats(sort_key).print_stats(top)
+
+    slowest = read_slowest_jobs(profile_dir, top)
+    out.write(f"### {len(slowest)} slowest jobs\n")
+    out.write("runner\tseconds\tjob\n")
+    for seconds, runner, job_id in slowest:
+        out.write(f"{runner}\t{seconds:.3f}\t{job_id}\n")
+    return out.getvalue()
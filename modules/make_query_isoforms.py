@@ -9,20 +9,19 @@ Exons should be on the same strand!
 import argparse
 import sys
 from collections import defaultdict
-import networkx as nx
 
 from constants import ConstColors
 
 try:
     from modules.common import flatten
-    from modules.common import get_graph_components
     from modules.common import to_log
     from modules.common import setup_logger
+    from modules.union_find import UnionFind
 except ImportError:
     from common import flatten
-    from common import get_graph_components
     from common import to_log
     from common import setup_logger
+    from union_find import UnionFind
 
 __author__ = "Bogdan M. Kirilenko"
 
@@ -139,72 +138,36 @@ def split_exons_in_chr_dir(exons_list):
     return chr_dir_exons
 
 
-def intersect_ranges(region_1, region_2):
-    """Return TRUE if ranges intersect."""
-    inter_size = min(region_1[1], region_2[1]) - max(region_1[0], region_2[0])
-    return True if inter_size > 0 else False
-
-
 def intersect_exons(chr_dir_exons, exon_id_to_transcript):
-    """Create graph of connected exons.
+    """Split transcripts in groups connected by intersected exons.
 
-    We will use a graph where nodes are transcript IDs.
-    Nodes are connected if they have a pair of intersected exons.
+    Exons of each chrom and direction are sorted by start, the sweep keeps
+    the exon with the max end so far: an exon that starts before this end
+    intersects this exon. Transcripts of intersected exons are joined
+    with union-find. Return lists of transcripts in order of appearance.
     """
     to_log(
-        f"{MODULE_NAME_FOR_LOG}: Building a graph where nodes are query exons, and edges "
-        f"indicate the fact that their coordinates intersect. Needed to identify which "
-        f"annotated transcripts intersect."
+        f"{MODULE_NAME_FOR_LOG}: sweeping through query exons to join transcripts "
+        f"with intersected exons. Needed to identify which annotated transcripts intersect."
     )
-    G = nx.Graph()  # init the graph
+    # transcripts that don't intersect anything are groups of one
+    transcripts = list(dict.fromkeys(exon_id_to_transcript.values()))
+    transcript_to_num = {t: num for num, t in enumerate(transcripts)}
+    transcripts_union = UnionFind(len(transcripts))
     for exons in chr_dir_exons.values():
         # this is the same chrom and direction now
-        # add nodes now: to avoid missing transcripts
-        # that don't intersect anything
-        exon_ids = [e[0] for e in exons]
-        transcripts = set(exon_id_to_transcript[x] for x in exon_ids)
-        G.add_nodes_from(transcripts)
-
-        if len(exons) == 1:
-            # only one exon: nothing to intersect
-            # gene id is on graph now: we can just continue
-            continue
-        exons_num = len(exons)
-        for i in range(exons_num - 1):
-            # nearly N^2 algorithm (a nested loop)
-            # but actually faster
-            # pick exon i
-            exon_i = exons[i]
-            exon_i_id = exon_i[0]
-            exon_i_start = exon_i[1]
-            exon_i_end = exon_i[2]
-            # get range and corresponding transcript
-            i_range = (exon_i_start, exon_i_end)
-            i_trans = exon_id_to_transcript[exon_i_id]
-            # then let's look at next exons
-            for j in range(i + 1, exons_num):
-                # exon j exists for sure (first range is up to exons_num - 1)
-                # num of exons is > 1
-                exon_j = exons[j]
-                exon_j_id = exon_j[0]
-                exon_j_start = exon_j[1]
-                exon_j_end = exon_j[2]
-                if exon_j_start > exon_i_end:
-                    # if exon_j start is > exon_i end then we can break
-                    # they are sorted: for all next exons start would be > exon_i end
-                    # and if so, they do not intersect for sure
-                    break
-                # let's check that they intersect
-                j_range = (exon_j_start, exon_j_end)
-                j_trans = exon_id_to_transcript[exon_j_id]  # j exon transcript
-                they_intersect = intersect_ranges(i_range, j_range)
-                if they_intersect is False:
-                    # don't intersect: nothing to do
-                    continue
-                # if we are in this branch: exons intersect
-                # we can add an edge connecting their corresponding transcripts
-                G.add_edge(i_trans, j_trans)
-    return G
+        max_end, max_end_trans = None, None
+        for exon_id, exon_start, exon_end in exons:
+            if exon_end <= exon_start:
+                # empty exon: intersects nothing
+                continue
+            trans_num = transcript_to_num[exon_id_to_transcript[exon_id]]
+            if max_end is not None and exon_start < max_end:
+                transcripts_union.union(max_end_trans, trans_num)
+            if max_end is None or exon_end > max_end:
+                max_end, max_end_trans = exon_end, trans_num
+    components = transcripts_union.components()
+    return [[transcripts[num] for num in component] for component in components]
 
 
 def parse_components(components, trans_to_range, gene_prefix=None):
@@ -221,7 +184,7 @@ def parse_components(components, trans_to_range, gene_prefix=None):
     for num, component in enumerate(components, 1):
         gene_id = f"{gp}_{num:011}"  # need to name them somehow
         # get transcripts and their ranges
-        transcripts = set(component.nodes())
+        transcripts = component
         regions = [trans_to_range[t] for t in transcripts]
         # define gene range, chrom and strand are same everywhere
         # just get them from the 0'st region
@@ -290,12 +253,9 @@ def get_query_isoforms_data(
     # exons from different chrom/direction cannot actually intersect
     chr_dir_to_exons = split_exons_in_chr_dir(exons_list)
     # the main part -> get exon intersections
-    # create a graph of transcripts with intersected exons
-    conn_graph = intersect_exons(chr_dir_to_exons, exon_id_to_transcript)
-    # split graph into connected components
-    # if two transcripts are in the same component -> they belong to the same gene
-    components = get_graph_components(conn_graph)
-    to_log(f"{MODULE_NAME_FOR_LOG}: identified {len(components)} connected components in the graph")
+    # if two transcripts have intersected exons -> they belong to the same gene
+    components = intersect_exons(chr_dir_to_exons, exon_id_to_transcript)
+    to_log(f"{MODULE_NAME_FOR_LOG}: identified {len(components)} groups of intersected transcripts")
     # covert components to isoforms table
     genes_data = parse_components(components, trans_to_range, gene_prefix)
     # save the results
@@ -659,68 +659,59 @@ def get_excluded_genes(exc_arg):
         return set()
 
 
-def merge_cesar_output(
-    input_dir,
-    output_bed,
-    output_fasta,
-    meta_data_arg,
-    skipped_arg,
-    prot_arg,
-    codon_arg,
-    output_trash,
-    fragm_data=None,
-    exclude=None,
-):
-    """Merge multiple CESAR output files."""
-    # check that input dir is correct
-    func_args = locals()
-    to_log(f"{MODULE_NAME_FOR_LOG}: module called with arguments:")
-    for k, v in func_args.items():
-        to_log(f"* {k}: {v}")
-    die(f"Error! {input_dir} is not a dir!") if not os.path.isdir(input_dir) else None
-    cesar_output_files = [x for x in os.listdir(input_dir) if x.endswith(".txt")]
-    to_log(f"{MODULE_NAME_FOR_LOG}: merging CESAR results from {len(cesar_output_files)} output files")
-    # get list of excluded transcripts
-    excluded_genes = get_excluded_genes(exclude)
-
-    # initiate lists for different types of output:
-    bed_summary = []
-    fasta_summary = []
-    trash_summary = []
-    meta_summary = []
-    prot_summary = []
-    codon_summary = []
-    skipped = []
-    fragm_genes_summary = []
-    crashed_status = []
+class CesarOutputMerger:
+    """Parse CESAR output files one by one and append results to the output files.
 
-    task_size = len(cesar_output_files)
-    bed_lines_count = 0
-
-    # extract data for all the files
-    for num, cesar_out_file in enumerate(cesar_output_files):
-        to_log(f" * processing file {cesar_out_file} {num + 1}/{task_size}")
-        # parse bdb files one by one
-        cesar_out_path = os.path.join(input_dir, cesar_out_file)
+    Files can be added while the other CESAR jobs are still running.
+    """
 
+    def __init__(
+        self,
+        output_bed,
+        output_fasta,
+        meta_data_arg,
+        skipped_arg,
+        prot_arg,
+        codon_arg,
+        output_trash,
+        fragm_data=None,
+        exclude=None,
+    ):
+        # get list of excluded transcripts
+        self.excluded_genes = get_excluded_genes(exclude)
+        self.output_bed = output_bed
+        self.bed_f = open(output_bed, "w")
+        self.fasta_f = open(output_fasta, "w")
+        self.meta_f = open(meta_data_arg, "w")
+        self.skipped_f = open(skipped_arg, "w")
+        self.prot_f = open(prot_arg, "w")
+        self.codon_f = open(codon_arg, "w")
+        self.trash_f = open(output_trash, "w") if output_trash else None
+        self.fragm_f = open(fragm_data, "w") if fragm_data else None
+        self.parsed_files_num = 0
+        self.bed_lines_count = 0
+        self.crashed_status = []
+
+    def add_file(self, cesar_out_path):
+        """Parse a CESAR output file, append the results."""
         # check whether this file exists
         if not os.path.isfile(cesar_out_path):
             stat = (cesar_out_path, "file doesn't exist!")
             to_log(f"!! file {cesar_out_path} does not exist")
-            crashed_status.append(stat)
-            continue
+            self.crashed_status.append(stat)
+            return
         # and check that this file has size > 0
         elif os.stat(cesar_out_path).st_size == 0:
             to_log(f"!! file {cesar_out_path} is empty!!")
-            continue
+            return
 
         try:  # try to parse data
-            parsed_data = parse_cesar_out_file(cesar_out_path, exclude_arg=excluded_genes)
+            parsed_data = parse_cesar_out_file(cesar_out_path, exclude_arg=self.excluded_genes)
         except AssertionError:
             # if this happened: some assertion was violated
             # probably CESAR output data is corrupted
             err_msg = (
-                f"{MODULE_NAME_FOR_LOG}: Error! Failed reading file {cesar_out_file}"
+                f"{MODULE_NAME_FOR_LOG}: Error! Failed reading file {cesar_out_path}"
             )
             to_log(err_msg)
             sys.exit(1)
@@ -735,57 +726,82 @@ def merge_cesar_output(
         skip = parsed_data[6]
         fragm_bed_exons = parsed_data[7]
 
-        # append data to lists
-        bed_summary.append("\n".join(bed_lines) + "\n")
+        # parts of some outputs are separated by newlines
+        sep = "\n" if self.parsed_files_num > 0 else ""
+        self.bed_f.write("\n".join(bed_lines) + "\n")
         to_log(f"{MODULE_NAME_FOR_LOG}: saving {len(bed_lines)} bed lines from this part")
-        bed_lines_count += len(bed_lines)
-        fasta_summary.append(fasta_lines)
-        trash_summary.append("".join(trash_exons))
-        meta_summary.append(meta_data)
-        skipped.append(skip)
-        prot_summary.append(prot_fasta)
-        codon_summary.append(codon_fasta)
-        fragm_genes_summary.append(fragm_bed_exons)
-
-    # save output
-    to_log(f"{MODULE_NAME_FOR_LOG}: Saving the output")
-    if len(bed_summary) == 0:
-        # if so, no need to continue
-        err_msg = (
-            f"{MODULE_NAME_FOR_LOG}: CRITICAL: could not extract any bed lines "
-            f"from the CESAR output, abort"
-        )
-        to_log(err_msg)
-        sys.exit(1)
-
-    # save bed, fasta and the rest
-    with open(output_bed, "w") as f:
-        to_log(f"{MODULE_NAME_FOR_LOG}: writing {bed_lines_count} bed records to {output_bed}")
-        f.write("".join(bed_summary))
-    with open(output_fasta, "w") as f:
-        f.write("".join(fasta_summary))
-    with open(meta_data_arg, "w") as f:
-        f.write("\n".join(meta_summary))
-    with open(skipped_arg, "w") as f:
-        f.write("\n".join(skipped))
-    with open(prot_arg, "w") as f:
-        f.write("\n".join(prot_summary))
-    with open(codon_arg, "w") as f:
-        f.write("\n".join(codon_summary))
-
-    if output_trash:
-        # if requested: provide trash annotation
-        f = open(output_trash, "w")
-        f.write("".join(trash_summary))
-        f.close()
+        self.bed_lines_count += len(bed_lines)
+        self.fasta_f.write(fasta_lines)
+        self.meta_f.write(sep + meta_data)
+        self.skipped_f.write(sep + skip)
+        self.prot_f.write(sep + prot_fasta)
+        self.codon_f.write(sep + codon_fasta)
+        if self.trash_f:
+            self.trash_f.write("".join(trash_exons))
+        if self.fragm_f:
+            self.fragm_f.write(fragm_bed_exons)
+        self.parsed_files_num += 1
+
+    def close(self):
+        """Close the output files.
+
+        Return list of (path, reason) for files that were not parsed.
+        """
+        for f in (self.bed_f, self.fasta_f, self.meta_f, self.skipped_f,
+                  self.prot_f, self.codon_f, self.trash_f, self.fragm_f):
+            f.close() if f else None
+        if self.parsed_files_num == 0:
+            # if so, no need to continue
+            err_msg = (
+                f"{MODULE_NAME_FOR_LOG}: CRITICAL: could not extract any bed lines "
+                f"from the CESAR output, abort"
+            )
+            to_log(err_msg)
+            sys.exit(1)
+        to_log(f"{MODULE_NAME_FOR_LOG}: saved {self.bed_lines_count} bed records to {self.output_bed}")
+        return self.crashed_status
 
-    if fragm_data:
-        # if requested: provide trash annotation
-        f = open(fragm_data, "w")
-        f.write("".join(fragm_genes_summary))
-        f.close()
 
-    return crashed_status
+def merge_cesar_output(
+    input_dir,
+    output_bed,
+    output_fasta,
+    meta_data_arg,
+    skipped_arg,
+    prot_arg,
+    codon_arg,
+    output_trash,
+    fragm_data=None,
+    exclude=None,
+):
+    """Merge multiple CESAR output files."""
+    # check that input dir is correct
+    func_args = locals()
+    to_log(f"{MODULE_NAME_FOR_LOG}: module called with arguments:")
+    for k, v in func_args.items():
+        to_log(f"* {k}: {v}")
+    die(f"Error! {input_dir} is not a dir!") if not os.path.isdir(input_dir) else None
+    cesar_output_files = [x for x in os.listdir(input_dir) if x.endswith(".txt")]
+    to_log(f"{MODULE_NAME_FOR_LOG}: merging CESAR results from {len(cesar_output_files)} output files")
+    merger = CesarOutputMerger(
+        output_bed,
+        output_fasta,
+        meta_data_arg,
+        skipped_arg,
+        prot_arg,
+        codon_arg,
+        output_trash,
+        fragm_data=fragm_data,
+        exclude=exclude,
+    )
+    task_size = len(cesar_output_files)
+
+    # extract data for all the files
+    for num, cesar_out_file in enumerate(cesar_output_files):
+        to_log(f" * processing file {cesar_out_file} {num + 1}/{task_size}")
+        # parse bdb files one by one
+        merger.add_file(os.path.join(input_dir, cesar_out_file))
+    return merger.close()
 
 
 def main():
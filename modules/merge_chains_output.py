@@ -10,6 +10,9 @@ import os
 import sys
 from datetime import datetime as dt
 from collections import defaultdict
+import numpy as np
+import pandas as pd
+from constants import Constants
 from version import __version__
 
 # TODO: check what is going on here
@@ -30,6 +33,12 @@ __author__ = "Bogdan M. Kirilenko"
 
 t0 = dt.now()
 
+HEADER_FIELDS = (
+    "gene gene_overs chain synt gl_score gl_exo chain_len exon_qlen loc_exo exon_cover "
+    "intr_cover gene_len ex_num ex_fract intr_fract flank_cov".split()
+)
+BED_FEATURES = ("gene_len", "exons_num", "exon_fraction", "intron_fraction")
+
 
 def parse_args():
     """Read args, check."""
@@ -280,14 +289,85 @@ def combine(bed_data, chain_data, genes_data, exon_cov, isoforms):
     return combined
 
 
+def get_records_shards(results_dir):
+    """List typed records shards produced by chain_runner.py --records_out.
+
+    Each job also redirects its stdout to the results directory,
+    if a job has no shard, it died before saving the records.
+    """
+    results_files = os.listdir(results_dir)
+    shards = [x for x in results_files if x.endswith(Constants.CHAIN_FEATURES_SHARD_EXT)]
+    if not shards:
+        return []
+    jobs = {os.path.splitext(x)[0] for x in results_files}
+    jobs_without_shard = jobs.difference(os.path.splitext(x)[0] for x in shards)
+    if jobs_without_shard:
+        err_msg = (
+            f"merge_chains_output: ERROR!\n{len(jobs_without_shard)} out of {len(jobs)} jobs "
+            f"did not save records shards, for example: {sorted(jobs_without_shard)[0]}"
+        )
+        to_log(err_msg)
+        die("Some features extracting jobs died!")
+    return [os.path.join(results_dir, x) for x in shards]
+
+
+def load_records(shards):
+    """Concatenate chain features records shards into columns."""
+    to_log(f"merge_chains_output: There are {len(shards)} records shards to combine")
+    columns = defaultdict(list)
+    for path in shards:
+        with np.load(path) as shard:
+            for field, _ in Constants.CHAIN_FEATURES_RECORD_FIELDS:
+                columns[field].append(shard[field])
+    records = {}
+    for field, dtype in Constants.CHAIN_FEATURES_RECORD_FIELDS:
+        # np.concatenate fails on empty list
+        arrays = columns[field] if columns[field] else [np.array([], dtype=dtype)]
+        records[field] = np.concatenate(arrays)
+    records["gene"] = records["gene"].astype(object)
+    to_log(f"merge_chains_output: got {len(records['gene'])} chain-transcript records")
+    return records
+
+
+def combine_records(bed_data, records, exon_cov, isoforms):
+    """Combine chain records and bed data into a gene-oriented dataframe.
+
+    Columnar equivalent of combine: the same rows in the same order.
+    """
+    to_log(f"merge_chains_output: Combining the records...")
+    df = pd.DataFrame(records)
+    # number of chains that cover this gene
+    # else: if you need the chains that overlap EXONS
+    if not exon_cov:
+        df["gene_overs"] = df.groupby("gene")["chain"].transform("size")
+    else:
+        df["gene_overs"] = (df["exon_cover"] > 0).groupby(df["gene"]).transform("sum")
+    if isoforms:
+        # synteny: number of different genes this chain intersects
+        chain_to_gene = pd.DataFrame({"chain": df["chain"], "g": df["gene"].map(isoforms)})
+        chain_to_gene = chain_to_gene.drop_duplicates()
+        df["synt"] = df["chain"].map(chain_to_gene.groupby("chain").size())
+
+    # add gene features, skip genes not in the bed file (it should not happen but...)
+    df = df[df["gene"].isin(bed_data.keys())]
+    bed_df = pd.DataFrame.from_dict(
+        {k: [v[f] for f in BED_FEATURES] for k, v in bed_data.items()},
+        orient="index",
+        columns=["gene_len", "ex_num", "ex_fract", "intr_fract"],
+    )
+    df = df.join(bed_df, on="gene")
+    # gene-oriented table: keep genes in the order of appearance
+    gene_codes, _ = pd.factorize(df["gene"])
+    df = df.iloc[np.argsort(gene_codes, kind="stable")]
+    df = df[HEADER_FIELDS].reset_index(drop=True)
+    to_log(f"merge_chains_output: got combined dataframe with {len(df)} rows")
+    return df
+
+
 def save(data, output):
     """Save the data into the file."""
     # make the header
-    header_fields = (
-        "gene gene_overs chain synt gl_score gl_exo chain_len exon_qlen loc_exo exon_cover "
-        "intr_cover gene_len ex_num ex_fract intr_fract flank_cov".split()
-    )
-    header = "\t".join(header_fields) + "\n"
+    header = "\t".join(HEADER_FIELDS) + "\n"
     # define the stream to write the data
     to_log(f"merge_chains_output: Writing output to {output}")
     f = open(output, "w") if output != "stdout" else sys.stdout
@@ -298,9 +378,15 @@ def save(data, output):
 
 
 def merge_chains_output(
-    bed_file, isoforms_file, results_dir, output, exon_cov_chains=False
+    bed_file, isoforms_file, results_dir, output, exon_cov_chains=False, save_table=True
 ):
-    """Chains output merger core function."""
+    """Chains output merger core function.
+
+    If chain_runner.py produced typed records shards, return the
+    merged dataframe, so it can be classified without reading the output
+    table again; in this case the table is written to output only if
+    save_table is set. Otherwise, merge the text output and return None.
+    """
     # read bed file, get gene features
     bed_data = read_bed_data(bed_file)
     # load isoforms data if provided
@@ -309,6 +395,17 @@ def merge_chains_output(
         _, isoforms, _ = read_isoforms_file(isoforms_file)
     else:
         isoforms = None
+    records_shards = get_records_shards(results_dir)
+    if records_shards:
+        records = load_records(records_shards)
+        df = combine_records(bed_data, records, exon_cov_chains, isoforms)
+        del records  # columns are copied to the dataframe
+        if save_table:
+            to_log(f"merge_chains_output: Writing output to {output}")
+            df.to_csv(output if output != "stdout" else sys.stdout, sep="\t", index=False)
+        to_log(f"merge_chains_output: total runtime: {format(dt.now() - t0)}")
+        return df
+
     # read result files from unit
     chain_genes_data, chain_raw_data = load_results(results_dir)
     # I need this dict reverted actually
@@ -8,25 +8,26 @@ import argparse
 import sys
 from collections import defaultdict
 from collections import Counter
-import networkx as nx
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from version import __version__
 
 try:
     from modules.common import split_proj_name
     from modules.common import flatten
     from modules.common import die
-    from modules.common import get_graph_components
     from modules.common import read_isoforms_file
     from modules.common import to_log
     from modules.common import setup_logger
+    from modules.union_find import UnionFind
 except ImportError:
     from common import split_proj_name
     from common import flatten
     from common import die
-    from common import get_graph_components
     from common import read_isoforms_file
     from common import to_log
     from common import setup_logger
+    from union_find import UnionFind
 
 
 __author__ = "Bogdan M. Kirilenko"
@@ -48,6 +49,9 @@ PREFIX_LEN = 3
 
 assert len(Q_PREFIX) == len(R_PREFIX) == PREFIX_LEN
 MODULE_NAME_FOR_LOG = "orthology_mapping"
+# many2many components with at least this number of edges
+# are resolved in parallel, if there are several processes
+PARALLEL_MIN_EDGES = 1000
 
 
 def trim_prefix(s):
@@ -177,39 +181,37 @@ def get_t_trans_to_projections(que_projections):
 def connect_genes(t_trans_to_gene, t_trans_to_q_proj, q_proj_to_q_gene, proj_to_score):
     """Create orthology relationships graph.
 
-    Nodes are reference and query genes.
+    Nodes are reference and query genes, encoded with numbers:
+    reference genes go first, then query genes.
     If nodes are connected -> they are orthologs.
-    Also emit ref_gene -> que_gene -> scores dict.
+    Return gene names, number of reference genes, array of
+    (ref gene num, que gene num) edges and ref_gene -> que_gene -> scores dict.
     """
     to_log(f"{MODULE_NAME_FOR_LOG}: creating a mapping between reference and query genes...")
-    o_graph = nx.Graph()  # init the graph
     ref_que_gene_scores = defaultdict(list)
-    genes = set(t_trans_to_gene.values())
-    o_graph.add_nodes_from(genes)
-    q_genes_all = []
-    conn_count = 0  # connections counter
+    gene_to_num = {g: num for num, g in enumerate(dict.fromkeys(t_trans_to_gene.values()))}
+    ref_genes_num = len(gene_to_num)
+    edges = {}  # ordered set of (ref gene num, que gene num) pairs
     for t_trans, t_gene in t_trans_to_gene.items():
         # we know ref gene: ref transcripts relation by default
         # also we already know transcript-to-projections (trivial)
         projections = t_trans_to_q_proj[t_trans]
         # from projections (query transcripts) we know query gene ids
         # also for each t_gene -> q_gene: add score
-        q_genes = set()
         for proj_ in projections:
             q_gene = q_proj_to_q_gene[proj_]
-            q_genes.add(q_gene)
             o_score = proj_to_score.get(proj_, 0.0)
             score_dict_key = (t_gene, q_gene)
             ref_que_gene_scores[score_dict_key].append(o_score)
-        # add connections to graph
-        for q_gene in q_genes:
             # we can connect all of those q_genes with the reference gene
-            conn_count += 1
-            q_genes_all.append(q_gene)
-            o_graph.add_edge(t_gene, q_gene)
-    q_genes_all = set(q_genes_all)
-    to_log(f"{MODULE_NAME_FOR_LOG}: added {len(q_genes_all)} query genes to the orthology graph")
-    return o_graph, ref_que_gene_scores
+            q_gene_num = gene_to_num.setdefault(q_gene, len(gene_to_num))
+            edges[(gene_to_num[t_gene], q_gene_num)] = True
+    genes = list(gene_to_num.keys())
+    edges_arr = np.array(list(edges.keys()), dtype=np.int64).reshape(-1, 2)
+    to_log(
+        f"{MODULE_NAME_FOR_LOG}: added {len(genes) - ref_genes_num} query genes to the orthology graph"
+    )
+    return genes, ref_genes_num, edges_arr, ref_que_gene_scores
 
 
 def get_c_class(r_num, q_num):
@@ -234,105 +236,6 @@ def get_c_class(r_num, q_num):
         raise RuntimeError(err_msg)
 
 
-def is_complete_bipartite(graph, r_genes, q_genes):
-    """Return True if a complete bipartite graph provided.
-
-    Here we assume that the graph is bipartite.
-    The graph is complete if:
-    1) Each reference gene appears in #q_genes connections,
-    2) Each query gene appears in #r_genes connections."""
-    num_r_genes = len(r_genes)
-    num_q_genes = len(q_genes)
-    connections_flat = flatten(graph.edges())
-    conn_count = Counter(connections_flat)
-    # check criteria 1 and 2
-    all_ref_ok = all(conn_count[r] == num_q_genes for r in r_genes)
-    all_que_ok = all(conn_count[q] == num_r_genes for q in q_genes)
-    if all_ref_ok and all_que_ok:
-        # criteria 1 and 2 satisfied
-        return True
-    # something's not satisfied -> is not complete
-    return False
-
-
-def order_edges(edges_lst, ref_nodes):
-    """Reorder edges such as reference node is on the first position."""
-    ret = []
-    for edge in edges_lst:
-        f_, s_ = edge
-        if f_ in ref_nodes:
-            ref_node = f_
-            que_node = s_
-        else:
-            ref_node = s_
-            que_node = f_
-        item = (ref_node, que_node)
-        ret.append(item)
-    return ret
-
-
-def edges_to_dicts(graph, ref_nodes__set):
-    """Convert list of tuples to dicts."""
-    # in tuple ref and que may go in the different order
-    # this is why we cannot convert this list to dict directly
-    # need to check what on which position in each tuple first
-    edges = order_edges(graph.edges(), ref_nodes__set)
-    ref_nodes_edges = defaultdict(list)
-    que_nodes_edges = defaultdict(list)
-    for edge in edges:
-        ref_nodes_edges[edge[0]].append(edge[1])
-        que_nodes_edges[edge[1]].append(edge[0])
-    return ref_nodes_edges, que_nodes_edges
-
-
-def graph_is_empty(graph):
-    """Check whether graph is empty."""
-    return True if len(graph.nodes()) == 0 else False
-
-
-def graph_has_isolated_points(graph):
-    """Check whether graph has isolated nodes."""
-    return True if len(list(nx.isolates(graph))) > 0 else False
-
-
-def select_strongly_connected_ref_genes(ref_conns, que_conns):
-    """Select strongly connected reference genes.
-
-    Strongly connected genes have >1 common connections.
-    """
-    ret = {}
-    for ref_gene, queries in ref_conns.items():
-        ref_second_order = Counter(flatten(que_conns[q] for q in queries))
-        del ref_second_order[ref_gene]
-        strongly_connected = set(k for k, v in ref_second_order.items() if v > 1)
-        if len(strongly_connected) == 0:
-            continue
-        ret[ref_gene] = strongly_connected
-    return ret
-
-
-def sep_strong_conn(graph, strongly_connected):
-    """Check whether any of strongly connected ref genes are separated."""
-    if len(strongly_connected) == 0:
-        # nothing to check
-        return False
-    graph_nodes = set(graph.nodes())
-    s_conn_appear_here = {
-        k: v for k, v in strongly_connected.items() if k in graph_nodes
-    }
-    if len(s_conn_appear_here) == 0:
-        # nothing to check: no strongly connected genes here
-        return False
-    for k, v in s_conn_appear_here.items():
-        conn_num = len(v)
-        if len(v.intersection(graph_nodes)) < conn_num:
-            # need this set to be included into graph nodes
-            # if not the case: strongly connected nodes are in a different graph
-            return True
-    # nothing bad happened
-    return False
-
-
 def check_low_score_edges_removed(scores_edges_left, scores_edges_removed):
     """Return True if scores of removed edges are lower in comparison to remaining edges."""
     if all(x == 0.0 for x in scores_edges_removed):
@@ -351,149 +254,179 @@ def check_low_score_edges_removed(scores_edges_left, scores_edges_removed):
     return False
 
 
-def split_graph(graph, r_genes, q_genes, edge_to_score):
-    """Split many2many graph if possible."""
-    # 1: find lead edges: edges connected to leaf nodes
-    ref_nodes_set = set(r_genes)
-    # query_nodes_set = set(q_genes)
-    ref_conns, que_conns = edges_to_dicts(graph, ref_nodes_set)
-    ref_leaf_edges = [(k, v[0]) for k, v in ref_conns.items() if len(v) == 1]
-    que_leaf_edges = [(v[0], k) for k, v in que_conns.items() if len(v) == 1]
-    leaf_edges = set(ref_leaf_edges + que_leaf_edges)
-    if len(leaf_edges) == 0:
+def get_components(genes_num, edges):
+    """Split graph in connected components.
+
+    Return lists of gene numbers and arrays of edge indexes for each component.
+    """
+    genes_union = UnionFind(genes_num)
+    for ref_gene, que_gene in edges.tolist():
+        genes_union.union(ref_gene, que_gene)
+    components = genes_union.components()
+    gene_to_component = np.empty(genes_num, dtype=np.int64)
+    for num, component in enumerate(components):
+        gene_to_component[component] = num
+    # group edges by component
+    edge_components = gene_to_component[edges[:, 0]]
+    edges_order = np.argsort(edge_components, kind="stable")
+    bounds = np.searchsorted(edge_components[edges_order], np.arange(len(components) + 1))
+    components_edges = [edges_order[bounds[i]: bounds[i + 1]] for i in range(len(components))]
+    return components, components_edges
+
+
+def split_many2many(ref_num, que_num, edges, edge_scores):
+    """Split many2many component if possible.
+
+    Edges: array of (ref gene, que gene) pairs, genes are numbered
+    within the component. Return list of (ref genes, que genes) parts,
+    None if the component cannot be split.
+    """
+    refs, ques = edges[:, 0], edges[:, 1]
+    # 1: find leaf edges: edges connected to leaf nodes
+    ref_degree = np.bincount(refs, minlength=ref_num)
+    que_degree = np.bincount(ques, minlength=que_num)
+    leaf_edges = (ref_degree[refs] == 1) | (que_degree[ques] == 1)
+    if not leaf_edges.any():
         # if no leaves: too complicated case, don't try to resolve
-        return [
-            graph,
-        ]
-    # 2: get nodes connected to leaf edges, and set difference
-    leaf_conn_nodes = set(flatten(leaf_edges))
-    not_leaf_conn_nodes = set(graph.nodes()).difference(leaf_conn_nodes)
-    # 3: get list of reference nodes that must be not separated
-    ref_not_separate = select_strongly_connected_ref_genes(ref_conns, que_conns)
-    # 4: get local graph copy for manipulations
-    _loc_graph_copy = nx.Graph()
-    for edge in graph.edges():
-        # probably is faster than deepcopy()
-        _loc_graph_copy.add_edge(edge[0], edge[1])
-    # 5: get part of the graph consisting only leaf+ nodes
-    trimmed_parts_united = _loc_graph_copy.edge_subgraph(leaf_edges).copy()
-    trimmed_parts = get_graph_components(trimmed_parts_united)
-    remainder = _loc_graph_copy.subgraph(not_leaf_conn_nodes)
-    # 6: check that remainder has no isolated nodes
+        return None
+    # 2: get nodes connected to leaf edges, the rest of the graph is the remainder
+    ref_leaf_conn = np.zeros(ref_num, dtype=bool)
+    ref_leaf_conn[refs[leaf_edges]] = True
+    que_leaf_conn = np.zeros(que_num, dtype=bool)
+    que_leaf_conn[ques[leaf_edges]] = True
+    remainder_edges = ~ref_leaf_conn[refs] & ~que_leaf_conn[ques]
+    # 3: check that remainder has no isolated nodes
     # if so: we don't try to resolve this many2many
-    # return original graph
-    if graph_has_isolated_points(remainder):
-        return [
-            graph,
-        ]
-    # add remainder only if it's not empty
-    # otherwise it makes no sense
-    if not graph_is_empty(remainder):
-        trimmed_parts.append(remainder)
-    # check whether we separated strongly connected genes
-    if any(sep_strong_conn(g, ref_not_separate) for g in trimmed_parts):
-        # we separated genes that we didn't want to: return initial graph
-        return [
-            graph,
-        ]
-    # 7: primitive "statistics"
+    rem_ref_degree = np.bincount(refs[remainder_edges], minlength=ref_num)
+    rem_que_degree = np.bincount(ques[remainder_edges], minlength=que_num)
+    if (rem_ref_degree[~ref_leaf_conn] == 0).any() or (rem_que_degree[~que_leaf_conn] == 0).any():
+        return None
+    # 4: parts are components of the leaf edges subgraph and the remainder
+    # que genes are numbered after ref genes here
+    nodes_union = UnionFind(ref_num + que_num)
+    for ref_gene, que_gene in edges[leaf_edges].tolist():
+        nodes_union.union(ref_gene, ref_num + que_gene)
+    leaf_conn = np.concatenate((ref_leaf_conn, que_leaf_conn))
+    parts = [x for x in nodes_union.components() if leaf_conn[x[0]]]
+    remainder = np.nonzero(~leaf_conn)[0].tolist()
+    if remainder:
+        # add remainder only if it's not empty
+        parts.append(remainder)
+    node_to_part = np.empty(ref_num + que_num, dtype=np.int64)
+    for num, part in enumerate(parts):
+        node_to_part[part] = num
+    # 5: check whether we separated strongly connected genes:
+    # reference genes that have > 1 common query genes
+    adjacency = np.zeros((ref_num, que_num), dtype=np.float32)
+    adjacency[refs, ques] = 1
+    common_ques = adjacency @ adjacency.T
+    np.fill_diagonal(common_ques, 0)
+    strong_x, strong_y = np.nonzero(common_ques > 1)
+    if (node_to_part[strong_x] != node_to_part[strong_y]).any():
+        return None
+    # 6: primitive "statistics"
     # Just check that scores of deleted edges are significantly lower than
     # scores of remaining edges
-    original_edges = set(order_edges(graph.edges(), ref_nodes_set))
-    edges_left = set(
-        order_edges(flatten(x.edges() for x in trimmed_parts), ref_nodes_set)
-    )
-    edges_removed = original_edges.difference(edges_left)
-    edges_left_scores = [edge_to_score.get(e, 0.0) for e in edges_left]
-    edges_rem_scores = [edge_to_score.get(e, 0.0) for e in edges_removed]
-    bool__removed_low_score_edges = check_low_score_edges_removed(
-        edges_left_scores, edges_rem_scores
-    )
-    # 8: return graph parts or the original graph depending on edge scores
-    if bool__removed_low_score_edges is True:
-        return trimmed_parts
-    else:
-        # here we are not certain, better to return original graph
-        return [
-            graph,
-        ]
-
-
-def get_graph_conn(graph, over__ref_genes, over__que_genes):
-    """Create connection for subgraph."""
-    # TODO: remove code duplicate
-    graph_nodes = graph.nodes()
-    ref_genes = [x for x in over__ref_genes if x in graph_nodes]
-    que_genes = [x for x in over__que_genes if x in graph_nodes]
-    ref_len, que_len = len(ref_genes), len(que_genes)
-    c_class = get_c_class(ref_len, que_len)
-    conn = {R_GENES: ref_genes, Q_GENES: que_genes, C_CLASS: c_class}
-    return conn
-
-
-def resolve_many2many(graph, r_genes, q_genes, edge_to_score):
-    """Resolve many2many graph."""
-    is_b_complete = is_complete_bipartite(graph, r_genes, q_genes)
-    if is_b_complete:
-        to_log(
-            f"* the subgraph with reference genes {r_genes} and query "
-            f"genes {q_genes} is complete: leaving as many-2-many"
-        )
-        conn = {R_GENES: r_genes, Q_GENES: q_genes, C_CLASS: MANY2MANY}
-        return [
-            conn,
-        ]
-
-    # not complete bipartite graph
-    # first, select reference genes that have a single connection
-    # edges = [(node, node), (node, node), ..] -> list of pairs
-    ret = []
-    graph_parts = split_graph(graph, r_genes, q_genes, edge_to_score)
-    to_log(
-        f"* could split a subgraph for reference genes {r_genes} and query "
-        f"genes {q_genes} into {len(graph_parts)} components:"
-    )
-    for elem in graph_parts:
-        conn = get_graph_conn(elem, r_genes, q_genes)
-        ret.append(conn)
-        to_log(f"*** subcomponent: {conn}")
-    return ret
+    edges_left = leaf_edges | remainder_edges
+    if not check_low_score_edges_removed(
+        edge_scores[edges_left].tolist(), edge_scores[~edges_left].tolist()
+    ):
+        # here we are not certain, better to keep the component
+        return None
+    return [
+        ([x for x in part if x < ref_num], [x - ref_num for x in part if x >= ref_num])
+        for part in parts
+    ]
+
+
+def resolve_many2many(ref_num, que_num, edges, edge_scores):
+    """Resolve many2many component.
+
+    Return True if the component is a complete bipartite graph
+    and list of (ref genes, que genes) parts it is split into.
+    """
+    # edges are unique: complete if each ref gene is connected to each que gene
+    if len(edges) == ref_num * que_num:
+        return True, [(list(range(ref_num)), list(range(que_num)))]
+    parts = split_many2many(ref_num, que_num, edges, edge_scores)
+    if parts is None:
+        return False, [(list(range(ref_num)), list(range(que_num)))]
+    return False, parts
 
 
-def extract_orth_connections(graph, r_genes_all, q_genes_all, edge_to_score):
+def extract_orth_connections(genes, ref_genes_num, edges, edge_to_score, processes=1):
     """Split graph in orth connections."""
     orth_connections = []
-    graph_components = get_graph_components(graph)
+    components, components_edges = get_components(len(genes), edges)
     to_log(
-        f"{MODULE_NAME_FOR_LOG}: orthology graph contains {len(graph_components)} connected components"
+        f"{MODULE_NAME_FOR_LOG}: orthology graph contains {len(components)} connected components"
     )
-
-    for component in graph_components:
+    # many2many components are independent: resolve large ones in parallel
+    executor = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+    components_data = []
+    for component, component_edges in zip(components, components_edges):
         # each component contains some reference and query gene ids
         # and they are orthologs
-        nodes = component.nodes()
-        # split all nodes into ref and query gene ids:
-        r_genes = [n for n in nodes if n in r_genes_all]
-        q_genes = [n for n in nodes if n in q_genes_all]
+        r_nums = [n for n in component if n < ref_genes_num]
+        q_nums = [n for n in component if n >= ref_genes_num]
         # to define the class we need sizes of these groups:
-        r_len = len(r_genes)
-        q_len = len(q_genes)
-        c_class = get_c_class(r_len, q_len)
-
+        c_class = get_c_class(len(r_nums), len(q_nums))
+        resolved = None
         if c_class == MANY2MANY:
             # this is many2many, a different procedure
             # maybe this is not a complete bipartite graph
             # then we should split it into sub graphs
-            connections = resolve_many2many(component, r_genes, q_genes, edge_to_score)
-            orth_connections.extend(connections)
+            # number genes within the component
+            gene_to_local = {n: i for i, n in enumerate(r_nums)}
+            gene_to_local.update({n: i for i, n in enumerate(q_nums)})
+            local_edges = np.array(
+                [(gene_to_local[r], gene_to_local[q]) for r, q in edges[component_edges].tolist()],
+                dtype=np.int64,
+            )
+            edge_scores = np.array(
+                [edge_to_score.get((genes[r], genes[q]), 0.0) for r, q in edges[component_edges].tolist()]
+            )
+            args = (len(r_nums), len(q_nums), local_edges, edge_scores)
+            if executor and len(local_edges) >= PARALLEL_MIN_EDGES:
+                resolved = executor.submit(resolve_many2many, *args)
+            else:
+                resolved = resolve_many2many(*args)
+        components_data.append((r_nums, q_nums, c_class, resolved))
+
+    for r_nums, q_nums, c_class, resolved in components_data:
+        r_genes = [genes[n] for n in r_nums]
+        q_genes = [genes[n] for n in q_nums]
+        if c_class != MANY2MANY:
+            # not many2many: create connection object and save it
+            to_log(
+                f"* assigned class {c_class} to node containing reference "
+                f"genes: {r_genes} and query genes: {q_genes}"
+            )
+            conn = {R_GENES: r_genes, Q_GENES: q_genes, C_CLASS: c_class}
+            orth_connections.append(conn)
+            continue
+        # large components were submitted to the executor
+        is_complete, parts = resolved if isinstance(resolved, tuple) else resolved.result()
+        if is_complete:
+            to_log(
+                f"* the subgraph with reference genes {r_genes} and query "
+                f"genes {q_genes} is complete: leaving as many-2-many"
+            )
+            conn = {R_GENES: r_genes, Q_GENES: q_genes, C_CLASS: MANY2MANY}
+            orth_connections.append(conn)
             continue
-        # not many2many: create connection object and save it
         to_log(
-            f"* assigned class {c_class} to node containing reference "
-            f"genes: {r_genes} and query genes: {q_genes}"
+            f"* could split a subgraph for reference genes {r_genes} and query "
+            f"genes {q_genes} into {len(parts)} components:"
         )
-        conn = {R_GENES: r_genes, Q_GENES: q_genes, C_CLASS: c_class}
-        orth_connections.append(conn)
+        for part_r, part_q in parts:
+            part_r_genes = [r_genes[i] for i in part_r]
+            part_q_genes = [q_genes[i] for i in part_q]
+            c_class = get_c_class(len(part_r_genes), len(part_q_genes))
+            conn = {R_GENES: part_r_genes, Q_GENES: part_q_genes, C_CLASS: c_class}
+            orth_connections.append(conn)
+            to_log(f"*** subcomponent: {conn}")
+    executor.shutdown() if executor else None
 
     # count different orthology classes
     class_list = [c[C_CLASS] for c in orth_connections]
@@ -589,6 +522,7 @@ def orthology_type_map(
     loss_data=None,
     save_skipped=None,
     orth_scores_arg=None,
+    processes=1,
 ):
     """Make orthology classification track."""
     to_log(f"{MODULE_NAME_FOR_LOG}: called with the following parameters:")
@@ -639,8 +573,6 @@ def orthology_type_map(
         f"{MODULE_NAME_FOR_LOG}: processed query transcripts, got data for "
         f"{len(q_gene_to_trans)} genes and {len(q_trans_to_gene)} transcripts"
     )
-    r_genes_all = set(r_gene_to_trans.keys())
-    q_genes_all = set(q_gene_to_trans.keys())
     # make transcript to projections dict:
     t_trans_to_projections = get_t_trans_to_projections(que_transcripts)
     temp_query_mapped = flatten(t_trans_to_projections.values())
@@ -649,7 +581,7 @@ def orthology_type_map(
         f"transcripts to respective {len(temp_query_mapped)} query transcripts"
     )
     # create graph to connect orthologous transcripts
-    o_graph, ref_que_conn_scores = connect_genes(
+    genes, ref_genes_num, edges, ref_que_conn_scores = connect_genes(
         r_trans_to_gene, t_trans_to_projections, q_trans_to_gene, q_trans_l_score
     )
 
@@ -657,7 +589,7 @@ def orthology_type_map(
     # if a group of reference and query genes are in the same connected component
     # then they are orthologs
     orth_connections = extract_orth_connections(
-        o_graph, r_genes_all, q_genes_all, edge_to_score
+        genes, ref_genes_num, edges, edge_to_score, processes=processes
     )
     # save data, get list of transcript that were not projected
     not_saved = save_data(
@@ -697,6 +629,13 @@ def parse_args():
         "--save_skipped", "-s", default=None, help="Save orphan transcripts"
     )
     app.add_argument("--orth_scores", "-o", default=None, help="Orthology scores file")
+    app.add_argument(
+        "--processes",
+        "--pr",
+        type=int,
+        default=1,
+        help="Number of processes to resolve large many2many components",
+    )
     app.add_argument("--log_file", default=None, help="Log file")
     # print help if there are no args
     if len(sys.argv) < 2:
@@ -720,6 +659,7 @@ def main():
         loss_data=args.loss_data,
         save_skipped=args.save_skipped,
         orth_scores_arg=args.orth_scores,
+        processes=args.processes,
     )
 
 
@@ -2,31 +2,46 @@
 import time
 import os
 from modules.common import to_log
+from constants import Constants
 
 __author__ = "Bogdan M. Kirilenko"
 
-ITER_DURATION = 60  # CESAR jobs check interval
 NF_DIR_NAME = "nextflow_logs"
 
 
-def monitor_jobs(jobs_managers, die_if_sc_1=False):
-    """Monitor parallel jobs if many batches run simultaneously."""
+def monitor_jobs(
+    jobs_managers,
+    die_if_sc_1=False,
+    max_interval=Constants.MONITOR_MAX_INTERVAL,
+    min_interval=Constants.MONITOR_MIN_INTERVAL,
+    backoff=Constants.MONITOR_BACKOFF,
+    on_poll=None,
+):
+    """Monitor parallel jobs if many batches run simultaneously.
+
+    Waits for the first unfinished batch: strategies driven by a local
+    process or pool return as soon as the jobs are done. The waiting
+    timeout grows from min_interval to max_interval, so strategies
+    without anything to wait for are polled with a backoff.
+    on_poll: function called after each check, for instance,
+    to process output of already finished jobs.
+    """
     to_log(f"## Stated polling cluster jobs until they done")
+    t0 = time.time()
+    interval = min_interval
     iter_num = 0
     while True:  # Run until all jobs are done (or crashed)
-        all_done = True  # default val, re-define if something is not done
-        for job_manager in jobs_managers:
-            # check if each process is still running
-            rc = job_manager.check_status()
-            if rc is None:
-                all_done = False
-        if all_done:
+        # check if each process is still running
+        running = [jm for jm in jobs_managers if jm.check_status() is None]
+        on_poll() if on_poll else None
+        if not running:
             to_log("### CESAR jobs done ###")
             break
-        else:
-            to_log(f"Polling iteration {iter_num}; already waiting {ITER_DURATION * iter_num} seconds.")
-            time.sleep(ITER_DURATION)
-            iter_num += 1
+        waiting = int(time.time() - t0)
+        to_log(f"Polling iteration {iter_num}; already waiting {waiting} seconds.")
+        running[0].wait(interval)
+        interval = min(interval * backoff, max_interval)
+        iter_num += 1
 
     if any(jm.return_code != 0 for jm in jobs_managers) and die_if_sc_1 is True:
         # some para/nextflow job died: critical issue
@@ -0,0 +1,64 @@
+"""Store of precomputed reference exons, indexed by transcript ID.
+
+Records are saved one after another to the data file; the index is
+a numpy array of (transcript ID, offset, length) sorted by transcript ID.
+Both files are memory-mapped by the reader, so a CESAR wrapper job
+reads only the index pages touched by the binary search and its own record.
+"""
+import mmap
+import os
+import numpy as np
+
+__author__ = "Bogdan M. Kirilenko"
+
+DATA_EXT = ".dat"
+INDEX_EXT = ".idx.npy"
+
+
+def get_store_files(store):
+    """Get data and index file paths of the store."""
+    return f"{store}{DATA_EXT}", f"{store}{INDEX_EXT}"
+
+
+def save_ref_exons_store(records, store):
+    """Save (transcript ID, record string) pairs to the store."""
+    data_file, index_file = get_store_files(store)
+    f = open(data_file, "wb")
+    index = []
+    offset = 0
+    for transcript, record in records:
+        record = record.encode("utf-8")
+        f.write(record)
+        index.append((transcript.encode("utf-8"), offset, len(record)))
+        offset += len(record)
+    f.close()
+    id_len = max((len(x[0]) for x in index), default=1)
+    index_arr = np.array(
+        sorted(index), dtype=[("id", f"S{id_len}"), ("offset", np.int64), ("length", np.int64)]
+    )
+    np.save(index_file, index_arr)
+    return len(index)
+
+
+class RefExonsStore:
+    """Read records of the store."""
+
+    def __init__(self, store):
+        data_file, index_file = get_store_files(store)
+        self.index = np.load(index_file, mmap_mode="r")
+        self.ids = self.index["id"]
+        f = open(data_file, "rb")
+        # mmap cannot map an empty file
+        self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(data_file) else b""
+        f.close()
+
+    def get(self, transcript):
+        """Get record string of the transcript, None if it is not in the store."""
+        key = transcript.encode("utf-8")
+        if len(key) > self.ids.dtype.itemsize:  # would be compared truncated
+            return None
+        pos = int(np.searchsorted(self.ids, key))
+        if pos == len(self.ids) or self.ids[pos] != key:
+            return None
+        offset, length = int(self.index["offset"][pos]), int(self.index["length"][pos])
+        return self.data[offset: offset + length].decode("utf-8")
@@ -0,0 +1,169 @@
+"""Reference pack: reference-only data shared by runs against many query genomes.
+
+Filtered annotation and its HDF5 index, checked isoforms and U12 files,
+CDS bed data, exon sequences with splice sites and flanks and CESAR-formatted
+exons of each reference transcript are computed once by "toga.py build_ref_pack".
+TOGA runs with --ref_pack only read the pack.
+"""
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime as dt
+from twobitreader import TwoBitFile
+from version import __version__
+
+try:
+    from modules.bed_hdf5_index import bed_hdf5_index
+    from modules.common import make_cds_track
+    from modules.common import to_log
+    from modules.filter_bed import prepare_bed_file
+    from modules.ref_exons_store import get_store_files
+    from modules.ref_exons_store import save_ref_exons_store
+    from modules.toga_sanity_checks import TogaSanityChecker
+except ImportError:
+    from bed_hdf5_index import bed_hdf5_index
+    from common import make_cds_track
+    from common import to_log
+    from filter_bed import prepare_bed_file
+    from ref_exons_store import get_store_files
+    from ref_exons_store import save_ref_exons_store
+    from toga_sanity_checks import TogaSanityChecker
+
+__author__ = "Bogdan M. Kirilenko"
+
+REF_PACK_VERSION = 3
+MANIFEST = "ref_pack.json"
+REF_BED = "toga_filt_ref_annot.bed"
+REF_BED_INDEX = "toga_filt_ref_annot.hdf5"
+REF_EXONS = "ref_exons"
+BED_FILTER_REJECTED = "BED_FILTER_REJECTED.txt"
+LOG_EVERY = 10000
+MODULE_NAME_FOR_LOG = "reference_pack"
+
+
+def file_md5(path):
+    """Compute md5 checksum of a file."""
+    md5 = hashlib.md5()
+    f = open(path, "rb")
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+        md5.update(chunk)
+    f.close()
+    return md5.hexdigest()
+
+
+def iter_ref_exons(ref_bed, t_2bit):
+    """Extract exon sequences, splice sites and flanks of each transcript."""
+    # CESAR_wrapper loads compiled libraries on import, which are
+    # not necessarily built yet when toga.py imports this module
+    from CESAR_wrapper import dump_ref_exons
+    from CESAR_wrapper import get_exons
+    from CESAR_wrapper import parse_bed_track
+
+    target_genome = TwoBitFile(t_2bit)
+    f = open(ref_bed, "r")
+    for num, line in enumerate(f, 1):
+        bed_data = parse_bed_track(make_cds_track(line.rstrip("\n")))
+        exons_data = get_exons(bed_data, t_2bit, target_genome=target_genome)
+        yield line.split("\t")[3], dump_ref_exons(bed_data, exons_data)
+        if num % LOG_EVERY == 0:
+            to_log(f"{MODULE_NAME_FOR_LOG}: extracted exons of {num} transcripts")
+    f.close()
+
+
+def build_reference_pack(t_2bit, bed_input, pack_dir, isoforms=None, u12=None, only_chrom=None):
+    """Precompute reference-only data and save it to pack_dir."""
+    t_2bit = os.path.abspath(t_2bit)
+    os.makedirs(pack_dir, exist_ok=True)
+    to_log(f"{MODULE_NAME_FOR_LOG}: building reference pack in {pack_dir}")
+    ref_bed = os.path.join(pack_dir, REF_BED)
+    prepare_bed_file(
+        bed_input,
+        ref_bed,
+        ouf=False,
+        save_rejected=os.path.join(pack_dir, BED_FILTER_REJECTED),
+        only_chrom=only_chrom,
+    )
+    f = open(ref_bed, "r")
+    lines = [line.rstrip("\n").split("\t") for line in f]
+    f.close()
+    t_in_bed = set(x[3] for x in lines)
+    TogaSanityChecker.check_2bit_file_completeness(t_2bit, {x[0]: None for x in lines}, ref_bed)
+    isoforms_file = TogaSanityChecker.check_isoforms_file(isoforms, t_in_bed, pack_dir)
+    u12_file = TogaSanityChecker.check_and_write_u12_file(u12, t_in_bed, pack_dir)
+
+    bed_hdf5_index(ref_bed, os.path.join(pack_dir, REF_BED_INDEX))
+    transcripts_num = save_ref_exons_store(
+        iter_ref_exons(ref_bed, t_2bit), os.path.join(pack_dir, REF_EXONS)
+    )
+
+    manifest = {
+        "ref_pack_version": REF_PACK_VERSION,
+        "toga_version": str(__version__),
+        "created": str(dt.now()),
+        "t_2bit": t_2bit,
+        "t_2bit_md5": file_md5(t_2bit),
+        "bed_input": os.path.abspath(bed_input),
+        "bed_input_md5": file_md5(bed_input),
+        "only_chrom": only_chrom,
+        "isoforms": os.path.basename(isoforms_file) if isoforms_file else None,
+        "u12": os.path.basename(u12_file) if u12_file else None,
+        "transcripts": transcripts_num,
+    }
+    f = open(os.path.join(pack_dir, MANIFEST), "w")
+    json.dump(manifest, f, indent=2)
+    f.close()
+    to_log(f"{MODULE_NAME_FOR_LOG}: saved {transcripts_num} reference transcripts to {pack_dir}")
+
+
+class ReferencePack:
+    """Read-only access to a reference pack."""
+
+    def __init__(self, pack_dir):
+        self.pack_dir = os.path.abspath(pack_dir)
+        manifest_path = os.path.join(self.pack_dir, MANIFEST)
+        if not os.path.isfile(manifest_path):
+            raise ValueError(f"Error! {pack_dir} is not a reference pack: {MANIFEST} not found")
+        f = open(manifest_path, "r")
+        self.manifest = json.load(f)
+        f.close()
+        if self.manifest["ref_pack_version"] != REF_PACK_VERSION:
+            raise ValueError(
+                f"Error! Reference pack {pack_dir} has version {self.manifest['ref_pack_version']}, "
+                f"expected {REF_PACK_VERSION}; please rebuild it"
+            )
+        self.ref_bed = os.path.join(self.pack_dir, REF_BED)
+        self.index_bed_file = os.path.join(self.pack_dir, REF_BED_INDEX)
+        self.ref_exons = os.path.join(self.pack_dir, REF_EXONS)
+        self.bed_filter_rejected = os.path.join(self.pack_dir, BED_FILTER_REJECTED)
+        self.isoforms = self.__pack_file(self.manifest["isoforms"])
+        self.u12 = self.__pack_file(self.manifest["u12"])
+
+    def __pack_file(self, filename):
+        return os.path.join(self.pack_dir, filename) if filename else None
+
+    def check_inputs(self, t_2bit, bed_input):
+        """Check that the pack was built from these reference files.
+
+        Return error message, None if they match.
+        """
+        pack_files = (self.ref_bed, self.index_bed_file, self.isoforms, self.u12)
+        for path in pack_files + get_store_files(self.ref_exons):
+            if path and not os.path.isfile(path):
+                return f"Error! Reference pack {self.pack_dir} is incomplete: {path} not found"
+        if file_md5(t_2bit) != self.manifest["t_2bit_md5"]:
+            return (
+                f"Error! Reference pack {self.pack_dir} was built for {self.manifest['t_2bit']}, "
+                f"which differs from {t_2bit}"
+            )
+        if file_md5(bed_input) != self.manifest["bed_input_md5"]:
+            return (
+                f"Error! Reference pack {self.pack_dir} was built for annotation "
+                f"{self.manifest['bed_input']}, which differs from {bed_input}"
+            )
+        return None
+
+    def copy_rejected(self, rejected_dir):
+        """Copy transcripts rejected by the bed filter, to report them in this run."""
+        if os.path.isfile(self.bed_filter_rejected):
+            shutil.copy(self.bed_filter_rejected, rejected_dir)
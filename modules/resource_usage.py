@@ -0,0 +1,129 @@
+"""Collect wall time, CPU time, peak RSS and I/O of TOGA steps and jobs.
+
+Parallel jobs (chain_runner.py, cesar_runner.py) save their usage
+to a JSON file each, TOGA measures its own steps and merges
+everything into a report saved as JSON and TSV.
+"""
+import json
+import os
+import resource
+import sys
+import time
+
+__author__ = "Bogdan M. Kirilenko"
+
+BLOCK_SIZE = 512  # getrusage counts I/O in 512 bytes blocks
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+MAXRSS_TO_MB = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024
+BYTES_IN_MB = 1024 * 1024
+REPORT_FIELDS = ("wall_time", "cpu_time", "max_rss_mb", "read_mb", "written_mb")
+
+
+def get_resource_usage():
+    """Get CPU time, peak RSS and I/O of this process and its finished children."""
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu_time": sum(
+            x.ru_utime + x.ru_stime for x in (usage_self, usage_children)
+        ),
+        "max_rss_mb": max(usage_self.ru_maxrss, usage_children.ru_maxrss) * MAXRSS_TO_MB,
+        "read_mb": (usage_self.ru_inblock + usage_children.ru_inblock) * BLOCK_SIZE / BYTES_IN_MB,
+        "written_mb": (usage_self.ru_oublock + usage_children.ru_oublock) * BLOCK_SIZE / BYTES_IN_MB,
+    }
+
+
+def save_job_usage(path, runner, job, start_time, jobs_num):
+    """Save resource usage of a job, start_time is time.time() at the job start."""
+    usage = get_resource_usage()
+    usage["wall_time"] = time.time() - start_time
+    usage["runner"] = runner
+    usage["job"] = job
+    usage["jobs_num"] = jobs_num
+    f = open(path, "w")
+    json.dump(usage, f)
+    f.close()
+
+
+def read_jobs_usage(stats_dir):
+    """Read resource usage records saved by parallel jobs."""
+    if stats_dir is None or not os.path.isdir(stats_dir):
+        return []
+    jobs_usage = []
+    for filename in sorted(os.listdir(stats_dir)):
+        f = open(os.path.join(stats_dir, filename), "r")
+        try:
+            jobs_usage.append(json.load(f))
+        except json.JSONDecodeError:  # job was killed while saving the data
+            pass
+        f.close()
+    return jobs_usage
+
+
+def summarize_jobs_usage(jobs_usage):
+    """Summarize resource usage of jobs executed by each runner."""
+    summary = {}
+    for usage in jobs_usage:
+        runner_summary = summary.setdefault(
+            usage["runner"],
+            {"jobs": 0, "max_wall_time": 0.0, "max_rss_mb": 0.0,
+             "wall_time": 0.0, "cpu_time": 0.0, "read_mb": 0.0, "written_mb": 0.0},
+        )
+        runner_summary["jobs"] += 1
+        runner_summary["max_wall_time"] = max(runner_summary["max_wall_time"], usage["wall_time"])
+        runner_summary["max_rss_mb"] = max(runner_summary["max_rss_mb"], usage["max_rss_mb"])
+        for field in ("wall_time", "cpu_time", "read_mb", "written_mb"):
+            runner_summary[field] += usage[field]
+    return summary
+
+
+class StepsUsageMonitor:
+    """Measure resource usage of TOGA steps.
+
+    CPU time and I/O include finished child processes,
+    such as jobs executed locally. Peak RSS is the peak
+    of the TOGA process and its children since the start.
+    Steps can run concurrently, then the CPU time and I/O
+    of each include those of the other steps.
+    """
+
+    def __init__(self):
+        self.steps_usage = []
+        self.__running = {}  # step: (start time, start usage)
+
+    def start(self, step):
+        """Start measuring the step."""
+        self.__running[step] = (time.time(), get_resource_usage())
+
+    def stop(self, step):
+        """Save the step resource usage."""
+        if step not in self.__running:
+            return
+        start_time, start_usage = self.__running.pop(step)
+        usage = get_resource_usage()
+        step_usage = {"step": step, "wall_time": time.time() - start_time}
+        for field in ("cpu_time", "read_mb", "written_mb"):
+            step_usage[field] = usage[field] - start_usage[field]
+        step_usage["max_rss_mb"] = usage["max_rss_mb"]
+        self.steps_usage.append(step_usage)
+
+    def save_report(self, json_path, tsv_path, jobs_stats_dir):
+        """Save steps and jobs resource usage."""
+        jobs_usage = read_jobs_usage(jobs_stats_dir)
+        report = {
+            "steps": self.steps_usage,
+            "runners": summarize_jobs_usage(jobs_usage),
+            "jobs": jobs_usage,
+        }
+        f = open(json_path, "w")
+        json.dump(report, f, indent=2)
+        f.close()
+
+        f = open(tsv_path, "w")
+        f.write("\t".join(("type", "name") + REPORT_FIELDS) + "\n")
+        rows = [("step", str(x["step"]), x) for x in self.steps_usage]
+        rows.extend(("job", f"{x['runner']}:{x['job']}", x) for x in jobs_usage)
+        for row_type, name, usage in rows:
+            values = [f"{usage[x]:.3f}" for x in REPORT_FIELDS]
+            f.write("\t".join([row_type, name] + values) + "\n")
+        f.close()
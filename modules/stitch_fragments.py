@@ -3,9 +3,13 @@
 
 """
 import argparse
+import heapq
+import math
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime as dt
 from collections import defaultdict
+from itertools import repeat
 from version import __version__
 
 try:
@@ -19,89 +23,14 @@ except ImportError:
     from common import make_cds_track
     from common import flatten
 
-# artificial 0-scored points
-SOURCE = "SOURCE"
-SINK = "SINK"
 SCORE_THRESHOLD = 0.5
 EXON_COV_THRESHOLD = 1.33
 MAX_OVERLAP = 250  # TODO: check whether 250 is a good option
+CHUNKS_PER_PROCESS = 4  # smaller chunks balance the load between processes
 
 __author__ = "Ekaterina Osipova & Bogdan M. Kirilenko"
 
 
-class Vertex:
-    """Graph vertex."""
-
-    def __init__(self, name, start, end, score):
-        self.name = name
-        self.start = start
-        self.end = end
-        self.score = score
-        self.children = list()
-
-    def add_child(self, v):
-        if v not in self.children:
-            self.children.append(v)
-
-
-class Graph:
-    """Build a directed graph using adjacency list."""
-
-    def __init__(self):
-        self.vertices = {}
-
-    def add_vertex(self, vertex):
-        """Add vertex if it's not in the vertices list."""
-        if isinstance(vertex, Vertex) and vertex.name not in self.vertices:
-            self.vertices[vertex.name] = vertex
-            return True
-        else:
-            return False
-
-    def add_edge(self, parent, child):
-        """Find vertices with parent and child names."""
-        if parent in self.vertices and child in self.vertices:
-            self.vertices[parent].add_child(child)
-            return True
-        else:
-            return False
-
-    def topological_sort_util(self, v, visited, stack):
-        """Perform Depth First Search
-
-        Mark the current node as visited.
-        """
-        visited[v] = True
-        # check all children of this vertex if they're visited
-        for i in self.vertices[v].children:
-            if visited[i] is False:
-                self.topological_sort_util(i, visited, stack)
-        # add current vertex to stack
-        stack.insert(0, v)
-
-    def topological_sort(self):
-        """Perform topological sort.
-
-        Use recursive function topological_sort_util().
-        Mark all the vertices as not visited.
-        """
-        visited = {v: False for v in self.vertices}
-        # initiate stack to store sorted vertices
-        stack = []
-        for vertex in self.vertices:
-            if visited[vertex] is False:
-                self.topological_sort_util(vertex, visited, stack)
-        # return sorted list of vertices
-        return stack
-
-    def __repr__(self):
-        lines = []
-        for elem in self.vertices.keys():
-            line = f"{elem}\t{self.vertices[elem].children}\n"
-            lines.append(line)
-        return "".join(lines)
-
-
 def parse_args():
     """Parse CMD args."""
     app = argparse.ArgumentParser()
@@ -117,6 +46,13 @@ def parse_args():
         dest="only_fragmented",
         help="Output fragmented genes only.",
     )
+    app.add_argument(
+        "--processes",
+        "-p",
+        type=int,
+        default=1,
+        help="Number of processes to stitch transcripts in parallel",
+    )
     app.add_argument("--log_file", help="Log file", default=None)
     if len(sys.argv) < 3:
         app.print_help()
@@ -198,90 +134,43 @@ def read_gene_loci(bed_file):
     return ret
 
 
-def build_chain_graph(chain_id_to_loc, intersecting_chains_wscores):
-    """Build chain graph.
+def find_best_path(intersecting_chains_wscores, chain_id_to_loc):
+    """Find the highest scoring sequence of chains.
 
-    Read chains and corresponding scores into
-    a chain dictionary {chain: (start, end, score)}.
+    Chains in the sequence are ordered by start, each chain starts
+    not earlier than MAX_OVERLAP before the previous one ends.
+    Weighted interval scheduling: chains are processed by start,
+    chains that can precede the current one are taken from a heap
+    ordered by end - MAX_OVERLAP; O(n log n).
     """
-    chain_graph = Graph()
-    # add all vertices to the chain graph
+    chain_scores = {}
     for chain_id, score in intersecting_chains_wscores:
-        start, end = chain_id_to_loc.get(chain_id, (None, None))
-        if start is None:
+        if chain_id not in chain_id_to_loc:
             raise ValueError(f"Cannot find chain {chain_id}")
-        v = Vertex(chain_id, start, end, -1 * score)
-        chain_graph.add_vertex(v)
-
-    # add edges to the chain graph
-    for i in chain_graph.vertices:
-        for j in chain_graph.vertices:
-            if i == j:
-                # no need to connect the point to itself
-                continue
-            i_vertex = chain_graph.vertices[i]
-            j_vertex = chain_graph.vertices[j]
-            # allow some overlap between chains
-            # defined in the MAX_OVERLAP constant
-            i_vertex_and_flank = i_vertex.end - MAX_OVERLAP
-            if i_vertex_and_flank <= j_vertex.start:
-                chain_graph.add_edge(i_vertex.name, j_vertex.name)
-    return chain_graph
-
-
-def add_source_sink_graph(graph_name):
-    """Add artificial Source and Sink vertices to the chain graph.
-
-    Assign them zero length and zero score.
-    """
-    source_end = min(
-        [graph_name.vertices[vertex].start for vertex in graph_name.vertices]
-    )
-    source_start = source_end
-    sink_start = max(
-        [graph_name.vertices[vertex].end for vertex in graph_name.vertices]
-    )
-    sink_end = sink_start
-    graph_name.add_vertex(Vertex(SOURCE, source_start, source_end, 0))
-    graph_name.add_vertex(Vertex(SINK, sink_start, sink_end, 0))
-
-    # add edges from Source to each vertex
-    for vertex in graph_name.vertices:
-        if vertex != SOURCE:
-            graph_name.add_edge(SOURCE, vertex)
+        chain_scores.setdefault(chain_id, score)
+    chains = sorted(chain_scores.keys(), key=lambda x: chain_id_to_loc[x][0])
+    path_scores, prev_chains = {}, {}
+    ends_heap = []  # (end - MAX_OVERLAP, chain) for processed chains
+    best_prev = None  # highest scoring chain that can precede the current one
 
-    # add edges from each vertex to Sink
-    for vertex in graph_name.vertices:
-        if vertex != SINK:
-            graph_name.add_edge(vertex, SINK)
-    return  # all
-
-
-def find_shortest_path(graph_name, source, sink, sorted_vertices):
-    """Find the shortest path in directed acyclic graph.
-
-    Initiate dictionary with the shortest paths to each node:
-    {vertex: (value, path itself)}.
-    """
-    shortest_paths = {}
-    for sorted_vertex in sorted_vertices:
-        shortest_paths[sorted_vertex] = (0, [source])
-
-    # check each child of the current vertex
-    # and update shortest path to this vertex in the dictionary
-    for sorted_vertex in sorted_vertices:
-        children = graph_name.vertices[sorted_vertex].children
-        for child in children:
-            current_score = shortest_paths[child][0]
-            sp_sv_0 = shortest_paths[sorted_vertex][0]
-            gn_sv_s = graph_name.vertices[child].score
-            score_if_updated = sp_sv_0 + gn_sv_s
-            if score_if_updated < current_score:
-                new_path = list(shortest_paths[sorted_vertex][1])
-                if sorted_vertex not in new_path:
-                    new_path.append(sorted_vertex)
-                shortest_paths[child] = (score_if_updated, new_path)
-    return shortest_paths[sink]
+    for chain_id in chains:
+        start, end = chain_id_to_loc[chain_id]
+        while ends_heap and ends_heap[0][0] <= start:
+            _, prev = heapq.heappop(ends_heap)
+            if best_prev is None or path_scores[prev] > path_scores[best_prev]:
+                best_prev = prev
+        prev_score = path_scores[best_prev] if best_prev is not None else 0
+        path_scores[chain_id] = prev_score + chain_scores[chain_id]
+        prev_chains[chain_id] = best_prev
+        heapq.heappush(ends_heap, (end - MAX_OVERLAP, chain_id))
+
+    # restore the path from its last chain
+    path = []
+    chain_id = max(chains, key=lambda x: path_scores[x])
+    while chain_id is not None:
+        path.append(chain_id)
+        chain_id = prev_chains[chain_id]
+    return path[::-1]
 
 
 def check_exon_coverage(chains, chain_id_to_loc, exons_loci):
@@ -318,7 +207,41 @@ def get_average_exon_cov(chain_to_exon_cov, exon_num):
     return average_cov
 
 
-def stitch_scaffolds(chain_file, chain_scores_file, bed_file, fragments_only=False):
+def stitch_transcript(intersecting_chains_wscores, chain_id_to_loc, exon_coords, fragments_only):
+    """Get path of chains for a potentially fragmented transcript, None if it is not."""
+    # extract some extra information about exon coverage
+    intersecting_chains = [x[0] for x in intersecting_chains_wscores]
+    chain_id_to_exon_cov = check_exon_coverage(
+        intersecting_chains, chain_id_to_loc, exon_coords
+    )
+    chain_id_covers_all = {
+        k: all(v for v in val) for k, val in chain_id_to_exon_cov.items()
+    }
+    if any(chain_id_covers_all.values()):
+        # if there is a chain that covers the transcript entirely: skip this
+        return None
+    average_exon_coverage = get_average_exon_cov(
+        chain_id_to_exon_cov, len(exon_coords)
+    )
+    if average_exon_coverage > EXON_COV_THRESHOLD:
+        # skip if each exon is covered > EXON_COV_THRESHOLD times in average
+        return None
+    path = find_best_path(intersecting_chains_wscores, chain_id_to_loc)
+    if fragments_only and len(path) < 2:
+        # this transcript is covered entirely by a single chain
+        return None
+    return path
+
+
+def stitch_transcripts(tasks, fragments_only):
+    """Stitch a chunk of transcripts, return (transcript, path or None) pairs."""
+    return [
+        (transcript, stitch_transcript(chains_wscores, chain_id_to_loc, exon_coords, fragments_only))
+        for transcript, chains_wscores, chain_id_to_loc, exon_coords in tasks
+    ]
+
+
+def stitch_scaffolds(chain_file, chain_scores_file, bed_file, fragments_only=False, processes=1):
     """Stitch chains of fragmented orthologs."""
     to_log("stitch_fragments: started stitching fragmented orthologous loci (if any)")
     transcript_score_dict = read_gene_scores(chain_scores_file)
@@ -337,13 +260,11 @@ def stitch_scaffolds(chain_file, chain_scores_file, bed_file, fragments_only=Fal
         k: v for k, v in chain_id_to_loc__no_filt.items() if k in orth_chains
     }
     genes_to_exon_coords = read_gene_loci(bed_file)
-    transcript_to_path = {}
     task_size = len(transcript_score_dict.keys())
     to_log(f"stitch fragments: processing {task_size} transcripts")
-    count = 1
 
+    tasks = []
     for transcript, intersecting_chains_wscores in transcript_score_dict.items():
-        count += 1
         if len(intersecting_chains_wscores) <= 1:
             continue
         # intersecting chains: list of tuples
@@ -355,43 +276,30 @@ def stitch_scaffolds(chain_file, chain_scores_file, bed_file, fragments_only=Fal
             err_msg = f"Cannot find a bed track for {transcript}"
             to_log(f"stitch fragments: FATAL ERROR {err_msg}")
             raise ValueError(err_msg)
-        # extract some extra information about exon coverage
-        intersecting_chains = [x[0] for x in intersecting_chains_wscores]
-        chain_id_to_exon_cov = check_exon_coverage(
-            intersecting_chains, chain_id_to_loc, exon_coords
-        )
-        chain_id_covers_all = {
-            k: all(v for v in val) for k, val in chain_id_to_exon_cov.items()
+        # each transcript is processed independently: pass only its chains
+        transcript_chain_locs = {
+            x[0]: chain_id_to_loc[x[0]] for x in intersecting_chains_wscores if x[0] in chain_id_to_loc
         }
-        if any(chain_id_covers_all.values()):
-            # if there is a chain that covers the transcript entirely: skip this
-            continue
-        average_exon_coverage = get_average_exon_cov(
-            chain_id_to_exon_cov, len(exon_coords)
-        )
-        if average_exon_coverage > EXON_COV_THRESHOLD:
-            # skip if each exon is covered > EXON_COV_THRESHOLD times in average
-            continue
-        # Initiate chain graph
-        chain_graph = build_chain_graph(chain_id_to_loc, intersecting_chains_wscores)
-        add_source_sink_graph(chain_graph)
-
-        # Topologically sort chain graph
-        sorted_vertices = chain_graph.topological_sort()
-
-        # Find 'longest' (=highest scoring) path in the graph =
-        # find the shortest path in the graph with negative scoring vertices.
-        longest_path_chain_graph = find_shortest_path(
-            chain_graph, SOURCE, SINK, sorted_vertices
-        )
-        _, _path = longest_path_chain_graph
-        path = _path[1:]  # starts with [SOURCE, ... ]
-        if fragments_only and len(path) < 2:
-            # this transcript is covered entirely by a single chain
-            continue
-        to_log(f"stitch fragments: transcript {transcript} is potentially fragmented")
-        transcript_to_path[transcript] = path
-        del chain_graph
+        tasks.append((transcript, intersecting_chains_wscores, transcript_chain_locs, exon_coords))
+
+    chunk_size = max(1, math.ceil(len(tasks) / (processes * CHUNKS_PER_PROCESS)))
+    chunks = [tasks[i: i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+    if processes > 1 and len(chunks) > 1:
+        to_log(f"stitch fragments: using {processes} processes for {len(chunks)} chunks of transcripts")
+        executor = ProcessPoolExecutor(max_workers=processes)
+        chunks_results = executor.map(stitch_transcripts, chunks, repeat(fragments_only))
+    else:
+        executor = None
+        chunks_results = (stitch_transcripts(x, fragments_only) for x in chunks)
+
+    transcript_to_path = {}
+    for chunk_results in chunks_results:
+        for transcript, path in chunk_results:
+            if path is None:
+                continue
+            to_log(f"stitch fragments: transcript {transcript} is potentially fragmented")
+            transcript_to_path[transcript] = path
+    executor.shutdown() if executor else None
     to_log(f"stitch fragments: identified {len(transcript_to_path)} fragmented transcripts")
     return transcript_to_path
 
@@ -405,6 +313,7 @@ if __name__ == "__main__":
         args.chain_scores_file,
         args.bed_file,
         fragments_only=args.only_fragmented,
+        processes=args.processes,
     )
     # save output
     for k, v in transcript_to_path.items():
@@ -0,0 +1,168 @@
+"""Per-step manifest of a TOGA run.
+
+For each completed step, TOGA saves its input file hashes,
+its output files and the state of the Toga object that the
+next steps need. Large inputs, such as 2bit files, are recorded
+by their size and modification time instead of the hash.
+A crashed run can be resumed from the first step that is not complete.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime as dt
+
+try:
+    from modules.common import to_log
+except ImportError:
+    from common import to_log
+
+__author__ = "Bogdan M. Kirilenko"
+
+MODULE_NAME_FOR_LOG = "toga_manifest"
+MANIFEST_VERSION = 2
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def get_file_hash(path):
+    """Compute sha256 of a file content."""
+    file_hash = hashlib.sha256()
+    f = open(path, "rb")
+    for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+        file_hash.update(chunk)
+    f.close()
+    return file_hash.hexdigest()
+
+
+def get_file_stat(path):
+    """Get [size, modification time] of a file."""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def get_args_hash(args_dict):
+    """Compute hash of the arguments that define the results."""
+    args_str = json.dumps(args_dict, sort_keys=True, default=str)
+    return hashlib.sha256(args_str.encode()).hexdigest()
+
+
+class TogaManifest:
+    """Manifest of completed TOGA steps saved as a JSON file.
+
+    args_hash: hash of the arguments that define the results,
+    steps done with other arguments cannot be reused.
+    """
+
+    def __init__(self, path, args_hash):
+        self.path = path
+        self.args_hash = args_hash
+        self.steps = {}
+        self.__hash_cache = {}  # path -> (size, mtime, hash)
+
+    def __get_hash(self, path):
+        stat = os.stat(path)
+        cached = self.__hash_cache.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        file_hash = get_file_hash(path)
+        self.__hash_cache[path] = (stat.st_size, stat.st_mtime_ns, file_hash)
+        return file_hash
+
+    def load(self):
+        """Read steps completed by the previous run."""
+        if not os.path.isfile(self.path):
+            to_log(f"{MODULE_NAME_FOR_LOG}: {self.path} not found, nothing to resume")
+            return
+        f = open(self.path, "r")
+        manifest = json.load(f)
+        f.close()
+        if manifest.get("version") != MANIFEST_VERSION:
+            to_log(f"{MODULE_NAME_FOR_LOG}: unsupported manifest version, cannot resume")
+            return
+        if manifest["args_hash"] != self.args_hash:
+            to_log(f"{MODULE_NAME_FOR_LOG}: TOGA arguments changed, cannot resume")
+            return
+        self.steps = {int(k): v for k, v in manifest["steps"].items()}
+
+    def save(self):
+        """Write the manifest, replace the old one atomically."""
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "args_hash": self.args_hash,
+            "steps": self.steps,
+        }
+        temp_path = f"{self.path}.tmp"
+        f = open(temp_path, "w")
+        json.dump(manifest, f, indent=2)
+        f.close()
+        os.replace(temp_path, self.path)
+
+    def is_done(self, step, check_files=True):
+        """Check whether step is complete and its data is intact.
+
+        check_files: check that the step input and output files exist;
+        intermediate files can be removed once the dependent steps are done.
+        Inputs that exist must be unchanged anyway.
+        """
+        record = self.steps.get(step)
+        if record is None:
+            return False
+        missing = [x for x in record["outputs"] if not os.path.exists(x)]
+        if check_files and missing:
+            to_log(f"{MODULE_NAME_FOR_LOG}: step {step} output is missing: {missing[0]}")
+            return False
+        for path, file_hash in record["inputs"].items():
+            if not os.path.isfile(path) and not check_files:
+                continue
+            if not os.path.isfile(path) or self.__get_hash(path) != file_hash:
+                to_log(f"{MODULE_NAME_FOR_LOG}: step {step} input changed: {path}")
+                return False
+        for path, (size, mtime) in record["stat_inputs"].items():
+            if not os.path.isfile(path) or get_file_stat(path) != [size, mtime]:
+                to_log(f"{MODULE_NAME_FOR_LOG}: step {step} input changed: {path}")
+                return False
+        return True
+
+    def get_resume_step(self, steps_num, dependencies):
+        """Get the first step to execute.
+
+        dependencies: step -> steps that must be done before it.
+        Files of a completed step are needed only if a step
+        that depends on it is executed again.
+        Steps that keep output in memory only can be skipped if
+        the next step is done too, otherwise they are executed again.
+        """
+        step = 0
+        while step < steps_num and self.is_done(step, check_files=False):
+            step += 1
+        prev_step = None
+        while step != prev_step:
+            prev_step = step
+            for done_step in range(step):
+                executed_again = [x for x in range(step, steps_num) if done_step in dependencies[x]]
+                if executed_again and not self.is_done(done_step):
+                    step = done_step
+                    break
+        if step > 0 and self.steps[step - 1]["in_memory"]:
+            step -= 1
+        return step
+
+    def get_state(self, step):
+        """Get Toga object state saved after the step."""
+        return self.steps[step]["state"]
+
+    def reset(self, from_step=0):
+        """Forget steps that are executed again."""
+        self.steps = {k: v for k, v in self.steps.items() if k < from_step}
+        self.save()
+
+    def mark_done(self, step, inputs, outputs, state, in_memory=False, stat_inputs=()):
+        """Save completion mark of the step."""
+        self.steps[step] = {
+            "done_at": str(dt.now()),
+            "inputs": {x: self.__get_hash(x) for x in inputs if os.path.isfile(x)},
+            "stat_inputs": {x: get_file_stat(x) for x in stat_inputs if os.path.isfile(x)},
+            "outputs": [x for x in outputs if x],
+            "state": state,
+            "in_memory": in_memory,
+        }
+        self.save()
@@ -204,13 +204,19 @@ class TogaSanityChecker:
         return isoforms_file
 
     @staticmethod
-    def check_chains_classified(chain_results_df):
-        """Check whether chain classification result is non-empty."""
+    def check_chains_classified(chain_results_df, chain_features=None):
+        """Check whether chain classification result is non-empty.
+
+        If chain features were kept in memory, check the dataframe instead of the file.
+        """
         def has_more_than_one_line(file_path):
             with open(file_path, 'r') as f:
                 return sum(1 for _ in islice(f, 2)) > 1
 
-        is_complete = has_more_than_one_line(chain_results_df)
+        if chain_features is not None:
+            is_complete = len(chain_features) > 0
+        else:
+            is_complete = has_more_than_one_line(chain_results_df)
         if is_complete is False:
             msg = f"Chain results file {chain_results_df} is empty! Abort."
             to_log(msg)
@@ -244,7 +250,6 @@ class TogaSanityChecker:
         imports_not_found = False
         required_libraries = [
             'twobitreader',
-            'networkx',
             'pandas',
             'numpy',
             'xgboost',
@@ -55,6 +55,6 @@ class TogaUtil:
 
     @staticmethod
     def terminate_parallel_processes(jobs_managers):
-        to_log(f"KeyboardInterrupt: terminating {len(jobs_managers)} running parallel processes")
+        to_log(f"Terminating {len(jobs_managers)} parallel processes")
         for job_manager in jobs_managers:
             job_manager.terminate_process()
\ No newline at end of file
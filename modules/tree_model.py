@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Plain tree representation of the chain classification models.
+
+XGBoost models saved with joblib can be loaded only with a compatible
+XGBoost version. This module exports such models to a JSON file with
+the trees as plain arrays and evaluates them with numpy only.
+The evaluator mimics XGBoost (float32 features and sums), the scores
+may differ from the booster ones only by float32 rounding of exp.
+"""
+import argparse
+import json
+import sys
+import numpy as np
+
+__author__ = "Bogdan M. Kirilenko"
+
+TREE_MODEL_FORMAT = "toga_tree_model"
+TREE_MODEL_VERSION = 1
+SUPPORTED_OBJECTIVES = {"binary:logistic"}
+TREE_FIELDS = ("left_children", "right_children", "split_indices", "split_conditions", "default_left")
+
+
+def parse_args():
+    """Read args, check."""
+    app = argparse.ArgumentParser(description="Export XGBoost model to plain JSON trees.")
+    app.add_argument("model", help="XGBoost model saved with joblib (train_model.py output)")
+    app.add_argument("output", help="Save JSON model here")
+    if len(sys.argv) < 2:
+        app.print_help()
+        sys.exit(0)
+    args = app.parse_args()
+    return args
+
+
+def booster_to_dict(booster):
+    """Convert XGBoost booster to a plain trees dict."""
+    model = json.loads(booster.save_raw("json"))["learner"]
+    objective = model["objective"]["name"]
+    if objective not in SUPPORTED_OBJECTIVES:
+        raise ValueError(f"Cannot export model with {objective} objective")
+    gbtree = model["gradient_booster"]["model"]
+    trees = []
+    for tree in gbtree["trees"]:
+        if any(x != 0 for x in tree["split_type"]):
+            raise ValueError("Cannot export model with categorical splits")
+        trees.append({field: tree[field] for field in TREE_FIELDS})
+    return {
+        "format": TREE_MODEL_FORMAT,
+        "version": TREE_MODEL_VERSION,
+        "objective": objective,
+        "features": model["feature_names"],
+        "base_score": float(model["learner_model_param"]["base_score"]),
+        "trees": trees,
+    }
+
+
+def export_model(model, output):
+    """Save XGBoost model to a JSON file.
+
+    Model is either a model object or a path to a joblib file.
+    """
+    if isinstance(model, str):
+        import joblib
+
+        model = joblib.load(model)
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    f = open(output, "w")
+    json.dump(booster_to_dict(booster), f)
+    f.close()
+
+
+def is_tree_model(path):
+    """Check whether a file is an exported JSON model."""
+    return path.endswith(".json")
+
+
+class TreeModel:
+    """Tree ensemble evaluator.
+
+    Provides inplace_predict of the XGBoost booster: X is
+    a (n, features) array, returns positive class probabilities.
+    """
+
+    def __init__(self, model_dict):
+        if model_dict.get("format") != TREE_MODEL_FORMAT:
+            raise ValueError("Not a TOGA tree model")
+        if model_dict["objective"] not in SUPPORTED_OBJECTIVES:
+            raise ValueError(f"Unsupported objective: {model_dict['objective']}")
+        self.feature_names = model_dict["features"]
+        self.trees = []
+        self.max_depth = 0
+        for tree in model_dict["trees"]:
+            left = np.array(tree["left_children"], dtype=np.int32)
+            right = np.array(tree["right_children"], dtype=np.int32)
+            feature = np.array(tree["split_indices"], dtype=np.int32)
+            # for leaves split condition is the leaf value
+            condition = np.array(tree["split_conditions"], dtype=np.float32)
+            default_left = np.array(tree["default_left"], dtype=bool)
+            self.max_depth = max(self.max_depth, self.__get_depth(left, right))
+            # leaves point to themselves: walking down the tree
+            # for max_depth steps ends in a leaf for each row
+            leaves = np.flatnonzero(left == -1)
+            left[leaves] = leaves
+            right[leaves] = leaves
+            self.trees.append((left, right, feature, condition, default_left))
+        base_score = np.float32(model_dict["base_score"])
+        # logit of the base score, as XGBoost computes it
+        self.base_margin = -np.log(np.float32(1.0) / base_score - np.float32(1.0))
+
+    @staticmethod
+    def __get_depth(left, right):
+        """Get max depth of the tree."""
+        depth = 0
+        level = [0]
+        while True:
+            level = [c for n in level for c in (left[n], right[n]) if c != -1]
+            if not level:
+                return depth
+            depth += 1
+
+    @classmethod
+    def load(cls, path):
+        """Load model from a JSON file."""
+        f = open(path, "r")
+        model_dict = json.load(f)
+        f.close()
+        return cls(model_dict)
+
+    def inplace_predict(self, X):
+        """Predict positive class probabilities."""
+        X = np.asarray(X, dtype=np.float32)
+        rows_num, features_num = X.shape
+        X_flat = X.ravel()
+        # flat index of the first feature for each row
+        row_offsets = np.arange(rows_num, dtype=np.int64) * features_num
+        missing = np.isnan(X_flat) if np.isnan(X_flat).any() else None
+        margin = np.full(rows_num, self.base_margin, dtype=np.float32)
+        for left, right, feature, condition, default_left in self.trees:
+            node = np.zeros(rows_num, dtype=np.int32)
+            for _ in range(self.max_depth):
+                x_ids = row_offsets + feature[node]
+                go_left = X_flat[x_ids] < condition[node]
+                if missing is not None:
+                    # NaN is missing value: go to the default direction
+                    is_missing = missing[x_ids]
+                    go_left[is_missing] = default_left[node[is_missing]]
+                node = np.where(go_left, left[node], right[node])
+            margin += condition[node]  # sum in tree order, like XGBoost
+        # sigmoid, as XGBoost computes it, but exp is computed in float64
+        margin = np.minimum(-margin, np.float32(88.7))
+        exp = np.exp(margin.astype(np.float64)).astype(np.float32)
+        return np.float32(1.0) / (exp + np.float32(1.0))
+
+
+def main():
+    args = parse_args()
+    export_model(args.model, args.output)
+
+
+if __name__ == "__main__":
+    main()
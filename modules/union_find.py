@@ -0,0 +1,36 @@
+"""Union-find (disjoint sets) over integer IDs 0..n-1."""
+
+__author__ = "Bogdan M. Kirilenko"
+
+
+class UnionFind:
+    """Disjoint sets with path halving and union by size."""
+
+    def __init__(self, size):
+        self.parents = list(range(size))
+        self.sizes = [1] * size
+
+    def find(self, x):
+        """Get root of the set containing x."""
+        parents = self.parents
+        while parents[x] != x:
+            parents[x] = parents[parents[x]]
+            x = parents[x]
+        return x
+
+    def union(self, x, y):
+        """Merge sets containing x and y."""
+        root_x, root_y = self.find(x), self.find(y)
+        if root_x == root_y:
+            return
+        if self.sizes[root_x] < self.sizes[root_y]:
+            root_x, root_y = root_y, root_x
+        self.parents[root_y] = root_x
+        self.sizes[root_x] += self.sizes[root_y]
+
+    def components(self):
+        """Get sets as lists of IDs, ordered by their smallest ID."""
+        root_to_component = {}
+        for x in range(len(self.parents)):
+            root_to_component.setdefault(self.find(x), []).append(x)
+        return list(root_to_component.values())
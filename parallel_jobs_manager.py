@@ -1,15 +1,20 @@
 #!/usr/bin/env python3
 """Strategy pattern implementation to handle parallel jobs.
 
-Provides implementations for nextflow and para strategies.
+Provides implementations for nextflow, para and local pool strategies.
 Please feel free to implement your custom strategy if
 neither nextflow nor para satisfy your needs.
 
 WIP, to be enabled later.
 """
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
 import subprocess
+import threading
+import time
 import os
+import signal
 import shutil
 from modules.common import to_log
 from version import __version__
@@ -45,6 +50,24 @@ class ParallelizationStrategy(ABC):
         """
         pass
 
+    def wait(self, timeout):
+        """
+        Block until the jobs are done, but not longer than timeout seconds.
+
+        Strategies driven by a local process (nextflow, para make)
+        return as soon as the process exits.
+
+        :return: Status of the jobs, like check_status.
+        """
+        if self._process is None:
+            time.sleep(timeout)  # nothing to wait for: just poll
+            return self.check_status()
+        try:
+            self._process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            pass
+        return self.check_status()
+
     def terminate_process(self):
         """Terminates the associated process"""
         if self._process:
@@ -210,6 +233,171 @@ class ParaStrategy(ParallelizationStrategy):
             return None
 
 
+class LocalResources:
+    """CPU slots and memory shared by all local pool jobs.
+
+    A job is admitted if there is a free slot and its memory fits
+    into the limit; a job requiring more memory than the limit
+    is admitted only if nothing else is running.
+    """
+
+    def __init__(self, slots, memory_limit=None):
+        self.slots = slots
+        self.memory_limit = memory_limit
+        self.used_slots = 0
+        self.used_memory = 0
+        self._condition = threading.Condition()
+
+    def __can_admit(self, memory):
+        if self.used_slots >= self.slots:
+            return False
+        if not self.memory_limit or self.used_slots == 0:
+            return True
+        return self.used_memory + memory <= self.memory_limit
+
+    def acquire(self, memory):
+        """Block until a job requiring memory Gb can be started."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.__can_admit(memory))
+            self.used_slots += 1
+            self.used_memory += memory
+
+    def release(self, memory):
+        """Return job resources."""
+        with self._condition:
+            self.used_slots -= 1
+            self.used_memory -= memory
+            self._condition.notify_all()
+
+
+class LocalPoolStrategy(ParallelizationStrategy):
+    """
+    Concrete strategy to execute jobs on the local machine.
+
+    Each joblist line is executed in a shell, lines are distributed
+    over a pool of workers. No nextflow or cluster manager is needed.
+    """
+    MAX_RETRIES = 3  # like maxRetries in execute_joblist.nf
+    _resources = None  # shared by all joblists pushed by TOGA
+
+    def __init__(self):
+        super().__init__()
+        self._process = None
+        self.return_code = None
+        self.label = None
+        self.log_file_path = None
+        self.memory_limit = 0
+        self.max_retries = self.MAX_RETRIES
+        self._executor = None
+        self._futures = []
+        self._running = set()
+        self._lock = threading.Lock()
+        self._terminated = False
+
+    @classmethod
+    def get_resources(cls, pool_size, memory_limit):
+        """Get resources shared by all local pool strategies."""
+        if cls._resources is None:
+            cls._resources = LocalResources(pool_size, memory_limit)
+        return cls._resources
+
+    def execute(self, joblist_path, manager_data, label, wait=False, **kwargs):
+        """Implementation for the local pool."""
+        self.label = label
+        self.memory_limit = float(kwargs.get("memory_limit", 0))
+        self.max_retries = manager_data.get("local_max_retries", self.MAX_RETRIES)
+        pool_size = manager_data.get("local_pool_size") or os.cpu_count()
+        resources = self.get_resources(pool_size, manager_data.get("local_memory_limit"))
+
+        log_dir = manager_data["logs_dir"]
+        os.mkdir(log_dir) if not os.path.isdir(log_dir) else None
+        self.log_file_path = os.path.join(log_dir, f"{label}.log")
+        open(self.log_file_path, "w").close()
+
+        with open(joblist_path, "r") as f:
+            jobs = [line.rstrip() for line in f if line.strip()]
+        to_log(
+            f"Parallel manager: pushing {len(jobs)} jobs from {joblist_path} "
+            f"to the local pool of {pool_size} workers"
+        )
+        self._executor = ThreadPoolExecutor(max_workers=pool_size)
+        self._futures = [
+            self._executor.submit(self.__run_job, num, job, resources)
+            for num, job in enumerate(jobs)
+        ]
+        self._executor.shutdown(wait=wait)
+
+    def __run_job(self, num, job, resources):
+        """Run a single joblist line, retry if failed.
+
+        Return the last return code.
+        """
+        rc = None
+        for attempt in range(self.max_retries + 1):
+            resources.acquire(self.memory_limit)
+            try:
+                with self._lock:
+                    if self._terminated:
+                        return rc
+                    # own process group: the shell and the commands it runs
+                    # are terminated together
+                    process = subprocess.Popen(
+                        job,
+                        shell=True,
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.PIPE,
+                        start_new_session=True,
+                    )
+                    self._running.add(process)
+                _, stderr = process.communicate()
+                with self._lock:
+                    self._running.discard(process)
+            finally:
+                resources.release(self.memory_limit)
+            rc = process.returncode
+            if rc == 0:
+                return rc
+            self.__log_failure(num, job, attempt, rc, stderr)
+        return rc
+
+    def __log_failure(self, num, job, attempt, rc, stderr):
+        """Save failed job attempt details in the log file."""
+        with self._lock:
+            with open(self.log_file_path, "a") as f:
+                f.write(f"# job {num} attempt {attempt + 1} failed with rc {rc}:\n{job}\n")
+                f.write(stderr.decode("utf-8", errors="replace"))
+                f.write("\n")
+
+    def check_status(self):
+        """Check if all local jobs are done."""
+        if self.return_code is not None:
+            return self.return_code
+        if not all(future.done() for future in self._futures):
+            return None
+        failed = sum(1 for f in self._futures if f.cancelled() or f.result() != 0)
+        if failed > 0:
+            to_log(f"Parallel manager: {failed} jobs of {self.label} failed, see {self.log_file_path}")
+        self.return_code = 1 if failed > 0 else 0
+        return self.return_code
+
+    def wait(self, timeout):
+        """Block until all local jobs are done or timeout passed."""
+        wait_futures(self._futures, timeout=timeout)
+        return self.check_status()
+
+    def terminate_process(self):
+        """Cancel pending jobs and kill the running ones."""
+        with self._lock:
+            self._terminated = True
+            for process in self._running:
+                try:
+                    os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+                except ProcessLookupError:  # the job is already finished
+                    pass
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
 class SnakeMakeStrategy(ParallelizationStrategy):
     """
     Not implemented class for Snakemake strategy.
@@ -298,7 +486,18 @@ class ParallelJobsManager:
 
         :return: Status of the jobs.
         """
-        return self.strategy.check_status()
+        self.return_code = self.strategy.check_status()
+        return self.return_code
+
+    def wait(self, timeout):
+        """
+        Wait for the jobs using the specified strategy.
+
+        :param timeout: Max waiting time, seconds.
+        :return: Status of the jobs.
+        """
+        self.return_code = self.strategy.wait(timeout)
+        return self.return_code
 
     def terminate_process(self):
         """Terminate associated process."""
@@ -11,6 +11,7 @@ import sys
 import subprocess
 import random
 from datetime import datetime as dt
+from constants import Constants
 from modules.chain_bed_intersect import chain_bed_intersect
 from modules.common import parts
 from modules.common import die
@@ -44,6 +45,12 @@ def parse_args():
         help="Don't print to console"
     )
     app.add_argument("--parallel_logs_dir", type=str, help="Path to dir storing logs from each cluster job")
+    app.add_argument(
+        "--stats_dir",
+        type=str,
+        default=None,
+        help="Path to dir storing resource usage of each cluster job"
+    )
     app.add_argument(
         "--jobs_num",
         "--jn",
@@ -269,7 +276,7 @@ def save_rejected_genes(skipped, filename):
     f.close()
 
 
-def save(template, batch, logs_dir=None):
+def save(template, batch, logs_dir=None, stats_dir=None):
     """Save the cluster jobs, create jobs_file file."""
     filenames = {}  # collect filenames of cluster jobs
     for num, jobs in enumerate(batch):
@@ -286,12 +293,16 @@ def save(template, batch, logs_dir=None):
     f = open(WORK_DATA["jobs_file"], "w")
     for num, path in filenames.items():
         cmd = template.format(path)
+        # chain features are saved as typed records, stdout keeps timing only
+        records_part = f"--records_out {WORK_DATA['results_dir']}/{num}{Constants.CHAIN_FEATURES_SHARD_EXT}"
         stdout_part = f"> {WORK_DATA['results_dir']}/{num}.txt"
         if logs_dir:
             logs_part = f" --log_file {logs_dir}/chain_runner_{num}.log"
         else:
             logs_part = ""
-        jobs_file_line = f"{cmd} {logs_part} {stdout_part}\n"
+        if stats_dir:
+            logs_part += f" --stats_file {stats_dir}/chain_runner_{num}.json"
+        jobs_file_line = f"{cmd} {logs_part} {records_part} {stdout_part}\n"
         f.write(jobs_file_line)
     f.close()
 
@@ -311,7 +322,7 @@ def main():
     commands = make_commands(intersections)  # shuffle and create set of commands
     batch = split_commands(commands)  # split the commands into cluster jobs
     template = get_template()
-    save(template, batch, logs_dir=args.parallel_logs_dir)  # save jobs and a jobs_file file
+    save(template, batch, logs_dir=args.parallel_logs_dir, stats_dir=args.stats_dir)  # save jobs and a jobs_file file
     to_log("split_chain_jobs: estimated time: {0}".format(dt.now() - t0))
     sys.exit(0)
 
@@ -9,10 +9,12 @@ import os
 import sys
 import math
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from datetime import datetime as dt
 from re import finditer, IGNORECASE
-import ctypes
 from twobitreader import TwoBitFile
+from modules.chain_coords_converter import chain_coords_converter
 from modules.common import parts
 from modules.common import chain_extract_id
 from modules.common import make_cds_track
@@ -60,21 +62,11 @@ MEM_FIT = "MEM_FIT"
 MEM_BIGMEM = "MEM_BIGMEM"
 MEM_DONTFIT = "MEM_DONTFIT"
 
-MODULE_NAME_FOR_LOG = "split_cesar_jobs"
+TOO_LONG = "TOO_LONG"  # query locus is too long, the projection is skipped
+CHUNKS_PER_PROCESS = 4  # smaller chunks balance the load between processes
 
-# connect shared lib; define input and output data types
-chain_coords_conv_lib_path = os.path.join(
-    LOCATION, "modules", "chain_coords_converter_slib.so"
-)
+MODULE_NAME_FOR_LOG = "split_cesar_jobs"
 
-ch_lib = ctypes.CDLL(chain_coords_conv_lib_path)
-ch_lib.chain_coords_converter.argtypes = [
-    ctypes.c_char_p,
-    ctypes.c_int,
-    ctypes.c_int,
-    ctypes.POINTER(ctypes.c_char_p),
-]
-ch_lib.chain_coords_converter.restype = ctypes.POINTER(ctypes.c_char_p)
 
 
 def parse_args():
@@ -141,6 +133,13 @@ def parse_args():
         default=50,
         help="Skip genes requiring more than X GB to call CESAR",
     )
+    app.add_argument(
+        "--processes",
+        "-p",
+        type=int,
+        default=1,
+        help="Number of processes to compute query loci of transcripts",
+    )
     app.add_argument("--jobs_dir", default="cesar_jobs", help="Save jobs in.")
     app.add_argument(
         "--combined", default="cesar_combined", help="Combined cluster jobs."
@@ -202,6 +201,21 @@ def parse_args():
         default=None,
         help="CESAR logs dir"
     )
+    app.add_argument(
+        "--cesar_cache",
+        default=None,
+        help="Directory with cached CESAR output, shared between runs"
+    )
+    app.add_argument(
+        "--ref_exons",
+        default=None,
+        help="Reference exons file of the reference pack, passed to CESAR wrapper jobs"
+    )
+    app.add_argument(
+        "--stats_dir",
+        default=None,
+        help="Save resource usage of each cluster job in this dir"
+    )
     app.add_argument(
         "--debug",
         "-d",
@@ -415,8 +429,59 @@ def define_short_q_proj_stat(q_chrom, q_start, q_end, q_2bit):
     #     return M
 
 
+def precompute_chains_regions(chains_data, bdb_chain_file, q_2bit):
+    """Find query loci of transcripts for a chunk of chains.
+
+    chains_data: list of (chain_id, [(transcript, (start, end), CDS length, chain field)]).
+    Return list of (transcript, chain_id, query locus length, predefined class, min query length);
+    predefined class is None if CESAR is to be called for the projection.
+    """
+    results = []
+    for chain_id, genes_data in chains_data:
+        # extract chain itself
+        chain_body = chain_extract_id(bdb_chain_file, chain_id)
+        q_chrom = chain_body.split("\n", 1)[0].split()[7]
+        # we need to get corresponding regions in the query
+        # for now we have chain blocks coordinates and gene
+        # regions in the reference genome
+        # use chain_coords_converter shared library to
+        # convert target -> query coordinates via chain
+        _, q_regions = chain_coords_converter(chain_body, [x[1] for x in genes_data], shifts=(2,))
+
+        # shared lib returns one region per gene, in the same order
+        for num, (q_start, q_end) in enumerate(q_regions[0].tolist()):
+            transcript, (t_start, t_end), cds_length, field = genes_data[num]
+            que_len = q_end - q_start
+            tar_len = t_end - t_start
+            len_delta = abs(tar_len - que_len)
+            delta_gene_times = len_delta / tar_len
+            min_query_length = cds_length * REF_LEN_THRESHOLD
+            # check that corresponding region in the query is not too long
+            # for instance query locus is 50 times longer than the gene
+            # or it's longer than 1M base and also this is a SPAN chain
+            high_rel_len = delta_gene_times > REL_LENGTH_THR
+            high_abs_len = len_delta > ABS_LENGTH_TRH
+            long_loci_field = field == SPAN
+            if (high_rel_len or high_abs_len) and long_loci_field:
+                results.append((transcript, chain_id, que_len, TOO_LONG, min_query_length))
+                continue
+            # in contrast, if query locus is too short (<5% CDS length)
+            # then CESAR might not build HMM properly, we skip this
+            # hard to imagine in what case such an input will give us any meaningful result
+            if que_len < min_query_length:
+                # in this case we need to check whether the gene is truly deleted
+                # in the corresponding locus or is missing
+                # to separate these cases, TOGA checks whether the region contains
+                # assembly gaps
+                proj_stat = define_short_q_proj_stat(q_chrom, q_start, q_end, q_2bit)
+                results.append((transcript, chain_id, que_len, proj_stat, min_query_length))
+                continue
+            results.append((transcript, chain_id, que_len, None, min_query_length))
+    return results
+
+
 def precompute_regions(
-    batch, bed_data, bdb_chain_file, chain_gene_field, limit, q_2bit
+    batch, bed_data, bdb_chain_file, chain_gene_field, limit, q_2bit, processes=1
 ):
     """Precompute region for each chain: bed pair."""
     to_log(f"{MODULE_NAME_FOR_LOG}: precomputing query regions for each transcript/chain pair")
@@ -463,116 +528,66 @@ def precompute_regions(
 
     # read regions themselves
     gene_chain_grange = defaultdict(dict)
-    chains_num, iter_num = len(chain_to_genes.keys()), 0
     task_size = len(chain_to_genes)
     to_log(f"{MODULE_NAME_FOR_LOG}: for each of {task_size} involved chains, precompute regions")
-
+    chains_data = []
     for chain_id, genes in chain_to_genes.items():
-        # extract chain itself
-        chain_body = chain_extract_id(bdb_chain_file, chain_id).encode()
-        all_gene_ranges = []
-        genes_cds_length = []
-        for transcript in genes:
-            # get genomic coordinates for each gene
-            gene_data = bed_data.get(transcript)
-            grange = f"{gene_data[0]}:{gene_data[1]}-{gene_data[2]}"
-            cds_length = sum(gene_data[3])
-            genes_cds_length.append(cds_length)
-            all_gene_ranges.append(grange)
-
-        # we need to get corresponding regions in the query
-        # for now we have chain blocks coordinates and gene
-        # regions in the reference genome
-        # use chain_coords_converter shared library to
-        # convert target -> query coordinates via chain
-        # first need to convert to C-types
-        c_chain = ctypes.c_char_p(chain_body)
-        c_shift = ctypes.c_int(2)
-        granges_bytes = [s.encode("utf-8") for s in all_gene_ranges]
-        granges_num = len(all_gene_ranges)
-        c_granges_num = ctypes.c_int(granges_num)
-        granges_arr = (ctypes.c_char_p * (granges_num + 1))()
-        granges_arr[:-1] = granges_bytes
-        granges_arr[granges_num] = None
-
-        # then call the function
-        raw_ch_conv_out = ch_lib.chain_coords_converter(
-            c_chain, c_shift, c_granges_num, granges_arr
+        # get genomic coordinates and CDS length for each gene
+        genes_data = [
+            (
+                transcript,
+                (bed_data[transcript][1], bed_data[transcript][2]),
+                sum(bed_data[transcript][3]),
+                chain_gene_field.get((chain_id, transcript)),
+            )
+            for transcript in genes
+        ]
+        chains_data.append((chain_id, genes_data))
+
+    # chains are independent: split them in chunks and process in parallel
+    chunk_size = max(1, math.ceil(task_size / (processes * CHUNKS_PER_PROCESS)))
+    chunks = [chains_data[i: i + chunk_size] for i in range(0, task_size, chunk_size)]
+    if processes > 1 and len(chunks) > 1:
+        to_log(f"{MODULE_NAME_FOR_LOG}: using {processes} processes for {len(chunks)} chunks of chains")
+        executor = ProcessPoolExecutor(max_workers=processes)
+        chunks_results = executor.map(
+            precompute_chains_regions, chunks, repeat(bdb_chain_file), repeat(q_2bit)
         )
-        chain_coords_conv_out = []  # keep lines here
-        # convert C output to python-readable type
-        for i in range(granges_num + 1):
-            chain_coords_conv_out.append(raw_ch_conv_out[i].decode("utf-8"))
-
-        for line in chain_coords_conv_out[1:]:
-            # then parse the output
-            # line contains information about transcript range in the query
-            # and the corresponding locus in the reference
-            line_info = line.rstrip().split()
-            # line info is: region num, region in reference, region in query
-            # one line per one gene, in the same order
-            num = int(line_info[0])
-            # regions format is chrom:start-end
-            q_chrom = line_info[1].split(":")[0]
-            q_grange = line_info[1].split(":")[1].split("-")
-            q_start, q_end = int(q_grange[0]), int(q_grange[1])
-            que_len = q_end - q_start
-            t_grange = line_info[2].split(":")[1].split("-")
-            t_start, t_end = int(t_grange[0]), int(t_grange[1])
-            tar_len = t_end - t_start
-            len_delta = abs(tar_len - que_len)
-            delta_gene_times = len_delta / tar_len
-            transcript = genes[num]  # shared lib returns data per gene in the same order
+    else:
+        executor = None
+        chunks_results = (precompute_chains_regions(x, bdb_chain_file, q_2bit) for x in chunks)
+
+    iter_num = 0
+    for chunk, chunk_results in zip(chunks, chunks_results):
+        for transcript, chain_id, que_len, proj_stat, min_query_length in chunk_results:
             proj_id = f"{transcript}.{chain_id}"
-            cds_length = genes_cds_length[num]
-            min_query_length = cds_length * REF_LEN_THRESHOLD
-            field = chain_gene_field.get((chain_id, transcript))
-            # check that corresponding region in the query is not too long
-            # for instance query locus is 50 times longer than the gene
-            # or it's longer than 1M base and also this is a SPAN chain
-            high_rel_len = delta_gene_times > REL_LENGTH_THR
-            high_abs_len = len_delta > ABS_LENGTH_TRH
-            long_loci_field = field == SPAN
-            if (high_rel_len or high_abs_len) and long_loci_field:
+            if proj_stat is None:
+                # for each chain-gene pair save query region length
+                # need this for required memory estimation
+                gene_chain_grange[transcript][chain_id] = que_len
+            elif proj_stat == TOO_LONG:
                 to_log(
                     f" * !!skipping transcript {transcript} / chain "
                     f"{chain_id} projection: too long query locus"
                 )
                 skipped.append((transcript, chain_id, "too long query locus"))
-                # print(f"TOO LONG: {proj_id}")
                 predef_glp[proj_id] = f"{PROJECTION}\t{M}"
-                continue
-            # in contrast, if query locus is too short (<5% CDS length)
-            # then CESAR might not build HMM properly, we skip this
-            # hard to imagine in what case such an input will give us any meaningful result
-            if que_len < min_query_length:
+            else:
                 to_log(
                     f" * !!transcript {transcript} / chain {chain_id} pair leads to "
                     f"very short query locus: {que_len}bp whereas limit is {min_query_length}. "
                     f"CESAR will not be called for this pair. Defining a class automatically."
                 )
-                # in this case we need to check whether the gene is truly deleted
-                # in the corresponding locus or is missing
-                # to separate these cases, TOGA checks whether the region contains
-                # assembly gaps
-                # skipped.append((gene, chain_id, "too short query locus"))
-                proj_stat = define_short_q_proj_stat(q_chrom, q_start, q_end, q_2bit)
                 predef_glp[proj_id] = f"{PROJECTION}\t{proj_stat}"
-                # print(f"Too short query: {proj_id}: {que_len}: {proj_stat}")
                 to_log(
                     f" * !! class assigned to transcript {transcript} / chain {chain_id} pair "
                     f"is {proj_stat}. M - if query locus intersects assembly gap, L otherwise (deletion)"
                 )
-                continue
-            # for each chain-gene pair save query region length
-            # need this for required memory estimation
-            gene_chain_grange[transcript][chain_id] = que_len
-
-        del raw_ch_conv_out  # not sure if necessary but...
-        iter_num += 1  # verbosity
-        if iter_num % 10_000 == 0:
-            to_log(f"PROCESSED {iter_num} CHAINS OUT OF {task_size}")
-        # eprint(f"Chain {iter_num} / {chains_num}", end="\r")
+        for _ in chunk:  # verbosity
+            iter_num += 1
+            if iter_num % 10_000 == 0:
+                to_log(f"PROCESSED {iter_num} CHAINS OUT OF {task_size}")
+    executor.shutdown() if executor else None
     to_log(f"{MODULE_NAME_FOR_LOG}: precomputed regions for {len(gene_chain_grange)} transcripts")
     to_log(f"{MODULE_NAME_FOR_LOG}: skipped {len(skipped)} projections")
     to_log(f"{MODULE_NAME_FOR_LOG}: predefined classification for {len(predef_glp)} projections")
@@ -657,7 +672,9 @@ def save_combined_joblist(
     inact_mut_dat,
     rejected_log,
     unproc_log,
-    cesar_logs_dir
+    cesar_logs_dir,
+    cesar_cache=None,
+    stats_dir=None
 ):
     """Save joblist of joblists (combined joblist)."""
     to_log(f"{MODULE_NAME_FOR_LOG}: saving combined CESAR jobs to {combined_file}")
@@ -678,6 +695,11 @@ def save_combined_joblist(
         if cesar_logs_dir:
             cesar_logs_path = os.path.join(cesar_logs_dir, f"cesar_{basename}.txt")
             combined_command += f" --log_file {cesar_logs_path}"
+        if cesar_cache:
+            combined_command += f" --cesar_cache {cesar_cache}"
+        if stats_dir:
+            stats_path = os.path.join(stats_dir, f"{basename}.json")
+            combined_command += f" --stats_file {stats_path}"
         f.write(combined_command + "\n")
 
     f.close()
@@ -734,6 +756,9 @@ def build_job(gene,
     # add U12 introns data if this gene has them:
     job = job + f" --u12 {os.path.abspath(args.u12)}" if u12_this_gene else job
 
+    # read reference exons from the reference pack, if provided
+    job = job + f" --ref_exons {os.path.abspath(args.ref_exons)}" if args.ref_exons else job
+
     # add mask_all_first_10p flag if needed
     job = job + f" --mask_all_first_10p" if mask_all_first_10p else job
     return job
@@ -877,6 +902,7 @@ def main():
         chain_gene_field,
         args.chains_limit,
         args.qDB,
+        processes=args.processes,
     )
     predefined_glp_class.update(predef_glp)
     predef_glp_class__chains_step = {}
@@ -1004,7 +1030,9 @@ def main():
         args.check_loss,
         args.rejected_log,
         args.unprocessed_log,
-        args.cesar_logs_dir
+        args.cesar_logs_dir,
+        cesar_cache=args.cesar_cache,
+        stats_dir=args.stats_dir
     )
 
     # save skipped genes if required
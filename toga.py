@@ -10,11 +10,17 @@ import os
 import shutil
 import subprocess
 import sys
+import threading
 import time
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import wait
 from constants import Constants
 from datetime import datetime as dt
 from modules.bed_hdf5_index import bed_hdf5_index
+from modules.cesar_cache import evict_cesar_cache
+from modules.cesar_results_watcher import CesarResultsWatcher
 from modules.chain_bst_index import chain_bst_index
 from modules.classify_chains import classify_chains
 from modules.collect_prefefined_glp_classes import add_transcripts_to_missing
@@ -27,17 +33,27 @@ from modules.common import setup_logger
 from modules.common import to_log
 from modules.filter_bed import prepare_bed_file
 from modules.gene_losses_summary import gene_losses_summary
+from modules.job_profiler import PROFILE_DIR_ENV
+from modules.job_profiler import PROFILE_FRACTION_ENV
+from modules.job_profiler import summarize_profiles
 from modules.make_pr_pseudogenes_annotation import create_ppgene_track
 from modules.make_query_isoforms import get_query_isoforms_data
+from modules.merge_cesar_output import CesarOutputMerger
 from modules.merge_cesar_output import merge_cesar_output
 from modules.merge_chains_output import merge_chains_output
 from modules.orthology_type_map import orthology_type_map
 from modules.parallel_jobs_manager_helpers import get_nextflow_dir
 from modules.parallel_jobs_manager_helpers import monitor_jobs
+from modules.reference_pack import ReferencePack
+from modules.reference_pack import build_reference_pack
+from modules.resource_usage import StepsUsageMonitor
 from modules.stitch_fragments import stitch_scaffolds
+from modules.toga_manifest import TogaManifest
+from modules.toga_manifest import get_args_hash
 from modules.toga_sanity_checks import TogaSanityChecker
 from modules.toga_util import TogaUtil
 from parallel_jobs_manager import CustomStrategy
+from parallel_jobs_manager import LocalPoolStrategy
 from parallel_jobs_manager import NextflowStrategy
 from parallel_jobs_manager import ParaStrategy
 from parallel_jobs_manager import ParallelJobsManager
@@ -50,10 +66,66 @@ __github__ = "https://github.com/kirilenkobm"
 __credits__ = ["Michael Hiller", "Virag Sharma", "David Jebb"]
 
 LOCATION = os.path.dirname(__file__)
+PROFILE_SUMMARY_CMD = "profile_summary"
+BUILD_REF_PACK_CMD = "build_ref_pack"
 
 
 class Toga:
     """TOGA manager class."""
+    STEPS_NUM = 12
+    CHAIN_FEATURES_MERGE_STEP = 3
+    CESAR_JOBS_SPLIT_STEP = 5
+    # step: steps that must be done before it starts, other steps run concurrently
+    STEP_DEPENDENCIES = {
+        0: (),
+        1: (0,),
+        2: (1,),
+        3: (2,),
+        4: (3,),
+        5: (4,),
+        6: (4,),
+        7: (5,),
+        8: (7,),
+        9: (8,),
+        10: (9,),
+        11: (10,),
+    }
+    # step: (input file attributes, output file attributes, state attributes)
+    # state attributes are set by the step and needed by the next steps
+    STEP_DATA = {
+        0: (
+            ["chain_file", "ref_bed"],
+            ["chain_index_file", "chain_index_txt_file", "index_bed_file"],
+            [],
+        ),
+        1: (
+            ["chain_file", "ref_bed", "index_bed_file"],
+            ["chain_cl_jobs_combined", "ch_cl_jobs", "chain_class_results"],
+            ["ch_cl_jobs", "chain_class_results", "chain_cl_jobs_combined", "_transcripts_not_intersected"],
+        ),
+        2: (["chain_cl_jobs_combined"], ["chain_class_results"], []),
+        3: ([], ["chain_results_df"], []),
+        4: (
+            ["chain_results_df"],
+            ["transcript_to_chain_classes", "pred_scores"],
+            ["transcript_to_chain_classes", "pred_scores", "se_model", "me_model", "ld_model",
+             "_transcripts_not_classified"],
+        ),
+        5: (
+            ["transcript_to_chain_classes", "pred_scores"],
+            ["cesar_combined"],
+            ["cesar_jobs_dir", "cesar_combined", "cesar_results", "paralogs_log"],
+        ),
+        6: (["pred_scores"], ["proc_pgenes_track"], []),
+        7: (["cesar_combined"], ["cesar_results", "gene_loss_data"], []),
+        8: ([], ["intermediate_bed", "nucl_fasta", "prot_fasta", "codon_fasta", "meta_data"], ["cesar_ok_merged"]),
+        9: (["intermediate_bed"], ["query_annotation", "loss_summ"], []),
+        10: (["query_annotation", "loss_summ"], ["orthology_type"], []),
+        11: ([], [], []),
+    }
+    # step: large input file attributes, checked by size and modification time
+    STEP_STAT_INPUTS = {0: ["t_2bit", "q_2bit"]}
+
     def __init__(self, args):
         """Initiate toga class."""
         self.t0 = dt.now()
@@ -87,6 +159,18 @@ class Toga:
         self.nextflow_config_dir = args.nextflow_config_dir
         self.para_strategy = args.parallelization_strategy
         self.cluster_queue_name = args.cluster_queue_name
+        self.local_pool_size = args.local_pool_size
+        self.local_memory_limit = args.local_memory_limit
+        self.max_poll_interval = args.max_poll_interval
+        self.incremental_merge = args.incremental_merge
+        self.cesar_watcher = None  # merges CESAR output while jobs are running
+        self.resume = args.resume
+        if args.profile_dir:
+            # parallel jobs inherit the environment
+            os.environ[PROFILE_DIR_ENV] = os.path.abspath(args.profile_dir)
+            os.environ[PROFILE_FRACTION_ENV] = str(args.profile_fraction)
+        self.resume_step = 0  # first step to execute
+        self.skip_done_cesar_jobs = False  # CESAR jobs are the same as in the previous run
 
         self.toga_exe_path = os.path.dirname(__file__)
         TogaUtil.log_python_version()
@@ -154,28 +238,36 @@ class Toga:
             chain_filter_cmd, "Please check if you use a proper chain file."
         )
 
-        # bed define bed files addresses
-        self.ref_bed = os.path.join(self.temp_wd, "toga_filt_ref_annot.bed")
-        self.index_bed_file = os.path.join(self.temp_wd, "toga_filt_ref_annot.hdf5")
-
-        # filter bed file
-        bed_filt_rejected_file = "BED_FILTER_REJECTED.txt"
-        bed_filt_rejected = os.path.join(self.rejected_dir, bed_filt_rejected_file)
-        # keeping UTRs!
-        prepare_bed_file(
-            args.bed_input,
-            self.ref_bed,
-            ouf=False,  # TODO: check whether we like to include this parameter
-            save_rejected=bed_filt_rejected,
-            only_chrom=args.limit_to_ref_chrom,
-        )
-
         # mics things
         self.gene_prefix = args.gene_prefix
         self.isoforms_arg = args.isoforms if args.isoforms else None
         self.isoforms = None  # will be assigned after completeness check
         self.u12_arg = args.u12 if args.u12 else None
         self.u12 = None  # assign after U12 file check
+
+        # reference-only data could be precomputed once for many query genomes
+        self.bed_input = os.path.abspath(args.bed_input)
+        self.ref_pack = self.__load_ref_pack(args) if args.ref_pack else None
+        if self.ref_pack:
+            self.ref_bed = self.ref_pack.ref_bed
+            self.index_bed_file = self.ref_pack.index_bed_file
+            self.ref_pack.copy_rejected(self.rejected_dir)
+        else:
+            # bed define bed files addresses
+            self.ref_bed = os.path.join(self.temp_wd, "toga_filt_ref_annot.bed")
+            self.index_bed_file = os.path.join(self.temp_wd, "toga_filt_ref_annot.hdf5")
+
+            # filter bed file
+            bed_filt_rejected_file = "BED_FILTER_REJECTED.txt"
+            bed_filt_rejected = os.path.join(self.rejected_dir, bed_filt_rejected_file)
+            # keeping UTRs!
+            prepare_bed_file(
+                args.bed_input,
+                self.ref_bed,
+                ouf=False,  # TODO: check whether we like to include this parameter
+                save_rejected=bed_filt_rejected,
+                only_chrom=args.limit_to_ref_chrom,
+            )
         self.chain_jobs = args.chain_jobs_num
         self.cesar_binary = (
             self.DEFAULT_CESAR if not args.cesar_binary else args.cesar_binary
@@ -194,6 +286,13 @@ class Toga:
         self.cesar_buckets = args.cesar_buckets
         self.cesar_mem_limit = args.cesar_mem_limit
         self.cesar_chain_limit = args.cesar_chain_limit
+        self.cesar_split_processes = (
+            args.cesar_split_processes if args.cesar_split_processes else os.cpu_count()
+        )
+        self.cesar_cache_dir = (
+            os.path.abspath(args.cesar_cache_dir) if args.cesar_cache_dir else None
+        )
+        self.cesar_cache_size = args.cesar_cache_size
         self.uhq_flank = args.uhq_flank
         self.mask_stops = args.mask_stops
         self.no_fpi = args.no_fpi
@@ -215,6 +314,12 @@ class Toga:
             self.temp_wd, "_cesar_crashed_jobs.txt"
         )
         self.fragmented_genome = False if args.disable_fragments_joining else True
+        self.stitch_processes = (
+            args.stitch_processes if args.stitch_processes else os.cpu_count()
+        )
+        self.orthology_processes = (
+            args.orthology_processes if args.orthology_processes else os.cpu_count()
+        )
         self.orth_score_threshold = args.orth_score_threshold
         if self.orth_score_threshold < 0.0 or args.orth_score_threshold > 1.0:
             self.die(
@@ -223,6 +328,7 @@ class Toga:
             )
 
         self.chain_results_df = os.path.join(self.temp_wd, "chain_results_df.tsv")
+        self.chain_features = None  # merged chain features dataframe, if kept in memory
         self.nucl_fasta = os.path.join(self.wd, "nucleotide.fasta")
         self.prot_fasta = os.path.join(self.wd, "prot.fasta")
         self.codon_fasta = os.path.join(self.wd, "codon.fasta")
@@ -232,6 +338,15 @@ class Toga:
         self.trash_exons = os.path.join(self.temp_wd, "trash_exons.bed")
         self.gene_loss_data = os.path.join(self.temp_wd, "inact_mut_data")
         self.query_annotation = os.path.join(self.wd, "query_annotation.bed")
+        self.proc_pgenes_track = os.path.join(self.wd, "proc_pseudogenes.bed")
+        # wall time, CPU time, peak memory and I/O of steps and parallel jobs
+        self.steps_usage = StepsUsageMonitor()
+        self.steps_lock = threading.Lock()  # steps may run concurrently
+        self.jobs_managers = []  # parallel jobs managers, terminated if TOGA is aborted
+        self.jobs_usage_dir = os.path.join(self.temp_wd, "jobs_resource_usage")
+        os.mkdir(self.jobs_usage_dir) if not os.path.isdir(self.jobs_usage_dir) else None
+        self.resource_usage_json = os.path.join(self.wd, "resource_usage.json")
+        self.resource_usage_tsv = os.path.join(self.wd, "resource_usage.tsv")
         self.loss_summ = os.path.join(self.wd, "loss_summ_data.tsv")
         # directory to store intermediate files with technically non-processable transcripts:
         self.technical_cesar_err = os.path.join(self.temp_wd, "technical_cesar_err")
@@ -279,6 +394,10 @@ class Toga:
         with open(self.version_file, "w") as f:
             f.write(self.version)
 
+        # completed steps are saved to the manifest -> possible to resume a crashed run
+        results_args = {k: v for k, v in vars(args).items() if k not in Constants.RESUME_IGNORED_ARGS}
+        self.manifest = TogaManifest(os.path.join(self.wd, Constants.MANIFEST), get_args_hash(results_args))
+
         to_log(f"Saving output to {self.wd}")
         to_log(f"Arguments stored in {self.toga_args_file}")
 
@@ -293,9 +412,12 @@ class Toga:
             selected_strategy = NextflowStrategy()
         elif selected_strategy == "para":
             selected_strategy = ParaStrategy()
+        elif selected_strategy == "local":
+            selected_strategy = LocalPoolStrategy()
         else:
             selected_strategy = CustomStrategy()
         jobs_manager = ParallelJobsManager(selected_strategy)
+        self.jobs_managers.append(jobs_manager)
         return jobs_manager
 
     def __check_param_files(self):
@@ -326,8 +448,14 @@ class Toga:
             # None is just a placeholder that indicated that we don't need
             # to compare chrom lengths with 2bit
             chrom_sizes_in_bed = {x: None for x in chroms_in_bed}
-        self.isoforms = TogaSanityChecker.check_isoforms_file(self.isoforms_arg, t_in_bed, self.temp_wd)
-        self.u12 = TogaSanityChecker.check_and_write_u12_file(self.u12_arg, t_in_bed, self.temp_wd)
+        if self.ref_pack:  # isoforms and U12 files were checked when the pack was built
+            pack_err = self.ref_pack.check_inputs(self.t_2bit, self.bed_input)
+            self.die(pack_err) if pack_err else None
+            self.isoforms = self.ref_pack.isoforms
+            self.u12 = self.ref_pack.u12
+        else:
+            self.isoforms = TogaSanityChecker.check_isoforms_file(self.isoforms_arg, t_in_bed, self.temp_wd)
+            self.u12 = TogaSanityChecker.check_and_write_u12_file(self.u12_arg, t_in_bed, self.temp_wd)
         TogaSanityChecker.check_2bit_file_completeness(self.t_2bit, chrom_sizes_in_bed, self.ref_bed)
         # need to check that chain chroms and their sizes match 2bit file data
         with open(self.chain_file, "r") as f:
@@ -338,6 +466,27 @@ class Toga:
         TogaSanityChecker.check_2bit_file_completeness(self.t_2bit, t_chrom_to_size, self.chain_file)
         TogaSanityChecker.check_2bit_file_completeness(self.q_2bit, q_chrom_to_size, self.chain_file)
 
+    def __load_ref_pack(self, args):
+        """Open reference pack, check that reference arguments do not conflict with it."""
+        pack_args = {
+            "--isoforms": args.isoforms,
+            "--u12": args.u12,
+            "--limit_to_ref_chrom": args.limit_to_ref_chrom,
+        }
+        for arg_name, arg_value in pack_args.items():
+            if arg_value:
+                self.die(
+                    f"Error! {arg_name} cannot be used with --ref_pack, "
+                    f"please set it when building the reference pack"
+                )
+        try:
+            ref_pack = ReferencePack(args.ref_pack)
+        except ValueError as err:
+            ref_pack = None
+            self.die(str(err))
+        to_log(f"Using reference pack {ref_pack.pack_dir}")
+        return ref_pack
+
     def die(self, msg, rc=1):
         """Show msg in stderr, exit with the rc given."""
         to_log(msg)
@@ -472,92 +621,19 @@ class Toga:
         if up_to_and_incl is not None:
             assert up_to_and_incl >= 0, \
                 f"up_to_and_incl is {up_to_and_incl} but must be >= 0"
+        last_step = self.STEPS_NUM - 1 if up_to_and_incl is None else up_to_and_incl
 
-        # 0) preparation:
-        # define the project name and mkdir for it
-        # move chain file filtered
-        # define initial values
-        # make indexed files for the chain
+        # steps are executed as a DAG, see STEP_DEPENDENCIES
+        # step 0 makes indexed files for the chain and bed
         self.__mark_start()
-        to_log("\n\n#### STEP 0: making chain and bed file indexes\n")
-        self.__make_indexed_chain()
-        self.__make_indexed_bed()
-        self.__time_mark("Made indexes")
-        if up_to_and_incl is not None and up_to_and_incl == 0: return None
-
-        # 1) make joblist for chain features extraction
-        to_log("\n\n#### STEP 1: Generate extract chain features jobs\n")
-        self.__split_chain_jobs()
-        self.__time_mark("Split chain jobs")
-        if up_to_and_incl is not None and up_to_and_incl == 1: return None
+        self.__init_resume()
+        self.__run_steps([x for x in range(self.STEPS_NUM) if x <= last_step])
+        if last_step < self.STEPS_NUM - 1:
+            return None
 
-        # 2) extract chain features: parallel process
-        to_log("\n\n#### STEP 2: Extract chain features: parallel step\n")
-        self.__extract_chain_features()
-        self.__time_mark("Chain jobs done")
-        to_log(f"Logs from individual chain runner jobs are show below")
-        self.__collapse_logs("chain_runner_")
-        if up_to_and_incl is not None and up_to_and_incl == 2: return None
-
-        # 3) create chain features dataset
-        to_log("\n\n#### STEP 3: Merge step 2 output\n")
-        self.__merge_chains_output()
-        self.__time_mark("Chains output merged")
-        if up_to_and_incl is not None and up_to_and_incl == 3: return None
-
-        # 4) classify chains as orthologous, paralogous, etc. using xgboost
-        to_log("\n\n#### STEP 4: Classify chains using gradient boosting model\n")
-        self.__classify_chains()
-        self.__time_mark("Chains classified")
-        if up_to_and_incl is not None and up_to_and_incl == 4: return None
-
-        # 5) create cluster jobs for CESAR2.0
-        to_log("\n\n#### STEP 5: Generate CESAR jobs")
-        # experimental feature, not publically available:
-        self.__split_cesar_jobs()
-        self.__time_mark("Split cesar jobs done")
-        if up_to_and_incl is not None and up_to_and_incl == 5: return None
-
-        # 6) Create bed track for processed pseudogenes
-        to_log("\n\n#### STEP 6: Create processed pseudogenes track\n")
-        self.__get_proc_pseudogenes_track()
-        if up_to_and_incl is not None and up_to_and_incl == 6: return None
-
-        # 7) call CESAR jobs: parallel step
-        to_log("\n\n### STEP 7: Execute CESAR jobs: parallel step\n")
-        self.__run_cesar_jobs()
-        self.__time_mark("Cesar jobs done")
-        self.__check_cesar_completeness()
-        to_log(f"Logs from individual CESAR jobs are show below")
-        self.__collapse_logs("cesar_")
-        if up_to_and_incl is not None and up_to_and_incl == 7: return None
-
-        # 8) parse CESAR output, create bed / fasta files
-        to_log("\n\n#### STEP 8: Merge STEP 7 output\n")
-        self.__merge_cesar_output()
-        self.__time_mark("Merged cesar output")
-        if up_to_and_incl is not None and up_to_and_incl == 8: return None
-
-        # 9) classify projections/genes as lost/intact
-        # also measure projections confidence levels
-        to_log("\n\n#### STEP 9: Gene loss pipeline classification\n")
-        # self.__transcript_quality()  # maybe remove -> not used anywhere
-        self.__gene_loss_summary()
-        self.__time_mark("Got gene loss summary")
-        if up_to_and_incl is not None and up_to_and_incl == 9: return None
-
-        # 10) classify genes as one2one, one2many, etc orthologs
-        to_log("\n\n#### STEP 10: Create orthology relationships table\n")
-        self.__orthology_type_map()
-        if up_to_and_incl is not None and up_to_and_incl == 10: return None
-
-        # 11) merge logs containing information about skipped genes,transcripts, etc.
-        to_log("\n\n#### STEP 11: Cleanup: merge parallel steps output files")
-        self.__merge_split_files()
+        # Everything is done
         shutil.rmtree(self.log_dir)
         self.__check_crashed_cesar_jobs()
-        # Everything is done
-
         if not self.cesar_ok_merged:
             cesar_not_ok_message = (
                 f"PLEASE NOTE:\nCESAR RESULTS ARE LIKELY INCOMPLETE"
@@ -568,8 +644,99 @@ class Toga:
         tot_runtime = dt.now() - self.t0
         self.__left_done_mark()
         self.__time_mark("Everything is done")
+        to_log(f"Resource usage of steps and jobs saved to {self.resource_usage_tsv}")
         to_log(f"TOGA pipeline is done in {tot_runtime}")
 
+    def __get_steps(self):
+        """Get step: (title, function, time mark message) dict."""
+        return {
+            0: ("making chain and bed file indexes", self.__make_indexes, "Made indexes"),
+            1: ("Generate extract chain features jobs", self.__split_chain_jobs, "Split chain jobs"),
+            2: ("Extract chain features: parallel step", self.__run_chain_jobs_step, "Chain jobs done"),
+            3: ("Merge step 2 output", self.__merge_chains_output, "Chains output merged"),
+            4: ("Classify chains using gradient boosting model", self.__classify_chains, "Chains classified"),
+            5: ("Generate CESAR jobs", self.__split_cesar_jobs, "Split cesar jobs done"),
+            6: ("Create processed pseudogenes track", self.__get_proc_pseudogenes_track, None),
+            7: ("Execute CESAR jobs: parallel step", self.__run_cesar_jobs_step, "Cesar jobs done"),
+            8: ("Merge STEP 7 output", self.__merge_cesar_output, "Merged cesar output"),
+            9: ("Gene loss pipeline classification", self.__gene_loss_summary, "Got gene loss summary"),
+            10: ("Create orthology relationships table", self.__orthology_type_map, None),
+            11: ("Cleanup: merge parallel steps output files", self.__merge_split_files, None),
+        }
+
+    def __run_steps(self, steps):
+        """Execute steps as a DAG, each step starts when the steps it depends on are done.
+
+        Independent steps are executed concurrently in threads,
+        for example, processed pseudogenes track is created while
+        CESAR jobs are running.
+        """
+        steps_funcs = self.__get_steps()
+        done = set()
+        running = {}  # future: step
+        for step in steps:
+            if not self.__step_to_run(step):
+                done.add(step)
+        try:
+            while len(done) < len(steps):
+                ready = [
+                    x for x in steps
+                    if x not in done and x not in running.values()
+                    and all(d in done for d in self.STEP_DEPENDENCIES[x])
+                ]
+                for step in ready:
+                    running[self.__start_step(step, *steps_funcs[step])] = step
+                finished, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()  # raises the step exception, if any
+                    done.add(running.pop(future))
+        except BaseException:
+            # Ctrl-C or a failed step: kill the jobs of the running steps
+            # and exit without waiting for them, their threads are daemons
+            TogaUtil.terminate_parallel_processes(self.jobs_managers) if running else None
+            raise
+
+    def __start_step(self, step, title, func, time_mark):
+        """Execute the step in a daemon thread, return its future."""
+        future = Future()
+
+        def run_step():
+            try:
+                future.set_result(self.__run_step(step, title, func, time_mark))
+            except BaseException as exc:  # die() raises SystemExit
+                future.set_exception(exc)
+
+        threading.Thread(target=run_step, name=f"step_{step}", daemon=True).start()
+        return future
+
+    def __run_step(self, step, title, func, time_mark):
+        """Execute the step and save its completion mark."""
+        to_log(f"\n\n#### STEP {step}: {title}\n")
+        self.steps_usage.start(step)
+        func()
+        if time_mark:
+            self.__time_mark(time_mark)
+        self.__mark_step_done(step)
+
+    def __make_indexes(self):
+        """Make chain and bed file indexes."""
+        self.__make_indexed_chain()
+        self.__make_indexed_bed()
+
+    def __run_chain_jobs_step(self):
+        """Extract chain features, collect the jobs logs."""
+        self.__extract_chain_features()
+        to_log(f"Logs from individual chain runner jobs are show below")
+        self.__collapse_logs("chain_runner_")
+
+    def __run_cesar_jobs_step(self):
+        """Execute CESAR jobs, check that all of them are done, collect the jobs logs."""
+        self.__run_cesar_jobs()
+        self.__check_cesar_completeness()
+        self.__evict_cesar_cache()
+        to_log(f"Logs from individual CESAR jobs are show below")
+        self.__collapse_logs("cesar_")
+
     def __collapse_logs(self, prefix):
         """Merge logfiles starting with prefix into a single log."""
         log_filenames_with_prefix = [x for x in os.listdir(self.log_dir) if x.startswith(prefix)]
@@ -583,6 +750,44 @@ class Toga:
             in_f.close()
         log_f.close()
 
+    def __init_resume(self):
+        """Find the first step to execute, restore state saved by the completed steps."""
+        if self.resume:
+            self.manifest.load()
+            self.resume_step = self.manifest.get_resume_step(self.STEPS_NUM, self.STEP_DEPENDENCIES)
+            for step in range(self.resume_step):
+                self.__dict__.update(self.manifest.get_state(step))
+            # CESAR jobs were not re-created: can skip the jobs done by the previous run
+            self.skip_done_cesar_jobs = self.resume_step > self.CESAR_JOBS_SPLIT_STEP
+            to_log(f"Resuming TOGA run from step {self.resume_step}")
+        self.manifest.reset(from_step=self.resume_step)
+
+    def __step_to_run(self, step):
+        """Check whether the step must be executed."""
+        if step >= self.resume_step:
+            return True
+        to_log(f"Step {step} was completed by the previous run, skipping")
+        return False
+
+    def __mark_step_done(self, step):
+        """Save the step completion mark, inputs, outputs and state to the manifest."""
+        input_attrs, output_attrs, state_attrs = self.STEP_DATA[step]
+        inputs = [getattr(self, x) for x in input_attrs]
+        outputs = [getattr(self, x) for x in output_attrs if os.path.exists(getattr(self, x))]
+        stat_inputs = [getattr(self, x) for x in self.STEP_STAT_INPUTS.get(step, [])]
+        state = {x: getattr(self, x) for x in state_attrs}
+        state["temp_files"] = list(self.temp_files)
+        # if the table is not saved, the step 4 cannot start without the merge step
+        in_memory = step == self.CHAIN_FEATURES_MERGE_STEP and not os.path.isfile(self.chain_results_df)
+        with self.steps_lock:  # concurrent steps can finish at the same time
+            self.manifest.mark_done(
+                step, inputs, outputs, state, in_memory=in_memory, stat_inputs=stat_inputs
+            )
+            self.steps_usage.stop(step)
+            self.steps_usage.save_report(
+                self.resource_usage_json, self.resource_usage_tsv, self.jobs_usage_dir
+            )
+
     def __mark_start(self):
         """Indicate that TOGA process have started."""
         p_ = os.path.join(self.wd, Constants.RUNNING)
@@ -622,6 +827,9 @@ class Toga:
 
     def __make_indexed_bed(self):
         """Create gene_ID: bed line bdb indexed file."""
+        if self.ref_pack:
+            to_log(f"Bed file index is taken from the reference pack: {self.index_bed_file}")
+            return
         to_log("Started bed file indexing...")
         bed_hdf5_index(self.ref_bed, self.index_bed_file)
         self.temp_files.append(self.index_bed_file)
@@ -651,6 +859,7 @@ class Toga:
             f"{self.index_bed_file} "
             f"--log_file {self.log_file} "
             f"--parallel_logs_dir {self.log_dir} "
+            f"--stats_dir {self.jobs_usage_dir} "
             f"--jobs_num {self.chain_jobs} "
             f"--jobs {self.ch_cl_jobs} "
             f"--jobs_file {self.chain_cl_jobs_combined} "
@@ -683,21 +892,27 @@ class Toga:
             "keep_nf_logs": self.keep_nf_logs,
             "nextflow_config_dir": self.nextflow_config_dir,
             "temp_wd": self.temp_wd,
-            "queue_name": self.cluster_queue_name
+            "queue_name": self.cluster_queue_name,
+            "local_pool_size": self.local_pool_size,
+            "local_memory_limit": self.local_memory_limit
         }
 
         # Execute jobs via the Strategy pattern
         jobs_manager = self.__get_paralellizer(self.para_strategy)
-        try:
-            jobs_manager.execute_jobs(self.chain_cl_jobs_combined, manager_data, project_name, wait=True)
-        except KeyboardInterrupt:
-            TogaUtil.terminate_parallel_processes([jobs_manager, ])
+        jobs_manager.execute_jobs(self.chain_cl_jobs_combined, manager_data, project_name, wait=True)
 
     def __merge_chains_output(self):
         """Call parse results."""
         # define where to save intermediate table
-        merge_chains_output(
-            self.ref_bed, self.isoforms, self.chain_class_results, self.chain_results_df
+        # chain features are also returned as a dataframe -> no need to read the table again
+        # the table itself is needed for debugging, training new models and UCSC plugin
+        save_table = self.keep_temp or self.stop_at_chain_class
+        self.chain_features = merge_chains_output(
+            self.ref_bed,
+            self.isoforms,
+            self.chain_class_results,
+            self.chain_results_df,
+            save_table=save_table,
         )
         # .append(self.chain_results_df)  -> UCSC plugin needs that
 
@@ -715,11 +930,22 @@ class Toga:
         cl_rej_log = os.path.join(self.rejected_dir, "classify_chains_rejected.txt")
         ld_arg_ = self.ld_model if self.ld_model_arg else None
 
-        if not os.path.isfile(self.se_model) or not os.path.isfile(self.me_model):
+        # models exported to plain trees do not depend on XGBoost version
+        se_model_json = self.se_model.replace(".dat", ".json")
+        me_model_json = self.me_model.replace(".dat", ".json")
+        if os.path.isfile(se_model_json) and os.path.isfile(me_model_json):
+            self.se_model = se_model_json
+            self.me_model = me_model_json
+        elif not os.path.isfile(self.se_model) or not os.path.isfile(self.me_model):
             call_process(self.MODEL_TRAINER, "Models not found, training...")
+            self.se_model = se_model_json
+            self.me_model = me_model_json
 
+        chain_features = (
+            self.chain_features if self.chain_features is not None else self.chain_results_df
+        )
         classify_chains(
-            self.chain_results_df,
+            chain_features,
             self.transcript_to_chain_classes,
             self.se_model,
             self.me_model,
@@ -734,14 +960,14 @@ class Toga:
 
         if self.stop_at_chain_class:
             self.die("User requested to halt TOGA after chain features extraction", rc=0)
-        TogaSanityChecker.check_chains_classified(self.chain_results_df)
+        TogaSanityChecker.check_chains_classified(self.chain_results_df, self.chain_features)
+        self.chain_features = None  # not needed anymore
 
     def __get_proc_pseudogenes_track(self):
         """Create annotation of processed genes in query."""
         to_log("Creating processed pseudogenes track.")
-        proc_pgenes_track = os.path.join(self.wd, "proc_pseudogenes.bed")
         create_ppgene_track(
-            self.pred_scores, self.chain_file, self.index_bed_file, proc_pgenes_track
+            self.pred_scores, self.chain_file, self.index_bed_file, self.proc_pgenes_track
         )
 
     def __split_cesar_jobs(self):
@@ -750,7 +976,7 @@ class Toga:
             to_log("Detecting fragmented transcripts")
             # need to stitch fragments together
             gene_fragments = stitch_scaffolds(
-                self.chain_file, self.pred_scores, self.ref_bed, True
+                self.chain_file, self.pred_scores, self.ref_bed, True, self.stitch_processes
             )
             fragm_dict_file = os.path.join(self.temp_wd, "gene_fragments.txt")
             f = open(fragm_dict_file, "w")
@@ -798,6 +1024,7 @@ class Toga:
             f"--buckets {self.cesar_buckets} "
             f"--mem_limit {self.cesar_mem_limit} "
             f"--chains_limit {self.cesar_chain_limit} "
+            f"--processes {self.cesar_split_processes} "
             f"--skipped_genes {skipped_path} "
             f"--rejected_log {self.rejected_dir} "
             f"--cesar_binary {self.cesar_binary} "
@@ -807,8 +1034,11 @@ class Toga:
             f"--unprocessed_log {self.technical_cesar_err} "
             f"--log_file {self.log_file} "
             f"--cesar_logs_dir {self.log_dir} "
+            f"--stats_dir {self.jobs_usage_dir} "
             f"{'--quiet' if self.quiet else ''}"
         )
+        if self.cesar_cache_dir:
+            split_cesar_cmd += f" --cesar_cache {self.cesar_cache_dir}"
 
         if self.annotate_paralogs:  # very rare occasion
             split_cesar_cmd += f" --annotate_paralogs"
@@ -820,6 +1050,8 @@ class Toga:
         split_cesar_cmd = (
             split_cesar_cmd + f" --u12 {self.u12}" if self.u12 else split_cesar_cmd
         )
+        if self.ref_pack:
+            split_cesar_cmd += f" --ref_exons {self.ref_pack.ref_exons}"
         split_cesar_cmd = (
             split_cesar_cmd + " --o2o_only" if self.o2o_only else split_cesar_cmd
         )
@@ -832,9 +1064,22 @@ class Toga:
             split_cesar_cmd += f" --fragments_data {fragm_dict_file}"
         call_process(split_cesar_cmd, "Could not split CESAR jobs!")
 
+    @staticmethod
+    def __cesar_job_is_done(line_data):
+        """Check whether the previous run executed the CESAR joblist.
+
+        cesar_runner.py writes the rejection log last.
+        """
+        rejected_log = line_data[line_data.index("--rejected_log") + 1]
+        return os.path.isfile(rejected_log)
+
     def __get_cesar_jobs_for_bucket(self, comb_file, bucket_req):
-        """Extract all cesar jobs belong to the bucket."""
+        """Extract all cesar jobs belong to the bucket.
+
+        If bucket_req is None, extract jobs of all buckets.
+        """
         lines = []
+        done_num = 0
         f = open(comb_file, "r")
         for line in f:
             line_data = line.split()
@@ -846,16 +1091,23 @@ class Toga:
             jobs = line_data[1]
             jobs_basename_data = os.path.basename(jobs).split("_")
             bucket = jobs_basename_data[-1]
-            if bucket_req != bucket:
+            if bucket_req is not None and bucket_req != bucket:
+                continue
+            if self.skip_done_cesar_jobs and self.__cesar_job_is_done(line_data):
+                done_num += 1
                 continue
             lines.append(line)
         f.close()
+        if done_num > 0:
+            to_log(f"Skipping {done_num} CESAR joblists executed by the previous run")
         return "".join(lines)
 
     def __locate_joblist_abspath(self, b):
-        if b != 0:  # extract jobs related to this bucket (if it's not 0)
+        if b != 0 or self.skip_done_cesar_jobs:
+            # extract jobs related to this bucket (if it's not 0)
+            # and not executed by the previous run
             bucket_tasks = self.__get_cesar_jobs_for_bucket(
-                self.cesar_combined, str(b)
+                self.cesar_combined, str(b) if b != 0 else None
             )
             if len(bucket_tasks) == 0:
                 to_log(f"There are no jobs in the {b}Gb bucket")
@@ -899,57 +1151,57 @@ class Toga:
         project_paths = []
         project_names = []
         jobs_managers = []
-        try:
-            timestamp = str(time.time()).split(".")[1]
-
-            if self.cesar_buckets == "0":
-                buckets = [0]
-            else:
-                buckets = [int(x) for x in self.cesar_buckets.split(",") if x != ""]
-            to_log(f"Pushing {len(buckets)} CESAR job lists")
-
-            for bucket in buckets:
-                to_log(f"Pushing memory bucket {bucket}Gb to the executor")
-                # 0 means that that buckets were not split
-                mem_lim = bucket if bucket != 0 else self.cesar_mem_limit
-
-                project_name = f"cesar_jobs__{self.project_name}_at_{timestamp}_q_{bucket}"
-                project_names.append(project_name)
-                joblist_abspath = self.__locate_joblist_abspath(bucket)
-
-                # Only run if bucket has jobs
-                if joblist_abspath:
-                    project_path = os.path.join(self.nextflow_dir, project_name)
-                    project_paths.append(project_path)
-    
-                    manager_data = {
-                        "project_name": project_name,
-                        "project_path": project_path,
-                        "logs_dir": project_path,
-                        "nextflow_dir": self.nextflow_dir,
-                        "NF_EXECUTE": self.NF_EXECUTE,
-                        "local_executor": self.local_executor,
-                        "keep_nf_logs": self.keep_nf_logs,
-                        "nextflow_config_dir": self.nextflow_config_dir,
-                        "temp_wd": self.temp_wd,
-                        "queue_name": self.cluster_queue_name
-                    }
-    
-                    jobs_manager = self.__get_paralellizer(self.para_strategy)
-                    jobs_manager.execute_jobs(joblist_abspath,
-                                              manager_data,
-                                              project_name,
-                                              memory_limit=mem_lim,
-                                              wait=self.exec_cesar_parts_sequentially)
-                    jobs_managers.append(jobs_manager)
-                    time.sleep(Constants.CESAR_PUSH_INTERVAL)
-
-            if self.exec_cesar_parts_sequentially is False:
-                monitor_jobs(jobs_managers)
-            self.__save_para_time_output_if_applicable(project_names)
-        except KeyboardInterrupt:
-            # to kill detached cluster jobs, just in case
-            TogaUtil.terminate_parallel_processes(jobs_managers)
+        timestamp = str(time.time()).split(".")[1]
+
+        if self.cesar_buckets == "0":
+            buckets = [0]
+        else:
+            buckets = [int(x) for x in self.cesar_buckets.split(",") if x != ""]
+        to_log(f"Pushing {len(buckets)} CESAR job lists")
+        if self.incremental_merge:
+            self.cesar_watcher = self.__get_cesar_watcher()
+
+        for bucket in buckets:
+            to_log(f"Pushing memory bucket {bucket}Gb to the executor")
+            # 0 means that that buckets were not split
+            mem_lim = bucket if bucket != 0 else self.cesar_mem_limit
+
+            project_name = f"cesar_jobs__{self.project_name}_at_{timestamp}_q_{bucket}"
+            project_names.append(project_name)
+            joblist_abspath = self.__locate_joblist_abspath(bucket)
+
+            # Only run if bucket has jobs
+            if joblist_abspath:
+                project_path = os.path.join(self.nextflow_dir, project_name)
+                project_paths.append(project_path)
+
+                manager_data = {
+                    "project_name": project_name,
+                    "project_path": project_path,
+                    "logs_dir": project_path,
+                    "nextflow_dir": self.nextflow_dir,
+                    "NF_EXECUTE": self.NF_EXECUTE,
+                    "local_executor": self.local_executor,
+                    "keep_nf_logs": self.keep_nf_logs,
+                    "nextflow_config_dir": self.nextflow_config_dir,
+                    "temp_wd": self.temp_wd,
+                    "queue_name": self.cluster_queue_name,
+                    "local_pool_size": self.local_pool_size,
+                    "local_memory_limit": self.local_memory_limit
+                }
+
+                jobs_manager = self.__get_paralellizer(self.para_strategy)
+                jobs_manager.execute_jobs(joblist_abspath,
+                                          manager_data,
+                                          project_name,
+                                          memory_limit=mem_lim,
+                                          wait=self.exec_cesar_parts_sequentially)
+                jobs_managers.append(jobs_manager)
+
+        if self.exec_cesar_parts_sequentially is False:
+            on_poll = self.cesar_watcher.poll if self.cesar_watcher else None
+            monitor_jobs(jobs_managers, max_interval=self.max_poll_interval, on_poll=on_poll)
+        self.__save_para_time_output_if_applicable(project_names)
 
     def __rebuild_crashed_jobs(self, crashed_jobs):
         """If TOGA has to re-run CESAR jobs we still need some buckets."""
@@ -1032,62 +1284,65 @@ class Toga:
         project_paths = []
         err_log_files = []
 
-        try:
-            for bucket, jobs in bucket_to_jobs.items():
-                mem_lim = bucket if bucket != 0 and bucket else self.cesar_mem_limit
-                to_log(f"!!RERUN CESAR JOBS: Pushing {len(jobs)} jobs into {bucket} GB queue")
-                batch_path = f"_cesar_rerun_batch_{bucket}"
-                bucket_batch_file = os.path.join(self.wd, batch_path)
-                batch_commands = []
-                for num, job in enumerate(jobs, 1):
-                    job_file = f"rerun_job_{num}_{bucket}"
-                    job_path = os.path.join(temp_jobs_dir, job_file)
-                    f = open(job_path, "w")
-                    f.write(job)
-                    f.write("\n")
-                    f.close()
-                    out_filename = f"rerun_job_{num}_{bucket}.txt"
-                    output_path = os.path.join(self.cesar_results, out_filename)
-                    inact_path = os.path.join(self.gene_loss_data, out_filename)
-                    rejected = os.path.join(self.rejected_dir_rerun, out_filename)
-                    err_log_files.append(rejected)
-                    batch_cmd = Constants.CESAR_RUNNER_TMP.format(
-                        Constants.CESAR_RUNNER, job_path, output_path, inact_path, rejected
-                    )
-                    batch_commands.append(batch_cmd)
-                f = open(bucket_batch_file, "w")
-                f.write("\n".join(batch_commands))
+        for bucket, jobs in bucket_to_jobs.items():
+            mem_lim = bucket if bucket != 0 and bucket else self.cesar_mem_limit
+            to_log(f"!!RERUN CESAR JOBS: Pushing {len(jobs)} jobs into {bucket} GB queue")
+            batch_path = f"_cesar_rerun_batch_{bucket}"
+            bucket_batch_file = os.path.join(self.wd, batch_path)
+            batch_commands = []
+            for num, job in enumerate(jobs, 1):
+                job_file = f"rerun_job_{num}_{bucket}"
+                job_path = os.path.join(temp_jobs_dir, job_file)
+                f = open(job_path, "w")
+                f.write(job)
                 f.write("\n")
                 f.close()
+                out_filename = f"rerun_job_{num}_{bucket}.txt"
+                output_path = os.path.join(self.cesar_results, out_filename)
+                inact_path = os.path.join(self.gene_loss_data, out_filename)
+                rejected = os.path.join(self.rejected_dir_rerun, out_filename)
+                err_log_files.append(rejected)
+                batch_cmd = Constants.CESAR_RUNNER_TMP.format(
+                    Constants.CESAR_RUNNER, job_path, output_path, inact_path, rejected
+                )
+                if self.cesar_cache_dir:
+                    batch_cmd += f" --cesar_cache {self.cesar_cache_dir}"
+                stats_file = os.path.join(self.jobs_usage_dir, f"cesar_rerun_job_{num}_{bucket}.json")
+                batch_cmd += f" --stats_file {stats_file}"
+                batch_commands.append(batch_cmd)
+            f = open(bucket_batch_file, "w")
+            f.write("\n".join(batch_commands))
+            f.write("\n")
+            f.close()
 
-                project_name = f"cesar_jobs__RERUN_{self.project_name}_at_{timestamp}_q_{bucket}"
-                project_path = os.path.join(self.nextflow_dir, project_name)
-                project_paths.append(project_path)
-
-                manager_data = {
-                    "project_name": project_name,
-                    "project_path": project_path,
-                    "logs_dir": project_path,
-                    "nextflow_dir": self.nextflow_dir,
-                    "NF_EXECUTE": self.NF_EXECUTE,
-                    "local_executor": self.local_executor,
-                    "keep_nf_logs": self.keep_nf_logs,
-                    "nextflow_config_dir": self.nextflow_config_dir,
-                    "temp_wd": self.temp_wd,
-                    "queue_name": self.cluster_queue_name
-                }
-                jobs_manager = self.__get_paralellizer(self.para_strategy)
-                jobs_manager.execute_jobs(bucket_batch_file,
-                                          manager_data,
-                                          project_name,
-                                          memory_limit=mem_lim,
-                                          wait=self.exec_cesar_parts_sequentially)
-                jobs_managers.append(jobs_manager)
-                time.sleep(Constants.CESAR_PUSH_INTERVAL)
-            to_log(f"Monitoring CESAR jobs rerun")
-            monitor_jobs(jobs_managers, die_if_sc_1=False)  # todo: come up with a better strategy here
-        except KeyboardInterrupt:
-            TogaUtil.terminate_parallel_processes(jobs_managers)
+            project_name = f"cesar_jobs__RERUN_{self.project_name}_at_{timestamp}_q_{bucket}"
+            project_path = os.path.join(self.nextflow_dir, project_name)
+            project_paths.append(project_path)
+
+            manager_data = {
+                "project_name": project_name,
+                "project_path": project_path,
+                "logs_dir": project_path,
+                "nextflow_dir": self.nextflow_dir,
+                "NF_EXECUTE": self.NF_EXECUTE,
+                "local_executor": self.local_executor,
+                "keep_nf_logs": self.keep_nf_logs,
+                "nextflow_config_dir": self.nextflow_config_dir,
+                "temp_wd": self.temp_wd,
+                "queue_name": self.cluster_queue_name,
+                "local_pool_size": self.local_pool_size,
+                "local_memory_limit": self.local_memory_limit
+            }
+            jobs_manager = self.__get_paralellizer(self.para_strategy)
+            jobs_manager.execute_jobs(bucket_batch_file,
+                                      manager_data,
+                                      project_name,
+                                      memory_limit=mem_lim,
+                                      wait=self.exec_cesar_parts_sequentially)
+            jobs_managers.append(jobs_manager)
+        to_log(f"Monitoring CESAR jobs rerun")
+        # todo: come up with a better strategy here
+        monitor_jobs(jobs_managers, die_if_sc_1=False, max_interval=self.max_poll_interval)
 
         # need to check whether anything crashed again
         to_log("!!Checking whether any CESAR jobs crashed twice")
@@ -1110,14 +1365,17 @@ class Toga:
         to_log(err_msg)
         self.die(err_msg, 1)
 
-    def __merge_cesar_output(self):
-        """Merge CESAR output, save final fasta and bed."""
-        to_log("Merging CESAR output to make fasta and bed files.")
-        merge_c_stage_skipped = os.path.join(self.rejected_dir, "CESAR_MERGE.txt")
-        self.temp_files.append(self.intermediate_bed)
+    def __evict_cesar_cache(self):
+        """Keep CESAR cache size within the limit."""
+        if self.cesar_cache_dir is None:
+            return
+        evict_cesar_cache(self.cesar_cache_dir, self.cesar_cache_size)
 
-        all_ok = merge_cesar_output(
-            self.cesar_results,
+    def __get_cesar_watcher(self):
+        """Create watcher that merges output of finished CESAR jobs."""
+        to_log("CESAR output is merged while CESAR jobs are running")
+        merge_c_stage_skipped = os.path.join(self.rejected_dir, "CESAR_MERGE.txt")
+        merger = CesarOutputMerger(
             self.intermediate_bed,
             self.nucl_fasta,
             self.meta_data,
@@ -1127,6 +1385,29 @@ class Toga:
             self.trash_exons,
             fragm_data=self.bed_fragm_exons_data,
         )
+        return CesarResultsWatcher(merger, self.cesar_results, self.gene_loss_data, self.rejected_dir)
+
+    def __merge_cesar_output(self):
+        """Merge CESAR output, save final fasta and bed."""
+        to_log("Merging CESAR output to make fasta and bed files.")
+        merge_c_stage_skipped = os.path.join(self.rejected_dir, "CESAR_MERGE.txt")
+        self.temp_files.append(self.intermediate_bed)
+
+        if self.cesar_watcher:
+            # most of the output is already merged
+            all_ok = self.cesar_watcher.finalize()
+        else:
+            all_ok = merge_cesar_output(
+                self.cesar_results,
+                self.intermediate_bed,
+                self.nucl_fasta,
+                self.meta_data,
+                merge_c_stage_skipped,
+                self.prot_fasta,
+                self.codon_fasta,
+                self.trash_exons,
+                fragm_data=self.bed_fragm_exons_data,
+            )
 
         # need to merge files containing transcripts that were not processed
         # for some technical reason, such as intersecting fragments in the query
@@ -1190,7 +1471,9 @@ class Toga:
             iforms_file=self.isoforms,
             paral=self.paralogs_log,
             predefined_class=predef_glp_classes,
+            loss_data=self.cesar_watcher.loss_data if self.cesar_watcher else None,
         )
+        self.cesar_watcher = None
 
     def __orthology_type_map(self):
         """Call orthology_type_map.py"""
@@ -1215,6 +1498,7 @@ class Toga:
             loss_data=self.loss_summ,
             save_skipped=skipped_ref_trans,
             orth_scores_arg=self.pred_scores,
+            processes=self.orthology_processes,
         )
 
     def __check_crashed_cesar_jobs(self):
@@ -1427,6 +1711,39 @@ def parse_args(arg_strs: list[str] = None):
             "a custom strategy implementation in the parallel_jobs_manager.py "
         )
     )
+    app.add_argument(
+        "--local_pool_size",
+        "--lps",
+        type=int,
+        default=None,
+        help=(
+            "Number of jobs to run simultaneously with the local parallelization "
+            "strategy. Default: number of CPU cores."
+        )
+    )
+    app.add_argument(
+        "--local_memory_limit",
+        "--lml",
+        type=float,
+        default=None,
+        help=(
+            "Memory available for jobs with the local parallelization strategy, Gb. "
+            "CESAR jobs are admitted according to their memory bucket. "
+            "Default: no limit."
+        )
+    )
+    app.add_argument(
+        "--max_poll_interval",
+        "--mpi",
+        type=int,
+        default=Constants.MONITOR_MAX_INTERVAL,
+        help=(
+            "Max interval between parallel jobs status checks, seconds. "
+            "The interval starts from 1 second and grows up to this value. "
+            "Local strategies and nextflow/para processes notify TOGA "
+            "when they are done, without waiting for the next check."
+        )
+    )
     # chain features related
     app.add_argument(
         "--chain_jobs_num",
@@ -1486,6 +1803,62 @@ def parse_args(arg_strs: list[str] = None):
             "depending on their memory requirements. See README.md for explanation."
         )
     )
+    app.add_argument(
+        "--incremental_merge",
+        "--im",
+        action="store_true",
+        dest="incremental_merge",
+        help=(
+            "Merge output of each CESAR job as soon as the job is done, "
+            "while the other CESAR jobs are still running."
+        )
+    )
+    app.add_argument(
+        "--cesar_cache_dir",
+        "--ccd",
+        default=None,
+        help=(
+            "Cache CESAR output in this directory and reuse it for the same "
+            "CESAR input, the directory can be shared between TOGA runs"
+        ),
+    )
+    app.add_argument(
+        "--cesar_cache_size",
+        "--ccs",
+        type=float,
+        default=100.0,
+        help=(
+            "CESAR cache size limit in Gb, the least recently used outputs are "
+            "removed after CESAR jobs are done (default 100)"
+        ),
+    )
+    app.add_argument(
+        "--profile_dir",
+        "--prd",
+        default=None,
+        help=(
+            "Profile a fraction of chain features extraction and CESAR wrapper jobs, "
+            "save the profiles and the slowest jobs to this directory. "
+            f"Use {sys.argv[0]} {PROFILE_SUMMARY_CMD} PROFILE_DIR to get the hotspots summary"
+        ),
+    )
+    app.add_argument(
+        "--profile_fraction",
+        "--prf",
+        type=float,
+        default=0.01,
+        help="Fraction of jobs to profile if --profile_dir is set (default 0.01)",
+    )
+    app.add_argument(
+        "--resume",
+        "--rs",
+        action="store_true",
+        dest="resume",
+        help=(
+            "Resume a crashed run in the same project directory: skip the steps "
+            f"completed according to {Constants.MANIFEST} and CESAR jobs that are done"
+        ),
+    )
     app.add_argument(
         "--cesar_exec_seq",
         "--ces",
@@ -1502,6 +1875,16 @@ def parse_args(arg_strs: list[str] = None):
             "chains. Recommended values are a 50-100."
         )
     )
+    app.add_argument(
+        "--cesar_split_processes",
+        "--csp",
+        type=int,
+        default=None,
+        help=(
+            "Number of processes to compute query loci of transcripts before "
+            "creating CESAR jobs. Default: number of CPU cores."
+        )
+    )
     app.add_argument(
         "--cesar_mem_limit",
         type=int,
@@ -1515,6 +1898,17 @@ def parse_args(arg_strs: list[str] = None):
         help="File to save timings of different steps.",
     )
     app.add_argument("--u12", default=None, help="U12 introns data")
+    app.add_argument(
+        "--ref_pack",
+        "--rp",
+        default=None,
+        help=(
+            "Reference pack directory: filtered and indexed annotation, isoforms, "
+            "U12 data and reference exon sequences precomputed once for many query "
+            f"genomes. Build it with {sys.argv[0]} {BUILD_REF_PACK_CMD}; bed_input and "
+            "tDB must be the files the pack was built from."
+        ),
+    )
     app.add_argument(
         "--stop_at_chain_class",
         "--sac",
@@ -1545,6 +1939,26 @@ def parse_args(arg_strs: list[str] = None):
         action="store_true",
         help="Disable assembling query genes from pieces",
     )
+    app.add_argument(
+        "--stitch_processes",
+        "--sp",
+        type=int,
+        default=None,
+        help=(
+            "Number of processes to find chains of fragmented transcripts. "
+            "Default: number of CPU cores."
+        )
+    )
+    app.add_argument(
+        "--orthology_processes",
+        "--orp",
+        type=int,
+        default=None,
+        help=(
+            "Number of processes to resolve large many2many orthology clusters. "
+            "Default: number of CPU cores."
+        )
+    )
     app.add_argument(
         "--ld_model",
         dest="ld_model",
@@ -1589,8 +2003,80 @@ def parse_args(arg_strs: list[str] = None):
     return args
 
 
+def parse_profile_summary_args(arg_strs):
+    """Parse arguments of the profile summary command."""
+    app = argparse.ArgumentParser(
+        prog=f"{sys.argv[0]} {PROFILE_SUMMARY_CMD}",
+        description="Aggregate job profiles saved with --profile_dir into a hotspots summary",
+    )
+    app.add_argument("profile_dir", help="Directory set as --profile_dir")
+    app.add_argument("--top", type=int, default=30, help="Number of functions and jobs to show")
+    app.add_argument(
+        "--sort",
+        default="tottime",
+        choices=["tottime", "cumulative", "ncalls"],
+        help="Sort functions by this field",
+    )
+    app.add_argument("--output", "-o", default=None, help="Save summary to file, stdout as default")
+    return app.parse_args(arg_strs)
+
+
+def profile_summary(arg_strs):
+    """Print hotspots summary of the profiled jobs."""
+    args = parse_profile_summary_args(arg_strs)
+    summary = summarize_profiles(args.profile_dir, top=args.top, sort_key=args.sort)
+    if args.output:
+        f = open(args.output, "w")
+        f.write(summary)
+        f.close()
+    else:
+        sys.stdout.write(summary)
+
+
+def parse_build_ref_pack_args(arg_strs):
+    """Parse arguments of the reference pack build command."""
+    app = argparse.ArgumentParser(
+        prog=f"{sys.argv[0]} {BUILD_REF_PACK_CMD}",
+        description="Precompute reference-only data once, to use it in runs against "
+                    "many query genomes with --ref_pack",
+    )
+    app.add_argument("bed_input", help="Bed file with annotations for the target genome.")
+    app.add_argument("tDB", help="Reference genome sequence in 2bit format.")
+    app.add_argument("pack_dir", help="Save reference pack to this directory")
+    app.add_argument("--isoforms", "-i", default=None, help="Path to isoforms data file")
+    app.add_argument("--u12", default=None, help="U12 introns data")
+    app.add_argument(
+        "--limit_to_ref_chrom",
+        default=None,
+        help="Find orthologs for a single reference chromosome only",
+    )
+    app.add_argument("--quiet", "-q", action="store_true", help="Don't print to console")
+    return app.parse_args(arg_strs)
+
+
+def build_ref_pack(arg_strs):
+    """Build reference pack."""
+    args = parse_build_ref_pack_args(arg_strs)
+    setup_logger(None, write_to_console=not args.quiet)
+    os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
+    build_reference_pack(
+        args.tDB,
+        args.bed_input,
+        args.pack_dir,
+        isoforms=args.isoforms,
+        u12=args.u12,
+        only_chrom=args.limit_to_ref_chrom,
+    )
+
+
 def main():
     """Entry point."""
+    if len(sys.argv) > 1 and sys.argv[1] == PROFILE_SUMMARY_CMD:
+        profile_summary(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == BUILD_REF_PACK_CMD:
+        build_ref_pack(sys.argv[2:])
+        return
     args = parse_args()
     toga_manager = Toga(args)
     toga_manager.run()
@@ -8,6 +8,7 @@ from sklearn.model_selection import StratifiedKFold
 from sklearn.model_selection import cross_val_score
 import joblib
 from constants import Constants
+from modules.tree_model import export_model
 from version import __version__
 
 
@@ -38,6 +39,10 @@ def train_on(x, y, save_to, name=None):
     print("Accuracy: {0:.3f} {1:.3f}".format(results.mean() * 100, results.std() * 100))
     joblib.dump(model, save_to)  # save the model
     print(f"Model saved to: {save_to}")
+    # plain trees: applied without XGBoost, see modules/tree_model.py
+    json_save_to = os.path.splitext(save_to)[0] + ".json"
+    export_model(model, json_save_to)
+    print(f"Model exported to: {json_save_to}")
 
 
 # load dataset, defile where is what: input and output files